@@ -6,6 +6,8 @@ BUILD_FOLDER=${2}
 IMAGE_NAME=${3}
 IMAGE_URI=${4}
 TARGET_AWS_REGION=${5}
+# Any further arguments are files shared from other folders
+SHARED_FILES=("${@:6}")
 MYTAG=$(date +%Y%m%d%H%M%S)
 
 # Check that git is installed
@@ -50,6 +52,17 @@ for CTR in {1..5}; do
     exit 1
 done
 
+# Shared files are copied into a copy of the build folder, so they exist in one place only
+if [ ${#SHARED_FILES[@]} -gt 0 ]; then
+    BUILD_CONTEXT=$(mktemp -d)
+    trap 'rm -rf "${BUILD_CONTEXT}"' EXIT
+    cp -R ${BUILD_FOLDER}/. ${BUILD_CONTEXT} && cp "${SHARED_FILES[@]}" ${BUILD_CONTEXT} || {
+        echo 'ERROR: copying shared files failed'
+        exit 1
+    }
+    BUILD_FOLDER=${BUILD_CONTEXT}
+fi
+
 # Build image
 docker build --no-cache -t ${IMAGE_NAME} ${BUILD_FOLDER} --platform linux/amd64 || {
     echo 'ERROR: docker build faied'
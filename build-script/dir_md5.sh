@@ -4,6 +4,8 @@
 
 # List of arguments
 build_folder=${1}
+# Files shared from other folders, copied into the build at build time
+shared_files="${@:2}"
 
 # Linux has command md5sum and OSX has command md5
 if command -v md5sum >/dev/null 2>&1; then
@@ -16,7 +18,7 @@ else
 fi
 
 # Take md5 from each object inside the program and then take a md5 of that output
-md5_output="$(eval ${MD5_PROGRAM} $build_folder/** | ${MD5_PROGRAM})"
+md5_output="$(eval ${MD5_PROGRAM} $build_folder/** $shared_files | ${MD5_PROGRAM})"
 
 # Output result as JSON back to terraform
 echo "{ \"md5\": \"${md5_output}\" }"
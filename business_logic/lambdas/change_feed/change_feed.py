@@ -0,0 +1,373 @@
+import json
+import boto3
+import os
+import random
+import threading
+import time
+import functools
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+# Feed items share the cluster table, in a partition of their own
+FEED_PK = "#CHANGE_FEED#"
+HEAD_SK = "#HEAD#"
+VERSION_PREFIX = "VERSION#"
+# Metadata attributes the cluster list shows, carried whole in every change
+FEED_FIELDS = [
+    "is_cluster",
+    "number_of_articles",
+    "description",
+    "generated_summary",
+    "summary_count",
+    "updated_at",
+]
+# Serialized changes per log entry, well under the 400 KB item limit
+MAX_ENTRY_BYTES = 300 * 1024
+MAX_CONFLICT_RETRIES = 10
+
+deserializer = TypeDeserializer()
+serializer = TypeSerializer()
+
+
+class FeedContention(Exception):
+    """
+    Raised when no version could be claimed, the stream batch is then retried.
+    """
+
+
+# Clients are created on first use and reused by later invocations in the container
+@functools.lru_cache(maxsize=None)
+def get_client(service_name):
+    return boto3.client(service_name)
+
+
+def version_key(version):
+    # Zero padded so sort keys order like the versions
+    return f"{VERSION_PREFIX}{version:012d}"
+
+
+def json_value(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == int(value) else float(value)
+    return value
+
+
+def plain_image(image):
+    return {name: deserializer.deserialize(value) for name, value in image.items()}
+
+
+def cluster_changes(records):
+    """
+    Turns stream records of metadata items into one change per cluster.
+
+    A change carries the cluster's FEED_FIELDS as they are now, so applying it
+    twice does no harm. kinds says what moved: new_cluster, count, summary or
+    removed. Records that touch none of the fields, such as centroid and
+    summary snapshot updates, are left out.
+    """
+    changes = {}
+    for record in records:
+        keys = record["dynamodb"]["Keys"]
+        if not keys["SK"]["S"].startswith("#METADATA#"):
+            continue
+        new = plain_image(record["dynamodb"].get("NewImage", {}))
+        old = plain_image(record["dynamodb"].get("OldImage", {}))
+
+        kinds = []
+        if record["eventName"] == "INSERT":
+            kinds.append("new_cluster")
+        elif record["eventName"] == "REMOVE":
+            kinds.append("removed")
+        else:
+            if new.get("number_of_articles") != old.get("number_of_articles"):
+                kinds.append("count")
+            if new.get("generated_summary") != old.get("generated_summary") or (
+                new.get("description") != old.get("description")
+            ):
+                kinds.append("summary")
+        if not kinds:
+            continue
+
+        cluster_id = keys["PK"]["S"]
+        change = changes.setdefault(cluster_id, {"cluster_id": cluster_id, "kinds": []})
+        change["kinds"] += [kind for kind in kinds if kind not in change["kinds"]]
+        change.update(
+            {field: json_value(new[field]) for field in FEED_FIELDS if field in new}
+        )
+    return list(changes.values())
+
+
+def merge_changes(changes):
+    # Later changes of a cluster win, the kinds add up
+    merged = {}
+    for change in changes:
+        current = merged.setdefault(change["cluster_id"], {"kinds": []})
+        kinds = current["kinds"] + [
+            kind for kind in change["kinds"] if kind not in current["kinds"]
+        ]
+        current.update(change)
+        current["kinds"] = kinds
+    return list(merged.values())
+
+
+def split_entries(changes, max_bytes=MAX_ENTRY_BYTES):
+    entries, current, size = [], [], 0
+    for change in changes:
+        change_size = len(json.dumps(change))
+        if current and size + change_size > max_bytes:
+            entries.append(current)
+            current, size = [], 0
+        current.append(change)
+        size += change_size
+    if current:
+        entries.append(current)
+    return entries
+
+
+class InMemoryChangeStore:
+    """
+    Feed state for a single process and local runs, same interface as DynamoDBChangeStore.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.entries = {}
+
+    def head(self):
+        with self.lock:
+            return self.version
+
+    def commit(self, version, changes, expired_version=None):
+        with self.lock:
+            if version != self.version + 1:
+                return False
+            self.entries[version] = {"changes": changes, "created_at": time.time()}
+            self.entries.pop(expired_version, None)
+            self.version = version
+            return True
+
+    def entries_after(self, version):
+        with self.lock:
+            return [
+                (v, self.entries[v]["changes"])
+                for v in sorted(self.entries)
+                if v > version
+            ]
+
+
+class DynamoDBChangeStore:
+    """
+    Feed state in the cluster table: a head item holding the latest version and one item per entry.
+
+    The head moves on in the same transaction that writes the entry, on
+    condition that it still holds the previous version. An entry is therefore
+    never visible before the ones ahead of it, and a reader that finds no gap
+    after its version has missed nothing.
+    """
+
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+
+    def head(self):
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={"PK": {"S": FEED_PK}, "SK": {"S": HEAD_SK}},
+            ConsistentRead=True,
+        )
+        return int(response.get("Item", {}).get("version", {"N": "0"})["N"])
+
+    def commit(self, version, changes, expired_version=None):
+        items = [
+            {
+                "Update": {
+                    "TableName": self.table_name,
+                    "Key": {"PK": {"S": FEED_PK}, "SK": {"S": HEAD_SK}},
+                    "UpdateExpression": "SET #version = :version",
+                    "ConditionExpression": "attribute_not_exists(#version) OR #version = :previous",
+                    "ExpressionAttributeNames": {"#version": "version"},
+                    "ExpressionAttributeValues": {
+                        ":version": {"N": str(version)},
+                        ":previous": {"N": str(version - 1)},
+                    },
+                }
+            },
+            {
+                "Put": {
+                    "TableName": self.table_name,
+                    "Item": {
+                        "PK": {"S": FEED_PK},
+                        "SK": {"S": version_key(version)},
+                        "version": {"N": str(version)},
+                        "changes": {"S": json.dumps(changes)},
+                        "created_at": {"N": str(int(time.time()))},
+                    },
+                }
+            },
+        ]
+        if expired_version:
+            items.append(
+                {
+                    "Delete": {
+                        "TableName": self.table_name,
+                        "Key": {
+                            "PK": {"S": FEED_PK},
+                            "SK": {"S": version_key(expired_version)},
+                        },
+                    }
+                }
+            )
+        try:
+            self.client.transact_write_items(TransactItems=items)
+            return True
+        except self.client.exceptions.TransactionCanceledException:
+            return False
+
+    def entries_after(self, version):
+        query_args = {
+            "TableName": self.table_name,
+            "KeyConditionExpression": "PK = :pk AND SK > :sk",
+            "ExpressionAttributeValues": {
+                ":pk": {"S": FEED_PK},
+                ":sk": {"S": version_key(version)},
+            },
+            "ConsistentRead": True,
+        }
+        entries = []
+        while True:
+            response = self.client.query(**query_args)
+            entries.extend(
+                (int(item["version"]["N"]), json.loads(item["changes"]["S"]))
+                for item in response.get("Items", [])
+            )
+            if "LastEvaluatedKey" not in response:
+                return entries
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+class ChangeFeed:
+    """
+    Bounded, versioned log of cluster changes.
+
+    Each entry takes the next version and only the latest max_versions
+    entries are kept. A reader asks for the changes after the version it
+    last saw, which costs one query however large the table is.
+    """
+
+    def __init__(self, store, max_versions=1000):
+        self.store = store
+        self.max_versions = max_versions
+
+    def append(self, changes):
+        # Returns the versions written, one per entry
+        return [self.append_entry(entry) for entry in split_entries(changes)]
+
+    def append_entry(self, changes):
+        for _ in range(MAX_CONFLICT_RETRIES):
+            version = self.store.head() + 1
+            expired_version = version - self.max_versions
+            if self.store.commit(
+                version, changes, expired_version if expired_version > 0 else None
+            ):
+                return version
+            time.sleep(random.uniform(0, 0.05))
+        raise FeedContention("Too much contention on the change feed head")
+
+    def changes_since(self, version=None):
+        """
+        Returns {"version", "changes", "reset"} for a reader at `version`.
+
+        changes are merged per cluster, the newest values winning. reset is True
+        when the reader has no version yet or fell behind the oldest entry
+        kept. It should then reload the cluster list and continue from the
+        version returned.
+        """
+        if version is None:
+            return {"version": self.store.head(), "changes": [], "reset": True}
+        entries = self.store.entries_after(version)
+        if not entries:
+            return {"version": version, "changes": [], "reset": False}
+        latest = entries[-1][0]
+        if entries[0][0] != version + 1:
+            return {"version": latest, "changes": [], "reset": True}
+        changes = merge_changes(change for _, entry in entries for change in entry)
+        return {"version": latest, "changes": changes, "reset": False}
+
+
+class InMemoryStream:
+    """
+    Stand-in for the cluster table and its NEW_AND_OLD_IMAGES stream in local runs.
+
+    put_item and update_item keep the items in memory and record what the
+    stream would, events hands the records out in Lambda event batches.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.records = []
+
+    def put_item(self, item):
+        key = (item["PK"], item["SK"])
+        old = self.items.get(key)
+        self.items[key] = dict(item)
+        self.record("MODIFY" if old else "INSERT", key, old, item)
+
+    def update_item(self, pk, sk, values):
+        old = self.items[(pk, sk)]
+        self.put_item({**old, **values})
+
+    def delete_item(self, pk, sk):
+        old = self.items.pop((pk, sk))
+        self.record("REMOVE", (pk, sk), old, None)
+
+    def record(self, event_name, key, old, new):
+        images = {"Keys": {"PK": {"S": key[0]}, "SK": {"S": key[1]}}}
+        for name, image in (("OldImage", old), ("NewImage", new)):
+            if image is not None:
+                images[name] = {
+                    attribute: serializer.serialize(value)
+                    for attribute, value in image.items()
+                }
+        self.records.append({"eventName": event_name, "dynamodb": images})
+
+    def events(self, batch_size=100):
+        while self.records:
+            batch, self.records = self.records[:batch_size], self.records[batch_size:]
+            yield {"Records": batch}
+
+
+@functools.lru_cache(maxsize=None)
+def get_feed():
+    store = DynamoDBChangeStore(
+        get_client("dynamodb"), os.environ["DYNAMODB_TABLE_NAME"]
+    )
+    return ChangeFeed(store, int(os.environ.get("CHANGE_FEED_MAX_VERSIONS", "1000")))
+
+
+"""
+Stream events append to the feed, any other event reads it
+{
+    since: 42
+}
+"""
+
+
+def handler(event, context):
+    feed = get_feed()
+    if "Records" not in event:
+        return feed.changes_since(event.get("since"))
+
+    changes = cluster_changes(event["Records"])
+    print(f"{len(event['Records'])} records, {len(changes)} cluster changes")
+    if not changes:
+        return {"statusCode": 200, "body": json.dumps("No cluster changes.")}
+
+    versions = feed.append(changes)
+    print(f"Appended versions {versions[0]} to {versions[-1]}")
+    return {
+        "statusCode": 200,
+        "body": json.dumps(
+            f"Appended {len(changes)} changes as {len(versions)} entries."
+        ),
+    }
@@ -0,0 +1,62 @@
+import gzip
+import io
+import json
+import uuid
+from datetime import datetime, timezone
+
+BATCH_PREFIX = "batches/"
+BATCH_SUFFIX = ".ndjson.gz"
+# Low level, the handoff objects are short lived and the CPU is better spent elsewhere
+COMPRESS_LEVEL = 3
+
+
+def new_batch_key(prefix=BATCH_PREFIX):
+    # Date partition keeps lifecycle rules and listing cheap
+    date = datetime.now(timezone.utc).strftime("%Y/%m/%d")
+    return f"{prefix}{date}/{uuid.uuid4()}{BATCH_SUFFIX}"
+
+
+def is_batch_key(key):
+    return key.endswith(BATCH_SUFFIX)
+
+
+def encode_batch(documents):
+    """
+    Serializes documents as one gzip compressed NDJSON object.
+
+    Each line is its own gzip member. Concatenated members are still a single
+    valid gzip stream, and the returned index of {"id", "offset", "length"}
+    lets a reader fetch any contiguous run of documents with one ranged GET.
+    """
+    return encode_serialized_batch((doc["id"], json.dumps(doc)) for doc in documents)
+
+
+def encode_serialized_batch(serialized_documents):
+    # Same as encode_batch, for (id, JSON string) pairs serialized by the caller
+    buffer = io.BytesIO()
+    index = []
+    for doc_id, doc_json in serialized_documents:
+        line = (doc_json + "\n").encode("utf-8")
+        member = gzip.compress(line, compresslevel=COMPRESS_LEVEL, mtime=0)
+        index.append({"id": doc_id, "offset": buffer.tell(), "length": len(member)})
+        buffer.write(member)
+    return buffer.getvalue(), index
+
+
+def iter_batch(stream):
+    # Streams documents out of a file-like body without holding the whole object
+    with gzip.GzipFile(fileobj=stream, mode="rb") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_documents(s3_client, bucket, keys):
+    # Accepts batch objects and the legacy one object per document keys
+    for key in keys:
+        print("Getting articles from ", key)
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        if is_batch_key(key):
+            yield from iter_batch(response["Body"])
+        else:
+            yield json.loads(response["Body"].read().decode("utf-8"))
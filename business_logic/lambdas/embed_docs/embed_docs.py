@@ -1,6 +1,15 @@
 import os
 import json
+import functools
+import threading
+import base64
+import struct
 import boto3
+from botocore.config import Config
+from batch_handoff import encode_serialized_batch, new_batch_key, read_documents
+from embedding_client import TITAN_MODEL_ID, embed_sagemaker, embed_titan
+from embedding_cache import DynamoDBStore, EmbeddingCache, cache_key
+from output_stage import MAX_MESSAGE_BYTES, put_objects, send_messages
 
 SQS_QUEUE_URL = os.environ["SQS_QUEUE_URL"]
 MAX_ARTICLES = int(os.environ["MAX_ARTICLES"])
@@ -20,11 +29,72 @@ EMBEDDING_FIELDS = [
 ]
 PREPROCESS_BUCKET = os.environ["PREPROCESS_BUCKET"]
 EMBEDDING_BUCKET = os.environ["EMBEDDING_BUCKET"]
+# "json" keeps the legacy list of floats, "float32"/"float16" use the binary encoding
+EMBEDDING_ENCODING = os.environ.get("EMBEDDING_ENCODING", "float16")
+EMBEDDING_ENCODING_VERSION = 1
+# "full" sends the whole article on SQS, "slim" sends only the id, embedding and S3 pointer
+MESSAGE_MODE = os.environ.get("MESSAGE_MODE", "full")
+# "batch" writes one compressed NDJSON object per invocation, "object" one JSON object per document
+HANDOFF_FORMAT = os.environ.get("HANDOFF_FORMAT", "batch")
+# struct format characters for the supported binary dtypes (little-endian)
+EMBEDDING_DTYPES = {"float32": "f", "float16": "e"}
+# Concurrent model calls per invocation
+EMBEDDING_WORKERS = int(os.environ.get("EMBEDDING_WORKERS", "8"))
+EMBEDDING_MAX_ATTEMPTS = int(os.environ.get("EMBEDDING_MAX_ATTEMPTS", "5"))
+# Limits for one SageMaker call, MAX_ARTICLES caps the number of texts per call
+EMBEDDING_MAX_PAYLOAD_BYTES = int(
+    os.environ.get("EMBEDDING_MAX_PAYLOAD_BYTES", "5000000")
+)
+EMBEDDING_MAX_BATCH_TOKENS = int(os.environ.get("EMBEDDING_MAX_BATCH_TOKENS", "16384"))
+# Concurrent S3 writes and SQS batch sends
+OUTPUT_WORKERS = int(os.environ.get("OUTPUT_WORKERS", "16"))
+# Shared cache table, empty keeps only the in-process tier
+EMBEDDING_CACHE_TABLE = os.environ.get("EMBEDDING_CACHE_TABLE", "")
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL_SECONDS = int(
+    os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", str(7 * 24 * 3600))
+)
+# Part of every cache key, a different model or output size never reuses an entry
+CACHE_MODEL_ID = (
+    f"{TITAN_MODEL_ID}:{MAX_LENGTH}"
+    if EMBEDDING_MODEL == "titan"
+    else f"{EMBEDDING_MODEL}:{EMBEDDING_ENDPOINT_NAME}:{MAX_LENGTH}"
+)
 
-s3_client = boto3.client("s3")
-sagemaker_client = boto3.client("sagemaker-runtime")
-sqs_client = boto3.client("sqs")
-bedrock_client = boto3.client("bedrock-runtime")
+# Throttling is retried with jitter in embedding_client, not again inside botocore
+model_config = Config(
+    max_pool_connections=EMBEDDING_WORKERS,
+    retries={"mode": "standard", "max_attempts": 1},
+)
+
+output_config = Config(max_pool_connections=OUTPUT_WORKERS)
+CLIENT_CONFIGS = {
+    "s3": output_config,
+    "sqs": output_config,
+    "sagemaker-runtime": model_config,
+    "bedrock-runtime": model_config,
+}
+
+clients_lock = threading.Lock()
+
+
+# Clients are created on first use and reused by later invocations in the container,
+# so only the configured model's client is ever built
+@functools.lru_cache(maxsize=None)
+def get_client(service_name):
+    # Worker threads can ask at the same time, boto3 client creation is not thread safe
+    with clients_lock:
+        return boto3.client(service_name, config=CLIENT_CONFIGS.get(service_name))
+
+
+@functools.lru_cache(maxsize=None)
+def get_embedding_cache():
+    shared = None
+    if EMBEDDING_CACHE_TABLE:
+        shared = DynamoDBStore(
+            get_client("dynamodb"), EMBEDDING_CACHE_TABLE, EMBEDDING_CACHE_TTL_SECONDS
+        )
+    return EmbeddingCache(EMBEDDING_CACHE_SIZE, shared=shared)
 
 
 def create_concat_text(doc_list):
@@ -42,68 +112,177 @@ def create_concat_text(doc_list):
     return concat_list
 
 
-# Event is list of S3 keys
-def handler(event, context):
+def encode_embedding(embedding):
+    if EMBEDDING_ENCODING not in EMBEDDING_DTYPES:
+        return [embedding]
 
-    document_list = []
-    for s3_key in event:
-        print("Getting article from ", s3_key)
-        response = s3_client.get_object(Bucket=PREPROCESS_BUCKET, Key=s3_key)
-        data = response["Body"].read().decode("utf-8")
-        doc = json.loads(data)
-        document_list.append(doc)
+    # Versioned header so the consumer can decode without knowing the producer config
+    packed = struct.pack(
+        f"<{len(embedding)}{EMBEDDING_DTYPES[EMBEDDING_ENCODING]}", *embedding
+    )
+    return {
+        "version": EMBEDDING_ENCODING_VERSION,
+        "dtype": EMBEDDING_ENCODING,
+        "dim": len(embedding),
+        "data": base64.b64encode(packed).decode("ascii"),
+    }
 
-    text_list = create_concat_text(document_list)
-    print("Text list: ", text_list)
 
-    data = {"input_texts": text_list, "max_length": MAX_LENGTH}
+def create_message(doc, s3_key, index_entry=None):
+    if MESSAGE_MODE != "slim":
+        return doc
 
-    # Print the content
-    print("Data:")
-    print(data)
-    json_data = json.dumps(data)
-    print("Embedding endpoint name: ", EMBEDDING_ENDPOINT_NAME)
+    # Claim check, the consumer fetches the article body from S3 only when it writes it
+    message = {
+        "id": doc["id"],
+        "s3_bucket": EMBEDDING_BUCKET,
+        "s3_key": s3_key,
+    }
+    if "duplicate_of" in doc:
+        message["duplicate_of"] = doc["duplicate_of"]
+    else:
+        message["concat_embedding"] = doc["concat_embedding"]
+    if index_entry is not None:
+        # Byte range of the document inside the batch object
+        message["s3_range"] = [index_entry["offset"], index_entry["length"]]
+    return message
+
+
+def store_documents(document_list, serialized):
+    # Returns the (s3_key, index_entry) each document's message should point at
+    if HANDOFF_FORMAT == "batch":
+        s3_key = new_batch_key()
+        body, index = encode_serialized_batch(
+            (doc["id"], doc_json) for doc, doc_json in zip(document_list, serialized)
+        )
+        get_client("s3").put_object(Bucket=EMBEDDING_BUCKET, Key=s3_key, Body=body)
+        return [(s3_key, entry) for entry in index]
+
+    locations = [(doc["id"] + ".json", None) for doc in document_list]
+    put_objects(
+        get_client("s3"),
+        [
+            (EMBEDDING_BUCKET, s3_key, doc_json)
+            for (s3_key, _), doc_json in zip(locations, serialized)
+        ],
+        max_workers=OUTPUT_WORKERS,
+    )
+    return locations
 
-    if len(document_list) > MAX_ARTICLES:
-        document_list[:MAX_ARTICLES]
 
+def embed_texts(texts):
     # If titan use bedrock, otherwise use sagemaker
-    prediction = {"embeddings": []}
     if EMBEDDING_MODEL == "titan":
-        for text in text_list:
-            response = bedrock_client.invoke_model(
-                body=json.dumps(
-                    {"inputText": text, "dimensions": MAX_LENGTH, "normalize": True}
-                ),
-                modelId="amazon.titan-embed-text-v2:0",
-                accept="application/json",
-                contentType="application/json",
-            )
-            response_body = json.loads(response.get("body").read().decode("utf-8"))
-            prediction["embeddings"].append(response_body["embedding"])
+        return embed_titan(
+            get_client("bedrock-runtime"),
+            texts,
+            MAX_LENGTH,
+            max_workers=EMBEDDING_WORKERS,
+            max_attempts=EMBEDDING_MAX_ATTEMPTS,
+        )
     else:
-        # Push content to the SageMaker endpoint
-        response = sagemaker_client.invoke_endpoint(
-            EndpointName=EMBEDDING_ENDPOINT_NAME,
-            ContentType="application/json",
-            Body=json_data,
+        print("Embedding endpoint name: ", EMBEDDING_ENDPOINT_NAME)
+        return embed_sagemaker(
+            get_client("sagemaker-runtime"),
+            EMBEDDING_ENDPOINT_NAME,
+            texts,
+            MAX_LENGTH,
+            max_texts=MAX_ARTICLES,
+            max_payload_bytes=EMBEDDING_MAX_PAYLOAD_BYTES,
+            max_tokens=EMBEDDING_MAX_BATCH_TOKENS,
+            max_workers=EMBEDDING_WORKERS,
+            max_attempts=EMBEDDING_MAX_ATTEMPTS,
         )
-        prediction = json.loads(response["Body"].read().decode("utf-8"))
 
-    print("Prediction:")
-    print(prediction)
-    embedding_list = prediction["embeddings"]
 
-    for i, doc in enumerate(document_list):
-        doc["concat_embedding"] = [embedding_list[i]]
-        message_body = json.dumps(doc)
-        if len(message_body.encode("utf-8")) > 262144:
+def embed_with_cache(text_list):
+    embedding_cache = get_embedding_cache()
+    keys = [cache_key(text, CACHE_MODEL_ID) for text in text_list]
+    found = embedding_cache.get_many(list(dict.fromkeys(keys)))
+
+    # Only misses go to the model, and copies within the batch go once
+    missing = {}
+    for key, text in zip(keys, text_list):
+        if key not in found:
+            missing.setdefault(key, text)
+    if missing:
+        computed = dict(zip(missing, embed_texts(list(missing.values()))))
+        embedding_cache.put_many(computed)
+        found.update(computed)
+
+    print(
+        f"Embedding cache: {len(text_list)} texts, {len(missing)} embedded, "
+        f"hit rate {embedding_cache.hit_rate():.1%} since start {embedding_cache.stats}"
+    )
+    return [found[key] for key in keys]
+
+
+class MessagesNotSent(Exception):
+    """
+    Raised when the invocation failed before any message was sent.
+
+    The inline caller in pre_process_docs reads the error type to tell a
+    batch it can safely stage again from one that may already be clustered.
+    """
+
+
+def embed_and_store(document_list):
+    # Returns the (id, message body) pairs to send, nothing is on the queue yet
+
+    # Near-duplicates flagged by preprocessing reuse their original's cluster, no embedding
+    to_embed = [doc for doc in document_list if "duplicate_of" not in doc]
+    print(f"Near duplicates skipped: {len(document_list) - len(to_embed)}")
+
+    text_list = create_concat_text(to_embed)
+    print("Text list: ", text_list)
+
+    embedding_list = embed_with_cache(text_list) if text_list else []
+
+    for i, doc in enumerate(to_embed):
+        doc["concat_embedding"] = encode_embedding(embedding_list[i])
+
+    # Each document is serialized once, for its S3 object and, in full mode, its message
+    serialized = [json.dumps(doc) for doc in document_list]
+
+    # Write the articles before the messages so slim messages never point at a missing object
+    locations = store_documents(document_list, serialized)
+    messages = []
+    for i, (doc, doc_json, (s3_key, index_entry)) in enumerate(
+        zip(document_list, serialized, locations)
+    ):
+        if MESSAGE_MODE == "slim":
+            message_body = json.dumps(create_message(doc, s3_key, index_entry))
+        else:
+            message_body = doc_json
+        if len(message_body.encode("utf-8")) > MAX_MESSAGE_BYTES:
             print(f"Skipping item at index {i} due to size limit")
             continue
-        s3_key = doc["id"] + ".json"
-        json_data = json.dumps(doc)
-        sqs_client.send_message(QueueUrl=SQS_QUEUE_URL, MessageBody=json_data)
-        s3_client.put_object(Bucket=EMBEDDING_BUCKET, Key=s3_key, Body=json_data)
+        messages.append((doc["id"], message_body))
+    return messages
+
+
+# Event is list of S3 keys, or {"documents": [...]} when preprocessing calls inline
+def handler(event, context):
+    if not event:
+        print("No documents to embed")
+        return "Success"
+
+    try:
+        if isinstance(event, dict):
+            document_list = event["documents"]
+        else:
+            document_list = list(
+                read_documents(get_client("s3"), PREPROCESS_BUCKET, event)
+            )
+        messages = embed_and_store(document_list)
+    except Exception as e:
+        raise MessagesNotSent(f"{type(e).__name__}: {e}") from e
+
+    failed = send_messages(
+        get_client("sqs"), SQS_QUEUE_URL, messages, max_workers=OUTPUT_WORKERS
+    )
+    if failed:
+        raise RuntimeError(f"Could not send messages for articles {failed}")
 
     print("End of function")
     return "Success"
@@ -0,0 +1,172 @@
+import hashlib
+import re
+import struct
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# BatchGetItem and BatchWriteItem request limits
+GET_BATCH_SIZE = 100
+WRITE_BATCH_SIZE = 25
+MAX_UNPROCESSED_RETRIES = 5
+
+
+def normalize_text(text):
+    # Syndicated copies differ in whitespace and Unicode composition more than in wording
+    return WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(text, model_id):
+    digest = hashlib.sha256()
+    digest.update(model_id.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def pack_embedding(embedding):
+    return struct.pack(f"<{len(embedding)}f", *embedding)
+
+
+def unpack_embedding(blob):
+    blob = getattr(blob, "value", blob)
+    return list(struct.unpack(f"<{len(blob) // 4}f", blob))
+
+
+class InMemoryStore:
+    """
+    Shared tier stand-in for local runs, with the same interface as DynamoDBStore.
+    """
+
+    def __init__(self):
+        self.items = {}
+
+    def get_many(self, keys):
+        return {key: self.items[key] for key in keys if key in self.items}
+
+    def put_many(self, entries):
+        self.items.update(entries)
+
+
+class DynamoDBStore:
+    """
+    Shared tier in a DynamoDB table keyed by cache_key, expired with a TTL.
+    """
+
+    def __init__(self, client, table_name, ttl_seconds):
+        self.client = client
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), GET_BATCH_SIZE):
+            request = {
+                self.table_name: {
+                    "Keys": [
+                        {"cache_key": {"S": key}}
+                        for key in keys[i : i + GET_BATCH_SIZE]
+                    ],
+                    "ProjectionExpression": "cache_key, embedding",
+                }
+            }
+            for attempt in range(MAX_UNPROCESSED_RETRIES):
+                response = self.client.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table_name, []):
+                    found[item["cache_key"]["S"]] = unpack_embedding(
+                        item["embedding"]["B"]
+                    )
+                request = response.get("UnprocessedKeys")
+                if not request:
+                    break
+                time.sleep(0.05 * 2**attempt)
+        return found
+
+    def put_many(self, entries):
+        expires_at = str(int(time.time()) + self.ttl_seconds)
+        requests = [
+            {
+                "PutRequest": {
+                    "Item": {
+                        "cache_key": {"S": key},
+                        "embedding": {"B": pack_embedding(embedding)},
+                        "expires_at": {"N": expires_at},
+                    }
+                }
+            }
+            for key, embedding in entries.items()
+        ]
+        for i in range(0, len(requests), WRITE_BATCH_SIZE):
+            request = {self.table_name: requests[i : i + WRITE_BATCH_SIZE]}
+            for attempt in range(MAX_UNPROCESSED_RETRIES):
+                response = self.client.batch_write_item(RequestItems=request)
+                request = response.get("UnprocessedItems")
+                if not request:
+                    break
+                time.sleep(0.05 * 2**attempt)
+
+
+class EmbeddingCache:
+    """
+    Two tier embedding cache, an in-process LRU in front of an optional shared store.
+
+    Hit counters accumulate for the lifetime of the container.
+    """
+
+    def __init__(self, local_size, shared=None):
+        self.local_size = local_size
+        self.shared = shared
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"local_hits": 0, "shared_hits": 0, "misses": 0}
+
+    def remember(self, key, embedding):
+        with self.lock:
+            self.local[key] = embedding
+            self.local.move_to_end(key)
+            while len(self.local) > self.local_size:
+                self.local.popitem(last=False)
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.local:
+                    self.local.move_to_end(key)
+                    found[key] = self.local[key]
+        local_hits = len(found)
+
+        remaining = [key for key in keys if key not in found]
+        if remaining and self.shared is not None:
+            try:
+                shared_found = self.shared.get_many(remaining)
+            except Exception as e:
+                # The cache only saves model calls, never fail the batch because of it
+                print(f"Shared embedding cache read failed: {e}")
+                shared_found = {}
+            for key, embedding in shared_found.items():
+                self.remember(key, embedding)
+            found.update(shared_found)
+
+        self.stats["local_hits"] += local_hits
+        self.stats["shared_hits"] += len(found) - local_hits
+        self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries):
+        for key, embedding in entries.items():
+            self.remember(key, embedding)
+        if entries and self.shared is not None:
+            try:
+                self.shared.put_many(entries)
+            except Exception as e:
+                print(f"Shared embedding cache write failed: {e}")
+
+    def hit_rate(self):
+        lookups = sum(self.stats.values())
+        if not lookups:
+            return 0.0
+        return (self.stats["local_hits"] + self.stats["shared_hits"]) / lookups
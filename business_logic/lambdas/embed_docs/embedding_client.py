@@ -0,0 +1,127 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+TITAN_MODEL_ID = "amazon.titan-embed-text-v2:0"
+# Error codes worth retrying, everything else fails the batch straight away
+RETRYABLE_ERRORS = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "InternalServerException",
+    "InternalFailure",
+}
+# Rough estimate for English text, the endpoint does the real tokenization
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text, max_length=None):
+    tokens = len(text) // CHARS_PER_TOKEN + 1
+    # The endpoint truncates every input to max_length tokens
+    return min(tokens, max_length) if max_length else tokens
+
+
+def call_with_retries(call, max_attempts=5, base_delay=0.2):
+    for attempt in range(max_attempts):
+        try:
+            return call()
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in RETRYABLE_ERRORS or attempt == max_attempts - 1:
+                raise
+            # Full jitter so concurrent workers do not retry in lockstep
+            delay = random.uniform(0, base_delay * 2**attempt)
+            print(f"{code}, retrying in {delay:.2f} s (attempt {attempt + 1})")
+            time.sleep(delay)
+
+
+def split_batches(texts, max_texts, max_payload_bytes, max_tokens, max_length=None):
+    """
+    Groups text indices into sub-batches for the embedding endpoint.
+
+    A sub-batch closes when adding the next text would exceed the number of
+    texts, the serialized payload size or the estimated token count. A single
+    oversized text still gets a sub-batch of its own.
+    """
+    batches = []
+    current, payload_bytes, tokens = [], 0, 0
+    for i, text in enumerate(texts):
+        # Serialized size inside the JSON list, plus the separator
+        text_bytes = len(json.dumps(text).encode("utf-8")) + 2
+        text_tokens = estimate_tokens(text, max_length)
+        if current and (
+            len(current) >= max_texts
+            or payload_bytes + text_bytes > max_payload_bytes
+            or tokens + text_tokens > max_tokens
+        ):
+            batches.append(current)
+            current, payload_bytes, tokens = [], 0, 0
+        current.append(i)
+        payload_bytes += text_bytes
+        tokens += text_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def embed_titan(bedrock_client, texts, dimensions, max_workers=8, max_attempts=5):
+    # Titan embeds one text per call, so the calls run side by side
+    def embed_one(text):
+        response = call_with_retries(
+            lambda: bedrock_client.invoke_model(
+                body=json.dumps(
+                    {"inputText": text, "dimensions": dimensions, "normalize": True}
+                ),
+                modelId=TITAN_MODEL_ID,
+                accept="application/json",
+                contentType="application/json",
+            ),
+            max_attempts,
+        )
+        response_body = json.loads(response.get("body").read().decode("utf-8"))
+        return response_body["embedding"]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(embed_one, texts))
+
+
+def embed_sagemaker(
+    sagemaker_client,
+    endpoint_name,
+    texts,
+    max_length,
+    max_texts,
+    max_payload_bytes,
+    max_tokens,
+    max_workers=8,
+    max_attempts=5,
+):
+    batches = split_batches(texts, max_texts, max_payload_bytes, max_tokens, max_length)
+    print(f"Embedding {len(texts)} texts in {len(batches)} endpoint calls")
+
+    def embed_batch(indices):
+        body = json.dumps(
+            {"input_texts": [texts[i] for i in indices], "max_length": max_length}
+        )
+        response = call_with_retries(
+            lambda: sagemaker_client.invoke_endpoint(
+                EndpointName=endpoint_name,
+                ContentType="application/json",
+                Body=body,
+            ),
+            max_attempts,
+        )
+        prediction = json.loads(response["Body"].read().decode("utf-8"))
+        return prediction["embeddings"]
+
+    embeddings = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for indices, batch_embeddings in zip(
+            batches, executor.map(embed_batch, batches)
+        ):
+            for i, embedding in zip(indices, batch_embeddings):
+                embeddings[i] = embedding
+    return embeddings
@@ -0,0 +1,90 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# SQS limits, per message and per SendMessageBatch request
+MAX_MESSAGE_BYTES = 262144
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 262144
+
+
+def pack_message_batches(
+    messages, max_entries=MAX_BATCH_ENTRIES, max_bytes=MAX_BATCH_BYTES
+):
+    """
+    Packs (id, body) pairs into SendMessageBatch sized groups, keeping their order.
+    """
+    batches = []
+    current, current_bytes = [], 0
+    for message_id, body in messages:
+        body_bytes = len(body.encode("utf-8"))
+        if current and (
+            len(current) >= max_entries or current_bytes + body_bytes > max_bytes
+        ):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append((message_id, body))
+        current_bytes += body_bytes
+    if current:
+        batches.append(current)
+    return batches
+
+
+def send_message_with_retries(sqs_client, queue_url, body, max_attempts=5):
+    for attempt in range(max_attempts):
+        try:
+            return sqs_client.send_message(QueueUrl=queue_url, MessageBody=body)
+        except Exception as e:
+            if attempt == max_attempts - 1:
+                raise
+            delay = random.uniform(0, 0.1 * 2**attempt)
+            print(f"send_message failed ({e}), retrying in {delay:.2f} s")
+            time.sleep(delay)
+
+
+def send_batch(sqs_client, queue_url, batch):
+    # Entry ids only need to be unique within the request
+    entries = [{"Id": str(i), "MessageBody": body} for i, (_, body) in enumerate(batch)]
+    response = sqs_client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+
+    failed = []
+    for failure in response.get("Failed", []):
+        message_id, body = batch[int(failure["Id"])]
+        print(
+            f"Batch entry for {message_id} failed ({failure.get('Code')}), retrying alone"
+        )
+        try:
+            send_message_with_retries(sqs_client, queue_url, body)
+        except Exception as e:
+            print(f"Could not send message for {message_id}: {e}")
+            failed.append(message_id)
+    return failed
+
+
+def send_messages(sqs_client, queue_url, messages, max_workers=8):
+    """
+    Sends (id, body) pairs with concurrent SendMessageBatch calls.
+
+    Entries the batch call rejects are retried one by one. Returns the ids
+    that could not be sent.
+    """
+    batches = pack_message_batches(messages)
+    print(f"Sending {len(messages)} messages in {len(batches)} batches")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda batch: send_batch(sqs_client, queue_url, batch), batches
+        )
+        return [message_id for failed in results for message_id in failed]
+
+
+def put_objects(s3_client, uploads, max_workers=8):
+    # uploads are (bucket, key, body), raises if any of them fails
+    if not uploads:
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(s3_client.put_object, Bucket=bucket, Key=key, Body=body)
+            for bucket, key, body in uploads
+        ]
+        for future in futures:
+            future.result()
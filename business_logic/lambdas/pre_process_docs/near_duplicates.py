@@ -0,0 +1,162 @@
+import re
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+SHINGLE_SIZE = 5
+BANDS = 16
+ROWS_PER_BAND = 4
+# Fixed seed, signatures must agree between invocations of the same container
+PERMUTATION_SEED = 20240501
+
+
+def make_permutations(count, seed=PERMUTATION_SEED):
+    """
+    Multiply-shift hash functions (a * x + b) mod 2**64 >> 32, with a odd.
+
+    Unlike a Mersenne prime modulus they never leave 64-bit integers, so
+    every function is applied to every shingle in one numpy expression.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2**64, size=count, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**64, size=count, dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+
+PERMUTATIONS = make_permutations(BANDS * ROWS_PER_BAND)
+
+
+def shingle_hashes(text):
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) <= SHINGLE_SIZE:
+        shingles = {zlib.crc32(" ".join(tokens).encode("utf-8"))}
+    else:
+        shingles = {
+            zlib.crc32(" ".join(tokens[i : i + SHINGLE_SIZE]).encode("utf-8"))
+            for i in range(len(tokens) - SHINGLE_SIZE + 1)
+        }
+    return np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signature(text, permutations=PERMUTATIONS):
+    a, b = permutations
+    # One row per hash function, wrapping uint64 arithmetic is the mod 2**64
+    hashed = (a * shingle_hashes(text) + b) >> np.uint64(32)
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def band_keys(signature, rows_per_band=ROWS_PER_BAND):
+    return [
+        hash((band, signature[start : start + rows_per_band].tobytes()))
+        for band, start in enumerate(range(0, len(signature), rows_per_band))
+    ]
+
+
+def estimated_similarity(signature, other):
+    return np.count_nonzero(signature == other) / len(signature)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash LSH index over recently seen documents.
+
+    Holds at most max_documents signatures and forgets documents older than
+    ttl_seconds. Candidates sharing a band are confirmed on the estimated
+    Jaccard similarity of the full signatures. More bands catch copies with
+    lower similarity, more rows per band make chance collisions rarer, and
+    signing costs grow with bands * rows_per_band.
+
+    The index is per container and best effort. A copy handled by another
+    concurrent container, or after a cold start, is not caught here and is
+    embedded like any new article, DBSCAN still puts it in its original's
+    cluster.
+    """
+
+    def __init__(
+        self,
+        threshold=0.8,
+        max_documents=10000,
+        ttl_seconds=6 * 3600,
+        bands=BANDS,
+        rows_per_band=ROWS_PER_BAND,
+    ):
+        self.threshold = threshold
+        self.max_documents = max_documents
+        self.ttl_seconds = ttl_seconds
+        self.rows_per_band = rows_per_band
+        self.permutations = make_permutations(bands * rows_per_band)
+        # doc id -> (added_at, signature, band keys), oldest first
+        self.documents = OrderedDict()
+        self.bands = {}
+        self.stats = {"documents": 0, "duplicates": 0}
+
+    def signature(self, text):
+        return minhash_signature(text, self.permutations)
+
+    def expire(self, now):
+        while self.documents:
+            doc_id, (added_at, _, keys) = next(iter(self.documents.items()))
+            if (
+                len(self.documents) <= self.max_documents
+                and now - added_at <= self.ttl_seconds
+            ):
+                break
+            del self.documents[doc_id]
+            for key in keys:
+                if self.bands.get(key) == doc_id:
+                    del self.bands[key]
+
+    def find(self, doc_id, signature, now=None):
+        """
+        Returns the id of an indexed near-duplicate of the document, or None.
+        """
+        now = time.time() if now is None else now
+        self.expire(now)
+        self.stats["documents"] += 1
+
+        keys = band_keys(signature, self.rows_per_band)
+        for candidate in dict.fromkeys(
+            self.bands[key] for key in keys if key in self.bands
+        ):
+            if candidate == doc_id:
+                continue
+            _, candidate_signature, _ = self.documents[candidate]
+            if estimated_similarity(signature, candidate_signature) >= self.threshold:
+                self.stats["duplicates"] += 1
+                return candidate
+        return None
+
+    def add(self, doc_id, signature, now=None):
+        # Only originals are indexed, so every copy points at the same article
+        now = time.time() if now is None else now
+        keys = band_keys(signature, self.rows_per_band)
+        self.documents[doc_id] = (now, signature, keys)
+        for key in keys:
+            self.bands[key] = doc_id
+
+    def remove(self, doc_ids):
+        # Originals that did not reach the consumer, copies must not point at them
+        for doc_id in doc_ids:
+            entry = self.documents.pop(doc_id, None)
+            if entry is None:
+                continue
+            for key in entry[2]:
+                if self.bands.get(key) == doc_id:
+                    del self.bands[key]
+
+    def find_or_add(self, doc_id, signature, now=None):
+        """
+        Returns the id of an indexed near-duplicate, or adds the document and returns None.
+        """
+        original_id = self.find(doc_id, signature, now)
+        if original_id is None:
+            self.add(doc_id, signature, now)
+        return original_id
+
+    def duplicate_rate(self):
+        if not self.stats["documents"]:
+            return 0.0
+        return self.stats["duplicates"] / self.stats["documents"]
@@ -1,23 +1,87 @@
 import os
+import functools
 import json
-import pickle
 import boto3
 from typing import List, Dict
-from bs4 import BeautifulSoup
-import re
 import base64
-
-kinesis_client = boto3.client("kinesis")
-s3_client = boto3.client("s3")
+import threading
+import uuid
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import (
+    ClientError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+)
+from text_normalization import clean_text, remove_tags
+from batch_handoff import encode_batch, new_batch_key
+from near_duplicates import NearDuplicateIndex
+from record_format import decode_record_data
 
 PREPROCESS_BUCKET = os.environ["PREPROCESS_BUCKET"]
-
-
-def clean_text(text):
-    # apply to title
-    text = text.replace("&quot;", '"')
-    text = re.sub(r'[^:a-zA-Z0-9\s"\'-]', "", text)
-    return text
+# Threads cleaning and uploading documents, also the size of the S3 connection pool
+PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS", "16"))
+# "batch" writes one compressed NDJSON object per invocation, "object" one JSON object per document
+HANDOFF_FORMAT = os.environ.get("HANDOFF_FORMAT", "batch")
+# Name of the embedding function to call inline, empty keeps the staged Step Functions path
+FUSED_EMBEDDING_FUNCTION = os.environ.get("FUSED_EMBEDDING_FUNCTION", "")
+FUSED_MAX_DOCUMENTS = int(os.environ.get("FUSED_MAX_DOCUMENTS", "25"))
+# Synchronous Lambda invocations accept up to 6 MB of payload
+FUSED_MAX_PAYLOAD_BYTES = int(os.environ.get("FUSED_MAX_PAYLOAD_BYTES", "5000000"))
+# Longer than the embedding function's timeout, so a slow call is not cut off and sent again
+FUSED_READ_TIMEOUT_SECONDS = int(os.environ.get("FUSED_READ_TIMEOUT_SECONDS", "310"))
+# Invoke errors returned before the embedding function ran, the batch can be staged instead
+NOT_INVOKED_ERROR_CODES = {
+    "TooManyRequestsException",
+    "ResourceNotReadyException",
+    "ResourceConflictException",
+    "ResourceNotFoundException",
+    "RequestTooLargeException",
+    "AccessDeniedException",
+}
+
+# Estimated Jaccard similarity above which an article is a copy of an earlier one, 0 disables
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+NEAR_DUPLICATE_MAX_DOCUMENTS = int(
+    os.environ.get("NEAR_DUPLICATE_MAX_DOCUMENTS", "10000")
+)
+NEAR_DUPLICATE_TTL_SECONDS = int(os.environ.get("NEAR_DUPLICATE_TTL_SECONDS", "21600"))
+# MinHash signature size is bands * rows per band, see data/benchmark_near_duplicates.py
+NEAR_DUPLICATE_BANDS = int(os.environ.get("NEAR_DUPLICATE_BANDS", "16"))
+NEAR_DUPLICATE_ROWS_PER_BAND = int(os.environ.get("NEAR_DUPLICATE_ROWS_PER_BAND", "4"))
+# Records that could not be processed are kept here for replay
+FAILED_RECORDS_PREFIX = "failed-records/"
+# S3 connections are shared by the worker threads. Inline embedding calls are
+# never retried, a retry after a read timeout could cluster the batch twice
+CLIENT_CONFIGS = {
+    "s3": Config(max_pool_connections=PREPROCESS_WORKERS),
+    "lambda": Config(
+        connect_timeout=5,
+        read_timeout=FUSED_READ_TIMEOUT_SECONDS,
+        retries={"mode": "standard", "max_attempts": 1},
+    ),
+}
+
+# Lives as long as the container, so copies are caught across its invocations only
+near_duplicate_index = NearDuplicateIndex(
+    NEAR_DUPLICATE_THRESHOLD,
+    NEAR_DUPLICATE_MAX_DOCUMENTS,
+    NEAR_DUPLICATE_TTL_SECONDS,
+    NEAR_DUPLICATE_BANDS,
+    NEAR_DUPLICATE_ROWS_PER_BAND,
+)
+near_duplicate_lock = threading.Lock()
+
+clients_lock = threading.Lock()
+
+
+# Clients are created on first use and reused by later invocations in the container
+@functools.lru_cache(maxsize=None)
+def get_client(service_name):
+    # Worker threads can ask at the same time, boto3 client creation is not thread safe
+    with clients_lock:
+        return boto3.client(service_name, config=CLIENT_CONFIGS.get(service_name))
 
 
 def extract_top_subjects(subject_entry: List[dict], threshold: float):
@@ -51,11 +115,6 @@ def extract_top_organizations(orgs_entry: List[dict], threshold: float):
     return result
 
 
-def remove_tags(text: str):
-    soup = BeautifulSoup(text, "html.parser")
-    return soup.get_text()
-
-
 def get_names(people: List[Dict], threshold=0.5):
 
     names = [person["name"] for person in people if person["relevance"] > threshold]
@@ -132,29 +191,230 @@ def process_data(data: dict):
     return processed_data
 
 
+def decode_record(event):
+    # Compressed envelope from put_records.py, or the legacy plain JSON list
+    return decode_record_data(base64.b64decode(event["data"]))
+
+
+def process_document(doc):
+    # The MinHash signature is None when near-duplicate detection is off
+    processed_data = process_data(doc)
+    if NEAR_DUPLICATE_THRESHOLD <= 0:
+        return processed_data, None
+    signature = near_duplicate_index.signature(
+        processed_data["title"] + "\n" + processed_data["text"]
+    )
+    return processed_data, signature
+
+
+def mark_near_duplicate(processed_data, signature, add=True):
+    """
+    Points a copy of an indexed article at it, returns True for an original.
+
+    Originals are added to the index with add, or left for the caller to
+    add once they are known to reach the consumer. Copies skip embedding,
+    the consumer files them under the original's cluster.
+    """
+    if signature is None:
+        return False
+    with near_duplicate_lock:
+        if add:
+            original_id = near_duplicate_index.find_or_add(
+                processed_data["id"], signature
+            )
+        else:
+            original_id = near_duplicate_index.find(processed_data["id"], signature)
+    if original_id is not None:
+        processed_data["duplicate_of"] = original_id
+        return False
+    return True
+
+
+def process_and_upload(doc):
+    # Copies of this invocation's own articles are not caught, they are uploaded side by side
+    processed_data, signature = process_document(doc)
+    original = mark_near_duplicate(processed_data, signature, add=False)
+
+    s3_key = processed_data["id"] + ".json"
+    json_data = json.dumps(processed_data)
+    print("Pushing data to ", PREPROCESS_BUCKET + "/" + s3_key)
+    get_client("s3").put_object(Bucket=PREPROCESS_BUCKET, Key=s3_key, Body=json_data)
+    return s3_key, processed_data["id"], signature if original else None
+
+
+def upload_batch(processed_documents):
+    s3_key = new_batch_key()
+    body, index = encode_batch(processed_documents)
+    print(
+        f"Pushing {len(index)} documents ({len(body)} bytes) to ",
+        PREPROCESS_BUCKET + "/" + s3_key,
+    )
+    get_client("s3").put_object(Bucket=PREPROCESS_BUCKET, Key=s3_key, Body=body)
+    return s3_key
+
+
+class InlineEmbeddingUnknown(Exception):
+    """
+    Raised when the embedding function may have sent some of the batch to the consumer.
+
+    Staging the batch again could cluster those articles twice, so the
+    records are parked for a decision instead.
+    """
+
+
+def embed_inline(processed_documents):
+    """
+    Hands small batches straight to the embedding function.
+
+    Skips the S3 round trip and the embedding state of the Step Function.
+    Returns False when the batch is too large or the embedding function
+    certainly sent nothing (the invoke was rejected or it failed before its
+    first message), so the caller falls back to the staged path. Raises
+    InlineEmbeddingUnknown for any other failure.
+    """
+    if not FUSED_EMBEDDING_FUNCTION or len(processed_documents) > FUSED_MAX_DOCUMENTS:
+        return False
+    payload = json.dumps({"documents": processed_documents}).encode("utf-8")
+    if len(payload) > FUSED_MAX_PAYLOAD_BYTES:
+        return False
+
+    try:
+        response = get_client("lambda").invoke(
+            FunctionName=FUSED_EMBEDDING_FUNCTION,
+            InvocationType="RequestResponse",
+            Payload=payload,
+        )
+    except (ConnectTimeoutError, EndpointConnectionError) as e:
+        print(f"Inline embedding not reached, falling back to staged: {e}")
+        return False
+    except ClientError as e:
+        if e.response["Error"]["Code"] in NOT_INVOKED_ERROR_CODES:
+            print(f"Inline embedding rejected, falling back to staged: {e}")
+            return False
+        raise InlineEmbeddingUnknown(f"Inline embedding failed: {e}") from e
+    except Exception as e:
+        # Read timeouts included, the function may still be running
+        raise InlineEmbeddingUnknown(f"Inline embedding failed: {e}") from e
+
+    if "FunctionError" in response:
+        error = response["Payload"].read().decode("utf-8")
+        try:
+            error_type = json.loads(error).get("errorType")
+        except (ValueError, AttributeError):
+            error_type = None
+        if error_type == "MessagesNotSent":
+            print(f"Inline embedding failed, falling back to staged: {error}")
+            return False
+        raise InlineEmbeddingUnknown(f"Inline embedding failed: {error}")
+
+    print(f"Embedded {len(processed_documents)} documents inline")
+    return True
+
+
+def park_failed_records(failures):
+    """
+    Keeps records that could not be processed under failed-records/ in the preprocessing bucket.
+
+    The pipe starts the state machine fire and forget, so nothing acts on
+    what the handler returns. Each object holds the Kinesis record as it was
+    received and the error, data/replay_failed_records.py puts them back on
+    the stream. A record that cannot be stored fails the execution instead
+    of being dropped.
+    """
+    date = datetime.now(timezone.utc).strftime("%Y/%m/%d")
+    for event, error in failures:
+        s3_key = (
+            f"{FAILED_RECORDS_PREFIX}{date}/"
+            f"{event.get('sequenceNumber') or uuid.uuid4()}.json"
+        )
+        print(f"Parking failed record at {PREPROCESS_BUCKET}/{s3_key}: {error}")
+        get_client("s3").put_object(
+            Bucket=PREPROCESS_BUCKET,
+            Key=s3_key,
+            Body=json.dumps({"record": event, "error": error}),
+        )
+
+
+# Events are the Kinesis records of the batch, all of them are processed
 def handler(events, context):
-    event = events[0]
-    print("EVENT: ", event)
-
-    encrypted_list = event["data"]
-    document_json = base64.b64decode(encrypted_list).decode("utf-8")
-
-    document_list = json.loads(document_json)
-    print("Document List: ", document_list)
+    print("Number of records: ", len(events))
     s3_key_list = []
-
-    for doc in document_list:
-        processed_data = process_data(doc)
-
-        print("Processed Data:")
-        print(processed_data)
-
-        s3_key = processed_data["id"] + ".json"
-        json_data = json.dumps(processed_data)
-        print("Pushing data to ", PREPROCESS_BUCKET + "/" + s3_key)
-        s3_client.put_object(Bucket=PREPROCESS_BUCKET, Key=s3_key, Body=json_data)
-
-        s3_key_list.append(s3_key)
-
+    failed_records = []
+    batched = HANDOFF_FORMAT == "batch"
+    # Processed documents and the records they came from, uploaded together in batch mode
+    processed_documents = []
+    batched_records = []
+    # Originals in the near-duplicate index, taken out again if they are parked
+    originals = []
+
+    # Lambda has no /dev/shm so process pools are unavailable, threads also overlap the S3 calls
+    with ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS) as executor:
+        submitted = []
+        for event in events:
+            try:
+                document_list = decode_record(event)
+            except (KeyError, ValueError) as e:
+                print(f"Could not decode record {event.get('sequenceNumber')}: {e}")
+                failed_records.append((event, f"Could not decode record: {e}"))
+                continue
+            worker = process_document if batched else process_and_upload
+            futures = [executor.submit(worker, doc) for doc in document_list]
+            submitted.append((event, futures))
+
+        for event, futures in submitted:
+            errors = []
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(
+                        f"Failed to process document in record {event.get('sequenceNumber')}: {e}"
+                    )
+                    errors.append(str(e))
+            if errors:
+                failed_records.append(
+                    (event, "Failed to process documents: " + "; ".join(errors))
+                )
+            elif batched:
+                # Copies of originals in this batch travel, or are parked, with them
+                for processed_data, signature in results:
+                    if mark_near_duplicate(processed_data, signature):
+                        originals.append(processed_data["id"])
+                    processed_documents.append(processed_data)
+                batched_records.append(event)
+            else:
+                for s3_key, doc_id, signature in results:
+                    s3_key_list.append(s3_key)
+                    if signature is not None:
+                        with near_duplicate_lock:
+                            near_duplicate_index.add(doc_id, signature)
+
+    staged = False
+    if processed_documents:
+        try:
+            staged = not embed_inline(processed_documents)
+        except InlineEmbeddingUnknown as e:
+            # Check the consumer before replaying these, some may be clustered
+            print(e)
+            failed_records.extend((event, str(e)) for event in batched_records)
+            near_duplicate_index.remove(originals)
+    if staged:
+        try:
+            s3_key_list.append(upload_batch(processed_documents))
+        except Exception as e:
+            print(f"Failed to upload batch: {e}")
+            failed_records.extend(
+                (event, f"Failed to upload batch: {e}") for event in batched_records
+            )
+            near_duplicate_index.remove(originals)
+
+    print(
+        f"Near duplicates: {near_duplicate_index.stats['duplicates']} of "
+        f"{near_duplicate_index.stats['documents']} documents, duplicate rate "
+        f"{near_duplicate_index.duplicate_rate():.1%} since start"
+    )
     print("End of function: ", s3_key_list)
-    return s3_key_list
+    print("Failed records: ", len(failed_records))
+    park_failed_records(failed_records)
+    return {"s3_keys": s3_key_list}
@@ -0,0 +1,102 @@
+import gzip
+import json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Envelope header: magic, format version, codec. Legacy records are a bare JSON list
+MAGIC = b"NC"
+VERSION = 1
+CODEC_GZIP = 1
+CODEC_ZSTD = 2
+CODECS = {"gzip": CODEC_GZIP, "zstd": CODEC_ZSTD}
+HEADER_BYTES = len(MAGIC) + 2
+KINESIS_MAX_RECORD_BYTES = 1024 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 9
+
+
+def default_codec():
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def compress(payload, codec):
+    if codec == "gzip":
+        return gzip.compress(payload, compresslevel=GZIP_LEVEL, mtime=0)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd records need the zstandard package")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(payload)
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def decompress(payload, codec_id):
+    if codec_id == CODEC_GZIP:
+        return gzip.decompress(payload)
+    if codec_id == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd records need the zstandard package")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(payload)
+    raise ValueError(f"Unknown record codec {codec_id}")
+
+
+def encode_record(serialized_articles, codec):
+    # Articles are JSON strings, serialized once by the caller
+    payload = ("[" + ",".join(serialized_articles) + "]").encode("utf-8")
+    return MAGIC + bytes([VERSION, CODECS[codec]]) + compress(payload, codec)
+
+
+def decode_record_data(data):
+    """
+    Returns the list of articles in a record, enveloped or legacy plain JSON.
+    """
+    if not data.startswith(MAGIC):
+        return json.loads(data.decode("utf-8"))
+    version, codec_id = data[len(MAGIC)], data[len(MAGIC) + 1]
+    if version != VERSION:
+        raise ValueError(f"Unsupported record format version {version}")
+    return json.loads(decompress(data[HEADER_BYTES:], codec_id).decode("utf-8"))
+
+
+def pack_records(articles, max_record_bytes=KINESIS_MAX_RECORD_BYTES, codec=None):
+    """
+    Packs articles into as few compressed records as fit under max_record_bytes.
+
+    Records are filled on the compression ratio seen so far, and a record
+    that still comes out too large is split in two. Articles too large for a
+    record of their own are skipped and returned separately.
+    Returns (records, skipped), records being (bytes, article count) pairs.
+    """
+    codec = codec or default_codec()
+    records, skipped = [], []
+    # Conservative until the first record is measured
+    ratio = 0.5
+
+    def emit(serialized):
+        nonlocal ratio
+        record = encode_record(serialized, codec)
+        if len(record) <= max_record_bytes:
+            ratio = len(record) / sum(len(s) + 1 for s in serialized)
+            records.append((record, len(serialized)))
+        elif len(serialized) == 1:
+            skipped.append(serialized[0])
+        else:
+            middle = len(serialized) // 2
+            emit(serialized[:middle])
+            emit(serialized[middle:])
+
+    current, current_bytes = [], 0
+    for article in articles:
+        serialized = json.dumps(article)
+        article_bytes = len(serialized) + 1
+        # Margin for the ratio varying between records
+        if current and (current_bytes + article_bytes) * ratio * 1.1 > max_record_bytes:
+            emit(current)
+            current, current_bytes = [], 0
+        current.append(serialized)
+        current_bytes += article_bytes
+    if current:
+        emit(current)
+    return records, [json.loads(s) for s in skipped]
@@ -0,0 +1,246 @@
+import re
+from html.entities import html5
+from html.parser import HTMLParser
+
+# Patterns are compiled once per container instead of once per call
+NON_TEXT_PATTERN = re.compile(r'[^:a-zA-Z0-9\s"\'-]')
+DECIMAL_REFERENCE_PATTERN = re.compile(r"^([0-9]+)(.*)")
+HEX_REFERENCE_PATTERN = re.compile(r"^([0-9a-f]+)(.*)")
+# Plain start and end tags, anything fancier goes through the full parser
+SIMPLE_TAG_PATTERN = re.compile(
+    r"<(?:([a-zA-Z][a-zA-Z0-9]*)"
+    r"(?:\s+[a-zA-Z_:][-a-zA-Z0-9_:.]*"
+    r"(?:\s*=\s*(?:\"[^\"<>]*\"|'[^'<>]*'|[^\s\"'<>=`]+))?)*\s*/?"
+    r"|/([a-zA-Z][a-zA-Z0-9]*)\s*)>"
+)
+SIMPLE_REFERENCE_PATTERN = re.compile(
+    r"&(#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);"
+)
+
+# The tables below reproduce BeautifulSoup(text, "html.parser").get_text()
+# Named entities, first spelling wins when one appears with and without ";"
+ENTITY_TO_CHARACTER = {}
+for _name, _character in sorted(html5.items()):
+    ENTITY_TO_CHARACTER.setdefault(_name.rstrip(";"), _character)
+
+# Numeric references in the C1 range are read as Windows-1252 bytes
+WINDOWS_1252_REFERENCES = {}
+for _numeric in range(0x80, 0xA0):
+    try:
+        WINDOWS_1252_REFERENCES[_numeric] = bytes([_numeric]).decode("cp1252")
+    except UnicodeDecodeError:
+        pass
+
+NONCHARACTERS = {
+    plane + offset
+    for plane in range(0, 0x110000, 0x10000)
+    for offset in (0xFFFE, 0xFFFF)
+}
+REPLACEMENT_CHARACTER = "\ufffd"
+
+VOID_ELEMENTS = {
+    "area", "base", "basefont", "bgsound", "br", "col", "command", "embed",
+    "frame", "hr", "image", "img", "input", "isindex", "keygen", "link",
+    "menuitem", "meta", "nextid", "param", "source", "spacer", "track", "wbr",
+}  # fmt: skip
+PRESERVE_WHITESPACE_ELEMENTS = {"pre", "textarea"}
+# Text directly inside these is not part of the visible text
+NON_TEXT_ELEMENTS = {"rt", "rp", "style", "script", "template"}
+ASCII_SPACES = " \n\t\x0c\r"
+# Elements whose content html.parser tokenizes specially, in some Python version
+SPECIAL_CONTENT_ELEMENTS = NON_TEXT_ELEMENTS | PRESERVE_WHITESPACE_ELEMENTS | {
+    "iframe", "noembed", "noframes", "noscript", "plaintext", "title", "xmp",
+}  # fmt: skip
+
+
+def numeric_reference_to_character(numeric):
+    if numeric == 0 or numeric > 0x10FFFF or 0xD800 <= numeric <= 0xDFFF:
+        return REPLACEMENT_CHARACTER
+    if 0xFDD0 <= numeric <= 0xFDEF or numeric in NONCHARACTERS:
+        return chr(numeric)
+    return WINDOWS_1252_REFERENCES.get(numeric, chr(numeric))
+
+
+def decode_reference(match):
+    name = match.group(1)
+    if name[0] != "#":
+        return ENTITY_TO_CHARACTER.get(name, "&" + name)
+    if name[1] in ("x", "X"):
+        return numeric_reference_to_character(int(name[2:], 16))
+    return numeric_reference_to_character(int(name[1:]))
+
+
+def collapse_whitespace(data):
+    if not data.strip(ASCII_SPACES):
+        return "\n" if "\n" in data else " "
+    return data
+
+
+def remove_simple_tags(text):
+    """
+    Regex fast path for markup made only of plain tags and references.
+
+    Every tag ends a text segment, exactly as in the full parser. Returns None
+    when the markup needs the full parser.
+    """
+    segments = []
+    position = 0
+    for match in SIMPLE_TAG_PATTERN.finditer(text):
+        start_tag, end_tag = match.groups()
+        name = (start_tag or end_tag).lower()
+        if name in SPECIAL_CONTENT_ELEMENTS or (end_tag and name in VOID_ELEMENTS):
+            return None
+        segments.append(text[position : match.start()])
+        position = match.end()
+    segments.append(text[position:])
+
+    output = []
+    for segment in segments:
+        if not segment:
+            continue
+        if "<" in segment:
+            return None
+        if "&" in segment:
+            decoded, references = SIMPLE_REFERENCE_PATTERN.subn(
+                decode_reference, segment
+            )
+            # A stray ampersand, let the full parser decide what it is
+            if segment.count("&") != references:
+                return None
+            segment = decoded
+        output.append(collapse_whitespace(segment))
+    return "".join(output)
+
+
+class TagStripper(HTMLParser):
+    """
+    Streaming HTML to text converter.
+
+    Keeps only the state needed to decide which strings are visible text,
+    instead of building a tree, and gives the same output as BeautifulSoup's
+    get_text() with the html.parser backend.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.output = []
+        self.current_data = []
+        self.open_tags = []
+        # Void elements closed at their start tag, a later explicit end tag is ignored
+        self.already_closed = []
+
+    def flush(self, kind="text"):
+        # kind is "text", "cdata" or "markup" (comments, declarations, instructions)
+        if not self.current_data:
+            return
+        data = "".join(self.current_data)
+        self.current_data = []
+
+        if not PRESERVE_WHITESPACE_ELEMENTS.intersection(self.open_tags):
+            data = collapse_whitespace(data)
+
+        if kind == "cdata" or (
+            kind == "text" and not NON_TEXT_ELEMENTS.intersection(self.open_tags)
+        ):
+            self.output.append(data)
+
+    def handle_starttag(self, tag, attrs, handle_void_element=True):
+        self.flush()
+        self.open_tags.append(tag)
+        if handle_void_element and tag in VOID_ELEMENTS:
+            self.handle_endtag(tag, check_already_closed=False)
+            self.already_closed.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, handle_void_element=False)
+        self.handle_endtag(tag, check_already_closed=False)
+
+    def handle_endtag(self, tag, check_already_closed=True):
+        if check_already_closed and tag in self.already_closed:
+            self.already_closed.remove(tag)
+            return
+        self.flush()
+        # Close the most recent matching tag and everything opened after it
+        for i in range(len(self.open_tags) - 1, -1, -1):
+            if self.open_tags[i] == tag:
+                del self.open_tags[i:]
+                break
+
+    def handle_data(self, data):
+        self.current_data.append(data)
+
+    def handle_entityref(self, name):
+        # Unknown entities are kept as literal text, without the semicolon
+        self.current_data.append(ENTITY_TO_CHARACTER.get(name, "&" + name))
+
+    def handle_charref(self, name):
+        base, pattern = 10, DECIMAL_REFERENCE_PATTERN
+        if name[:1] in ("x", "X"):
+            name, base, pattern = name[1:], 16, HEX_REFERENCE_PATTERN
+
+        extra_data = ""
+        try:
+            numeric = int(name, base)
+        except ValueError:
+            # Unterminated reference followed by ordinary text
+            match = pattern.search(name)
+            if match is None:
+                self.current_data.append(name)
+                return
+            numeric = int(match.group(1), base)
+            extra_data = match.group(2)
+
+        self.current_data.append(numeric_reference_to_character(numeric))
+        if extra_data:
+            self.current_data.append(extra_data)
+
+    def handle_comment(self, data):
+        self.flush()
+        self.current_data.append(data)
+        self.flush("markup")
+
+    def handle_decl(self, decl):
+        self.flush()
+        self.current_data.append(decl)
+        self.flush("markup")
+
+    def handle_pi(self, data):
+        self.flush()
+        self.current_data.append(data)
+        self.flush("markup")
+
+    def unknown_decl(self, data):
+        self.flush()
+        # CDATA sections are text, other declarations are not
+        if data.upper().startswith("CDATA["):
+            self.current_data.append(data[len("CDATA[") :])
+            self.flush("cdata")
+        else:
+            self.current_data.append(data)
+            self.flush("markup")
+
+    def get_text(self):
+        self.flush()
+        return "".join(self.output)
+
+
+def remove_tags(text: str):
+    # Most fields (dates, titles) hold no markup at all
+    if "<" not in text and "&" not in text:
+        return collapse_whitespace(text) if text else text
+
+    simple_text = remove_simple_tags(text)
+    if simple_text is not None:
+        return simple_text
+
+    stripper = TagStripper()
+    stripper.feed(text)
+    stripper.close()
+    return stripper.get_text()
+
+
+def clean_text(text):
+    # apply to title
+    text = text.replace("&quot;", '"')
+    text = NON_TEXT_PATTERN.sub("", text)
+    return text
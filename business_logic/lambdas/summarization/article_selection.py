@@ -0,0 +1,73 @@
+import numpy as np
+
+# Encodings of the embedding attribute the stream consumer writes on ARTICLE# items
+EMBEDDING_DTYPES = {"float32": "<f4", "float16": "<f2"}
+
+
+def article_embedding(article):
+    blob = article.get("embedding")
+    dtype = EMBEDDING_DTYPES.get(article.get("embedding_dtype", "float16"))
+    if blob is None or dtype is None:
+        return None
+    # boto3 returns Binary attributes wrapped, the raw bytes are in .value
+    blob = getattr(blob, "value", blob)
+    return np.frombuffer(bytes(blob), dtype=dtype).astype(np.float32)
+
+
+def recency_key(article):
+    return article.get("publication_date") or ""
+
+
+def mmr_order(embeddings, k, diversity):
+    """
+    Orders up to k rows by maximal marginal relevance to their centroid.
+
+    Relevance is the cosine similarity to the centroid of the rows, redundancy
+    the highest similarity to a row already chosen. diversity of 0 keeps the
+    k rows closest to the centroid, 1 ignores the centroid after the first pick.
+    """
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.maximum(norms, 1e-12)
+    centroid = unit.mean(axis=0)
+    centroid /= max(np.linalg.norm(centroid), 1e-12)
+    relevance = unit @ centroid
+
+    chosen = [int(np.argmax(relevance))]
+    redundancy = unit @ unit[chosen[0]]
+    available = np.ones(len(unit), dtype=bool)
+    available[chosen[0]] = False
+    while len(chosen) < min(k, len(unit)):
+        scores = (1 - diversity) * relevance - diversity * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        chosen.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, unit @ unit[best])
+    return chosen
+
+
+def select_representative_articles(articles, k, diversity=0.3):
+    """
+    Keeps the k articles that best represent the cluster, most representative first.
+
+    Articles with a stored embedding are ranked with mmr_order. Articles
+    without one, written before embeddings were stored or filed as
+    near-duplicates, only fill the remaining places, newest first.
+    """
+    if len(articles) <= k:
+        return articles
+
+    embedded, embeddings, unembedded = [], [], []
+    for article in articles:
+        embedding = article_embedding(article)
+        if embedding is None or (embeddings and len(embedding) != len(embeddings[0])):
+            unembedded.append(article)
+        else:
+            embedded.append(article)
+            embeddings.append(embedding)
+
+    selected = []
+    if embedded:
+        selected = [embedded[i] for i in mmr_order(np.stack(embeddings), k, diversity)]
+    unembedded.sort(key=recency_key, reverse=True)
+    return selected + unembedded[: k - len(selected)]
@@ -0,0 +1,116 @@
+import queue
+import threading
+
+from boto3.dynamodb.conditions import Attr, Key
+
+# Article attributes summarization reads, the article text stays in the table
+ARTICLE_ATTRIBUTES = [
+    "title",
+    "summary",
+    "embedding",
+    "embedding_dtype",
+    "publication_date",
+    "entry_creation_date",
+    "locations",
+    "organizations",
+]
+METADATA_ATTRIBUTES = [
+    "description",
+    "generated_summary",
+    "summary_count",
+    "summarized_through",
+    "number_of_articles",
+    "updated_at",
+    "location_counts",
+    "organization_counts",
+    "centroid",
+    "centroid_dtype",
+    "most_common_location",
+    "most_common_organization",
+    "earliest_date",
+    "latest_date",
+]
+# Pages read ahead of the caller
+PREFETCH_PAGES = 2
+
+
+def projection(attributes):
+    # Placeholders avoid clashes with DynamoDB reserved words
+    return {
+        "ProjectionExpression": ", ".join(f"#f{i}" for i in range(len(attributes))),
+        "ExpressionAttributeNames": {
+            f"#f{i}": attribute for i, attribute in enumerate(attributes)
+        },
+    }
+
+
+def get_cluster_metadata(table, cluster_id):
+    response = table.get_item(
+        Key={"PK": cluster_id, "SK": f"#METADATA#{cluster_id}"},
+        **projection(METADATA_ATTRIBUTES),
+    )
+    return response.get("Item", {})
+
+
+def query_article_pages(table, cluster_id, since=None, page_size=None):
+    # Articles written after `since`, an entry_creation_date, or all of them
+    query_args = {
+        "KeyConditionExpression": Key("PK").eq(cluster_id)
+        & Key("SK").begins_with("ARTICLE#"),
+        **projection(ARTICLE_ATTRIBUTES),
+    }
+    if since:
+        query_args["FilterExpression"] = Attr("entry_creation_date").gt(since)
+    if page_size:
+        query_args["Limit"] = page_size
+
+    while True:
+        response = table.query(**query_args)
+        yield response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def iter_article_pages(table, cluster_id, since=None, page_size=None):
+    """
+    Yields the cluster's articles a page at a time, reading the next pages in the background.
+
+    While the caller works on one page, up to PREFETCH_PAGES more are
+    queried. A failed query is raised from the page it would have returned.
+    """
+    pages = queue.Queue(maxsize=PREFETCH_PAGES)
+    done = object()
+    stop = threading.Event()
+
+    def offer(item):
+        # Gives up once the caller has stopped reading
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for page in query_article_pages(table, cluster_id, since, page_size):
+                if not offer(page):
+                    return
+            offer(done)
+        except Exception as e:
+            offer(e)
+
+    threading.Thread(target=read, daemon=True).start()
+    try:
+        while True:
+            page = pages.get()
+            if page is done:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        # The caller stopped early, let the reader go
+        stop.set()
@@ -0,0 +1,138 @@
+import math
+import re
+
+# Words, numbers and single punctuation marks, roughly how BPE tokenizers split text
+PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+# Longer words are split into several tokens, about this many characters each
+CHARS_PER_WORD_TOKEN = 6
+# Headroom over the local estimate, the model's own tokenizer decides in the end
+ESTIMATE_MARGIN = 1.1
+
+
+def estimate_tokens(text):
+    """
+    Approximates the token count of text without a tokenizer.
+
+    Counts one token per punctuation mark and one per started
+    CHARS_PER_WORD_TOKEN characters of each word, plus ESTIMATE_MARGIN.
+    """
+    pieces = PIECE_PATTERN.findall(text)
+    tokens = sum(1 + (len(piece) - 1) // CHARS_PER_WORD_TOKEN for piece in pieces)
+    return math.ceil(tokens * ESTIMATE_MARGIN)
+
+
+def format_article(article):
+    return f"title: {article.get('title')}, summary: {article.get('summary') or ''}"
+
+
+def truncate_to_tokens(text, max_tokens):
+    # Longest prefix within max_tokens, estimates only grow with the prefix
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def fit_article(article, max_tokens):
+    """
+    Returns the article with its summary, then its title, cut to fit max_tokens in a prompt.
+
+    None when not even an empty article fits.
+    """
+    empty_tokens = estimate_tokens(format_article({"title": "", "summary": ""}) + "\n")
+    room = max_tokens - empty_tokens
+    if room < 0:
+        return None
+    title = truncate_to_tokens(article.get("title") or "", room)
+    room -= estimate_tokens(title)
+    summary = truncate_to_tokens(article.get("summary") or "", room)
+    fitted = {**article, "title": title, "summary": summary}
+    # The estimate of the joined line can exceed the sum of its parts by a token or two
+    while (
+        estimate_tokens(format_article(fitted) + "\n") > max_tokens
+        and fitted["summary"]
+    ):
+        fitted["summary"] = fitted["summary"][:-1]
+    if estimate_tokens(format_article(fitted) + "\n") > max_tokens:
+        return None
+    return fitted
+
+
+def prompt_frame(instructions, previous_summary):
+    head = f"{instructions} <story> \n{previous_summary} </story> \n\n <context>\n"
+    tail = "</context>\n"
+    return head, tail
+
+
+def build_prompt(instructions, previous_summary, articles, token_budget):
+    """
+    Packs whole articles, in the given priority order, into a prompt of at most token_budget tokens.
+
+    The instructions, the previous summary and the tags around them are
+    reserved first. Articles that do not fit are skipped, so a later shorter
+    one can still use the room left. When none fits, the first one is cut to
+    the room left instead. Returns the prompt, its estimated token count and
+    the articles included, as given, empty when not even that fits.
+    """
+    head, tail = prompt_frame(instructions, previous_summary)
+    used = estimate_tokens(head) + estimate_tokens(tail)
+
+    lines, included = [], []
+    for article in articles:
+        line = format_article(article) + "\n"
+        line_tokens = estimate_tokens(line)
+        if used + line_tokens > token_budget:
+            continue
+        lines.append(line)
+        included.append(article)
+        used += line_tokens
+    if not lines and articles:
+        fitted = fit_article(articles[0], token_budget - used)
+        if fitted is not None:
+            lines.append(format_article(fitted) + "\n")
+            included.append(articles[0])
+            used += estimate_tokens(lines[0])
+
+    return head + "".join(lines) + tail, used, included
+
+
+def chunk_articles(instructions, articles, token_budget, max_chunks):
+    """
+    Splits articles into at most max_chunks runs that each fit one prompt with no previous summary.
+
+    Keeps the priority order, so articles beyond the last chunk are the
+    least representative ones. An article too large for a prompt of its own
+    gets a chunk to itself, build_prompt cuts it to fit.
+    """
+    head, tail = prompt_frame(instructions, "")
+    reserved = estimate_tokens(head) + estimate_tokens(tail)
+
+    chunks, current, used = [], [], reserved
+    for article in articles:
+        line_tokens = estimate_tokens(format_article(article) + "\n")
+        if reserved + line_tokens > token_budget:
+            fitted = fit_article(article, token_budget - reserved)
+            if fitted is None:
+                continue
+            line_tokens = estimate_tokens(format_article(fitted) + "\n")
+        if current and used + line_tokens > token_budget:
+            chunks.append(current)
+            if len(chunks) == max_chunks:
+                return chunks
+            current, used = [], reserved
+        current.append(article)
+        used += line_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def estimate_cost(input_tokens, output_tokens, input_price, output_price):
+    # Prices are per 1000 tokens
+    return input_tokens / 1000 * input_price + output_tokens / 1000 * output_price
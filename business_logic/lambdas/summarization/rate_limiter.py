@@ -0,0 +1,205 @@
+import math
+import random
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+# Seconds of the per-minute rate a full bucket holds, the largest burst allowed
+BURST_SECONDS = 10
+# Share of each bucket only the highest priority callers may use
+LOW_PRIORITY_RESERVE = 0.3
+# Clusters this large get the full size score
+LARGE_CLUSTER_ARTICLES = 100
+RECENCY_HALF_LIFE_HOURS = 6
+MAX_CONFLICT_RETRIES = 10
+
+
+class CapacityUnavailable(Exception):
+    """
+    Raised when the model capacity could not be acquired in time.
+
+    The summary state machine retries it with jittered backoff.
+    """
+
+
+def summary_priority(number_of_articles, updated_at=None, now=None):
+    """
+    Scores a cluster between 0 and 1, larger and recently updated clusters first.
+    """
+    size = min(1.0, math.log1p(number_of_articles) / math.log1p(LARGE_CLUSTER_ARTICLES))
+    recency = 1.0
+    if updated_at:
+        try:
+            age = (now or datetime.now()) - datetime.fromisoformat(updated_at)
+            recency = 0.5 ** max(
+                age.total_seconds() / 3600 / RECENCY_HALF_LIFE_HOURS, 0
+            )
+        except ValueError:
+            pass
+    return size * (0.5 + 0.5 * recency)
+
+
+class InMemoryBucketStore:
+    """
+    Bucket state for a single process and local runs, same interface as DynamoDBBucketStore.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = None
+        self.version = 0
+
+    def load(self):
+        with self.lock:
+            return self.state, self.version
+
+    def save(self, state, version):
+        with self.lock:
+            if version != self.version:
+                return False
+            self.state = state
+            self.version += 1
+            return True
+
+
+class DynamoDBBucketStore:
+    """
+    Bucket state in one item, shared by every summarization Lambda.
+
+    Writes are conditional on the version read, so concurrent callers never
+    both spend the same capacity.
+    """
+
+    def __init__(self, table, key):
+        self.table = table
+        self.key = key
+
+    def load(self):
+        item = self.table.get_item(Key=self.key, ConsistentRead=True).get("Item")
+        if not item:
+            return None, 0
+        state = {
+            name: float(item[name]) for name in ("requests", "tokens", "updated_at")
+        }
+        return state, int(item["version"])
+
+    def save(self, state, version):
+        try:
+            self.table.update_item(
+                Key=self.key,
+                UpdateExpression="SET #requests = :requests, #tokens = :tokens, "
+                "#updated_at = :updated_at, #version = :next",
+                ConditionExpression="attribute_not_exists(#version) OR #version = :version",
+                ExpressionAttributeNames={
+                    f"#{name}": name
+                    for name in ("requests", "tokens", "updated_at", "version")
+                },
+                ExpressionAttributeValues={
+                    ":requests": Decimal(str(round(state["requests"], 3))),
+                    ":tokens": Decimal(str(round(state["tokens"], 3))),
+                    ":updated_at": Decimal(str(round(state["updated_at"], 3))),
+                    ":version": version,
+                    ":next": version + 1,
+                },
+            )
+            return True
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+
+class TokenBuckets:
+    """
+    Request and token buckets refilled at per-minute rates, kept in a store.
+
+    A caller with priority p may only take capacity while at least
+    LOW_PRIORITY_RESERVE * (1 - p) of each bucket stays available.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, store):
+        self.rates = {
+            "requests": requests_per_minute / 60,
+            "tokens": tokens_per_minute / 60,
+        }
+        self.capacity = {
+            name: rate * BURST_SECONDS for name, rate in self.rates.items()
+        }
+        self.store = store
+
+    def current(self, now):
+        state, version = self.store.load()
+        if state is None:
+            return dict(self.capacity), version
+        elapsed = max(now - state["updated_at"], 0)
+        levels = {
+            name: min(self.capacity[name], state[name] + rate * elapsed)
+            for name, rate in self.rates.items()
+        }
+        return levels, version
+
+    def update(self, change):
+        # change(levels) returns the new levels, or None to leave them
+        for _ in range(MAX_CONFLICT_RETRIES):
+            now = time.time()
+            levels, version = self.current(now)
+            new_levels = change(levels)
+            if new_levels is None:
+                return levels
+            if self.store.save({**new_levels, "updated_at": now}, version):
+                return None
+            time.sleep(random.uniform(0, 0.05))
+        raise CapacityUnavailable("Too much contention on the rate limit state")
+
+    def try_acquire(self, tokens, priority=1.0):
+        """
+        Takes one request and `tokens` tokens, returns 0 or the seconds to wait before trying again.
+        """
+        reserve = LOW_PRIORITY_RESERVE * (1 - priority)
+        # A call larger than the usable bucket still has to go through eventually
+        usable_tokens = self.capacity["tokens"] * (1 - reserve)
+        cost = {"requests": 1, "tokens": min(tokens, usable_tokens)}
+
+        def take(levels):
+            if all(
+                levels[name] - cost[name] >= reserve * self.capacity[name]
+                for name in cost
+            ):
+                return {name: levels[name] - cost[name] for name in cost}
+            return None
+
+        levels = self.update(take)
+        if levels is None:
+            return 0
+        return max(
+            (cost[name] + reserve * self.capacity[name] - levels[name])
+            / self.rates[name]
+            for name in cost
+        )
+
+    def acquire(self, tokens, priority=1.0, max_wait=60):
+        deadline = time.time() + max_wait
+        while True:
+            wait = self.try_acquire(tokens, priority)
+            if wait == 0:
+                return
+            if time.time() + wait > deadline:
+                raise CapacityUnavailable(f"No model capacity within {max_wait} s")
+            # Jitter so waiting callers do not all come back at once
+            time.sleep(wait * random.uniform(1, 1.5))
+
+    def settle(self, estimated_tokens, actual_tokens):
+        # Returns what the estimate overcharged, or charges what it missed
+        delta = estimated_tokens - actual_tokens
+        if delta:
+            self.update(
+                lambda levels: {
+                    **levels,
+                    "tokens": min(self.capacity["tokens"], levels["tokens"] + delta),
+                }
+            )
+
+    def drain(self):
+        # The model throttled us, so the buckets were fuller than the real quota
+        self.update(
+            lambda levels: {name: min(level, 0) for name, level in levels.items()}
+        )
@@ -1,13 +1,98 @@
+import base64
 import json
 import os
+import functools
+import random
+import time
 import boto3
-from datetime import datetime
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from datetime import datetime, timedelta
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from article_selection import select_representative_articles
+from cluster_reader import (
+    get_cluster_metadata,
+    iter_article_pages,
+    query_article_pages,
+)
+from prompt_builder import build_prompt, chunk_articles, estimate_cost, estimate_tokens
+from rate_limiter import (
+    CapacityUnavailable,
+    DynamoDBBucketStore,
+    TokenBuckets,
+    summary_priority,
+)
 
-bedrock_client = boto3.client("bedrock-runtime")
-dynamodb = boto3.resource("dynamodb")
 model_id = os.environ["MODEL_ID"]
 table_name = os.environ["DYNAMODB_TABLE_NAME"]
+# Articles given to the model, picked for being close to the centroid yet not redundant
+SUMMARY_MAX_ARTICLES = int(os.environ.get("SUMMARY_MAX_ARTICLES", "25"))
+# Maximal marginal relevance trade-off, 0 ranks on centroid similarity alone
+SUMMARY_DIVERSITY = float(os.environ.get("SUMMARY_DIVERSITY", "0.3"))
+# Estimated input tokens per prompt, instructions and previous summary included
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "3000"))
+MAX_OUTPUT_TOKENS = 500
+# USD per 1000 tokens, for the cost estimate logged before each call
+INPUT_TOKEN_PRICE = float(os.environ.get("INPUT_TOKEN_PRICE", "0.00025"))
+OUTPUT_TOKEN_PRICE = float(os.environ.get("OUTPUT_TOKEN_PRICE", "0.00125"))
+# Clusters with at least this many articles to summarize are summarized in chunks, then merged
+MAP_REDUCE_MIN_ARTICLES = int(os.environ.get("MAP_REDUCE_MIN_ARTICLES", "40"))
+MAP_REDUCE_MAX_CHUNKS = int(os.environ.get("MAP_REDUCE_MAX_CHUNKS", "8"))
+MAP_REDUCE_WORKERS = int(os.environ.get("MAP_REDUCE_WORKERS", "4"))
+# Longest a consumer batch write can take plus clock skew, articles stamped this
+# close to the read may not have been visible yet and are read again next time
+SUMMARY_MARK_LAG_SECONDS = int(os.environ.get("SUMMARY_MARK_LAG_SECONDS", "120"))
+# Articles per query page, small pages let summarization start before the whole cluster is read
+CLUSTER_READ_PAGE_SIZE = int(os.environ.get("CLUSTER_READ_PAGE_SIZE", "50"))
+# Model quota shared by every summarization, 0 requests per minute turns the limiter off
+BEDROCK_REQUESTS_PER_MINUTE = int(os.environ.get("BEDROCK_REQUESTS_PER_MINUTE", "0"))
+BEDROCK_TOKENS_PER_MINUTE = int(os.environ.get("BEDROCK_TOKENS_PER_MINUTE", "0"))
+RATE_LIMIT_MAX_WAIT_SECONDS = int(os.environ.get("RATE_LIMIT_MAX_WAIT_SECONDS", "30"))
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "5"))
+# Left at the end of an invocation for the model call in progress and the reduce stage
+INVOCATION_RESERVE_SECONDS = int(os.environ.get("INVOCATION_RESERVE_SECONDS", "30"))
+# Error codes worth retrying, everything else fails the summary straight away
+RETRYABLE_ERRORS = {
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "InternalServerException",
+}
+INSTRUCTIONS = "You will be provided with multiple sets of titles and summaries from different articles in <context> tag, and the current title and summary for a story in <story> tag. Compile, summarize and update the current title and summary for the story. The summary should be less than 100 words. Put the generated context inside <title> and <summary> tag. Do not hallucinate or make up content.\n\n"
+
+
+# Time by which waiting for the model must stop, set by each invocation
+invocation_deadline = None
+
+
+# Clients are created on first use and reused by later invocations in the container
+@functools.lru_cache(maxsize=None)
+def get_bedrock_client():
+    # Retries are done by generate_bedrock_claude, in step with the rate limiter
+    return boto3.client(
+        "bedrock-runtime",
+        config=Config(retries={"mode": "standard", "max_attempts": 1}),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_table():
+    return boto3.resource("dynamodb").Table(table_name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_rate_limiter():
+    if BEDROCK_REQUESTS_PER_MINUTE <= 0:
+        return None
+    key = f"#RATE_LIMIT#{model_id}"
+    store = DynamoDBBucketStore(get_table(), {"PK": key, "SK": key})
+    # Without a token quota, one that never binds before the request quota does
+    tokens_per_minute = BEDROCK_TOKENS_PER_MINUTE or BEDROCK_REQUESTS_PER_MINUTE * (
+        PROMPT_TOKEN_BUDGET + MAX_OUTPUT_TOKENS
+    )
+    return TokenBuckets(BEDROCK_REQUESTS_PER_MINUTE, tokens_per_minute, store)
 
 
 def generate_average_cluster_data(articles):
@@ -61,61 +146,176 @@ def generate_average_cluster_data(articles):
     }
 
 
+def get_average_cluster_data_from_metadata(metadata):
+    # The stream consumer maintains these incrementally as articles are added
+    if "location_counts" not in metadata:
+        return None
+
+    return {
+        "most_common_location": metadata.get("most_common_location", ""),
+        "most_common_organization": metadata.get("most_common_organization", ""),
+        "earliest_date": metadata.get("earliest_date", ""),
+        "latest_date": metadata.get("latest_date", ""),
+    }
+
+
+def get_cluster_articles(cluster_id, since=None):
+    articles = []
+    for page in query_article_pages(get_table(), cluster_id, since):
+        articles.extend(page)
+    return articles
+
+
 def get_cluster_data(cluster_id):
-    # Initialize a DynamoDB client
-    table = dynamodb.Table(table_name)
+    metadata = get_cluster_metadata(get_table(), cluster_id)
+    summary_count = metadata.get("summary_count", 0)
+    previous_summary = metadata.get("generated_summary", "")
+
+    # Once summarized, only the articles past the high-water mark need to be read
+    summarized_through = metadata.get("summarized_through", "")
+    since = summarized_through if previous_summary else None
+    print(f"Reading articles added since {since or 'the start'}")
+    pages = iter_article_pages(get_table(), cluster_id, since, CLUSTER_READ_PAGE_SIZE)
+
+    return previous_summary, summary_count, pages, metadata
 
-    # Query the table
-    response = table.query(
-        KeyConditionExpression=boto3.dynamodb.conditions.Key("PK").eq(cluster_id),
+
+def summary_snapshot(metadata):
+    """
+    Cluster state the summary is made from, for the next change check in trigger_sfn.
+
+    Returned as DynamoDB attribute values and written by the state machine
+    together with the summary, so a summary that fails leaves the previous
+    snapshot in place. A missing centroid is written as empty, which the
+    change check treats as nothing to compare against.
+    """
+    centroid = metadata.get("centroid")
+    # Same entity names as change_significance.entities
+    entities = sorted(
+        f"{counter}:{name}"
+        for counter in ["location_counts", "organization_counts"]
+        for name in metadata.get(counter) or {}
     )
-    cluster_data = response.get("Items", [])
+    return {
+        "summary_entities": [{"S": entity} for entity in entities],
+        "summary_centroid": base64.b64encode(
+            getattr(centroid, "value", centroid) or b""
+        ).decode("ascii"),
+        "summary_centroid_dtype": metadata.get("centroid_dtype", "float16"),
+    }
 
-    # Extract the first item
-    metadata = cluster_data[0]
-    articles = cluster_data[1:]
-    summary_count = metadata.get("summary_count", 0)
 
-    return metadata.get("generated_summary", ""), summary_count, articles
+def high_water_mark(articles, included, previous_mark="", read_started_at=None):
+    """
+    Latest entry_creation_date the next summary can skip, ISO strings sort chronologically.
+
+    Only articles that made it into a prompt count. Articles read but left
+    out, by the selection, the prompt budget or the chunk limit, are read
+    again next time, so the mark stays below the earliest of them.
 
+    The consumer stamps articles before its batch write lands, so an article
+    stamped just before one that was read may not have been visible yet. The
+    mark never passes read_started_at minus SUMMARY_MARK_LAG_SECONDS, articles
+    in that window are summarized again rather than missed.
+    """
+    included_ids = {id(article) for article in included}
+    left_out = [
+        article.get("entry_creation_date") or ""
+        for article in articles
+        if id(article) not in included_ids
+    ]
+    marks = [article.get("entry_creation_date") or "" for article in included]
+    if left_out:
+        marks = [mark for mark in marks if mark < min(left_out)]
+    mark = max(marks + [""])
+    if read_started_at is not None:
+        safe_mark = read_started_at - timedelta(seconds=SUMMARY_MARK_LAG_SECONDS)
+        mark = min(mark, safe_mark.isoformat())
+    return max(mark, previous_mark or "")
 
-def generate_bedrock_claude(input_tokens):
+
+def wait_budget():
+    """
+    Seconds the current invocation can still wait for model capacity.
+
+    Waiting never runs into the Lambda timeout, which the state machine
+    could not tell from a failed summary. CapacityUnavailable is raised
+    instead and retried there with backoff.
+    """
+    if invocation_deadline is None:
+        return RATE_LIMIT_MAX_WAIT_SECONDS
+    return max(0, min(RATE_LIMIT_MAX_WAIT_SECONDS, invocation_deadline - time.time()))
+
+
+def read_bedrock_response(bedrock_response):
+    rd = bedrock_response.get("body").read()
+    body_json = json.loads(rd)
+    response = "".join(block.get("text", "") for block in body_json.get("content", []))
+    if not response:
+        print(rd)
+    # Token counts from the headers, or from the usage in the body without them
+    headers = bedrock_response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    usage = body_json.get("usage", {})
+    input_token_cnt = int(
+        headers.get("x-amzn-bedrock-input-token-count") or usage.get("input_tokens", 0)
+    )
+    output_token_cnt = int(
+        headers.get("x-amzn-bedrock-output-token-count")
+        or usage.get("output_tokens", 0)
+    )
+    return input_token_cnt, output_token_cnt, response
+
+
+def generate_bedrock_claude(input_tokens, estimated_tokens=None, priority=1.0):
+    limiter = get_rate_limiter()
+    # Charged up front for each attempt, then settled on what the attempt used
+    cost = (estimated_tokens or estimate_tokens(input_tokens)) + MAX_OUTPUT_TOKENS
     claude_body = {
         "modelId": model_id,
         "body": json.dumps(
             {
                 "anthropic_version": "bedrock-2023-05-31",
                 "messages": [{"role": "user", "content": input_tokens}],
-                "max_tokens": 500,  # the higher this is the longer it takes
+                "max_tokens": MAX_OUTPUT_TOKENS,  # the higher this is the longer it takes
                 "temperature": 0.1,  # these parameters affect response diversity
                 "top_p": 1,
                 "top_k": 100,
             }
         ),
     }
-    bedrock_response = bedrock_client.invoke_model(
-        **claude_body,
-        accept="*/*",
-        contentType="application/json",
-    )
-    body = bedrock_response.get("body")
-    rd = body.read()
-    body_json = json.loads(rd)
-    try:
-        response = body_json["content"][0].get("text")
-        output_token_cnt = int(
-            bedrock_response["ResponseMetadata"]["HTTPHeaders"].get(
-                "x-amzn-bedrock-output-token-count"
+    for attempt in range(BEDROCK_MAX_ATTEMPTS):
+        if limiter is not None:
+            limiter.acquire(cost, priority, wait_budget())
+        # Tokens the attempt used, a failed attempt gets its whole charge back
+        used = 0
+        try:
+            bedrock_response = get_bedrock_client().invoke_model(
+                **claude_body,
+                accept="*/*",
+                contentType="application/json",
             )
-        )
-        input_token_cnt = int(
-            bedrock_response["ResponseMetadata"]["HTTPHeaders"].get(
-                "x-amzn-bedrock-input-token-count"
+            input_token_cnt, output_token_cnt, response = read_bedrock_response(
+                bedrock_response
             )
-        )
-    except Exception:
-        print(rd)
-    return input_token_cnt, output_token_cnt, response
+            used = input_token_cnt + output_token_cnt
+            return input_token_cnt, output_token_cnt, response
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in RETRYABLE_ERRORS:
+                raise
+            error = e
+        finally:
+            if limiter is not None:
+                limiter.settle(cost, used)
+        if code == "ThrottlingException" and limiter is not None:
+            limiter.drain()
+        # Full jitter so concurrent summaries do not retry in lockstep
+        delay = random.uniform(0, 0.5 * 2**attempt)
+        if attempt == BEDROCK_MAX_ATTEMPTS - 1 or delay > wait_budget():
+            # The state machine retries the whole summary later
+            raise CapacityUnavailable(f"{code} after {attempt + 1} attempts") from error
+        print(f"{code}, retrying in {delay:.2f} s (attempt {attempt + 1})")
+        time.sleep(delay)
 
 
 def parse_res(res):
@@ -127,26 +327,158 @@ def parse_res(res):
         return "<Title>", res
 
 
-def generate_cluster_summary(previous_summary, articles, limit):
-    input_context = []
-    # If we've done summaries before we'll limit the input tokens for each summary
-    limit_number = 2000
-    if limit:
-        limit_number = 1500
-    instructions = "You will be provided with multiple sets of titles and summaries from different articles in <context> tag, and the current title and summary for a story in <story> tag. Compile, summarize and update the current title and summary for the story. The summary should be less than 100 words. Put the generated context inside <title> and <summary> tag. Do not hallucinate or make up content.\n\n"
-    texts = "\n".join(
-        [
-            f"title: {article.get('title')}, summary: {article.get('summary', "")[:limit_number]}"
-            for article in articles
-        ]
-    )
-    prompt = f"{instructions} <story> \n{previous_summary} </story> \n\n <context>\n{texts}\n</context>\n"
-    print("Prompt Length:", len(prompt))
-    input_context.append(prompt)
-    output = generate_bedrock_claude(prompt[:12000])
+def summarize_articles(previous_summary, articles, priority=1.0):
+    """
+    Summarizes articles into an update of previous_summary with one model call.
+
+    Returns the title and summary, the token usage of the call and the
+    articles that made it into the prompt. The summary is None, and the
+    model is not called, when no article fits the prompt next to the
+    previous summary.
+    """
+    prompt, estimated_tokens, included = build_prompt(
+        INSTRUCTIONS, previous_summary, articles, PROMPT_TOKEN_BUDGET
+    )
+    if not included:
+        print(
+            f"No room for any of {len(articles)} articles in the prompt, not summarized"
+        )
+        usage = {
+            "calls": 0,
+            "articles": 0,
+            "estimated_input_tokens": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+        }
+        return None, usage, included
+    estimated_cost = estimate_cost(
+        estimated_tokens, MAX_OUTPUT_TOKENS, INPUT_TOKEN_PRICE, OUTPUT_TOKEN_PRICE
+    )
+    print(
+        f"Prompt: {len(included)} of {len(articles)} articles, {len(prompt)} characters, "
+        f"~{estimated_tokens} of {PROMPT_TOKEN_BUDGET} tokens, at most ${estimated_cost:.5f}"
+    )
+    output = generate_bedrock_claude(prompt, estimated_tokens, priority)
+    # Keeps an eye on how far the local estimate is from the model's tokenizer
+    print(
+        f"Input tokens: {output[0]} actual, {estimated_tokens} estimated; "
+        f"output tokens: {output[1]}"
+    )
     title, summary = parse_res(output[2])
 
-    return {"title": title, "summary": summary}
+    usage = {
+        "calls": 1,
+        "articles": len(included),
+        "estimated_input_tokens": estimated_tokens,
+        "input_tokens": output[0],
+        "output_tokens": output[1],
+    }
+    return {"title": title, "summary": summary}, usage, included
+
+
+def add_usage(total, usage):
+    for key, value in usage.items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+
+def print_usage(stage, usage, seconds):
+    cost = estimate_cost(
+        usage["input_tokens"],
+        usage["output_tokens"],
+        INPUT_TOKEN_PRICE,
+        OUTPUT_TOKEN_PRICE,
+    )
+    print(
+        f"{stage}: {usage['calls']} calls over {usage['articles']} inputs in {seconds:.1f} s, "
+        f"input tokens {usage['input_tokens']} ({usage['estimated_input_tokens']} estimated), "
+        f"output tokens {usage['output_tokens']}, ${cost:.5f}"
+    )
+
+
+def generate_cluster_summary(previous_summary, articles, priority=1.0):
+    start = time.time()
+    generated_summary, usage, included = summarize_articles(
+        previous_summary, articles, priority
+    )
+    print_usage("Summary", usage, time.time() - start)
+    return generated_summary, included
+
+
+def submit_chunks(executor, futures, articles, priority, final):
+    # Sends every full chunk to the model, returns the articles left for the next one
+    room = MAP_REDUCE_MAX_CHUNKS - len(futures)
+    chunks = chunk_articles(INSTRUCTIONS, articles, PROMPT_TOKEN_BUDGET, room)
+    leftover = []
+    if not final and 0 < len(chunks) < room:
+        # The last chunk can still take articles from the next page
+        leftover = chunks.pop()
+    for chunk in chunks:
+        futures.append(executor.submit(summarize_articles, "", chunk, priority))
+    return leftover
+
+
+def generate_cluster_summary_map_reduce(
+    previous_summary, articles, priority=1.0, more_pages=()
+):
+    """
+    Summarizes chunks of the articles side by side, then merges the partial summaries.
+
+    Chunks go to the model as soon as they are full, while the later pages of
+    more_pages are still being read. Up to MAP_REDUCE_MAX_CHUNKS chunks are
+    summarized. Articles past them are still read, pages are not in
+    entry_creation_date order and the high-water mark has to stay below
+    every one of them, so the next run picks them up. The reduce stage folds
+    the partial summaries into the previous summary. Returns the summary,
+    None when nothing could be summarized, every article read and the
+    articles the summary covers.
+    """
+    # Created before the workers, client creation is not thread safe
+    get_bedrock_client()
+    get_rate_limiter()
+    start = time.time()
+    articles = list(articles)
+    futures = []
+    with ThreadPoolExecutor(max_workers=MAP_REDUCE_WORKERS) as executor:
+        pending = submit_chunks(executor, futures, articles, priority, final=False)
+        for page in more_pages:
+            articles.extend(page)
+            if len(futures) < MAP_REDUCE_MAX_CHUNKS:
+                pending = submit_chunks(
+                    executor, futures, pending + page, priority, final=False
+                )
+        if pending and len(futures) < MAP_REDUCE_MAX_CHUNKS:
+            submit_chunks(executor, futures, pending, priority, final=True)
+        results = [future.result() for future in futures]
+    chunked = sum(usage["articles"] for _, usage, _ in results)
+    print(
+        f"Map-reduce over {len(futures)} chunks of {len(articles)} articles, "
+        f"{len(articles) - chunked} left for the next summary"
+    )
+    map_usage = {}
+    for _, usage, _ in results:
+        add_usage(map_usage, usage)
+    partials = [partial for partial, _, _ in results if partial is not None]
+    if not partials:
+        # No chunk at all, or none fit a prompt
+        print("No chunk was summarized, nothing to merge")
+        return None, articles, []
+    print_usage("Map", map_usage, time.time() - start)
+
+    start = time.time()
+    generated_summary, reduce_usage, merged = summarize_articles(
+        previous_summary, partials, priority
+    )
+    print_usage("Reduce", reduce_usage, time.time() - start)
+    # A chunk is covered only if its partial summary made it into the merge
+    merged_ids = {id(partial) for partial in merged}
+    covered = [
+        article
+        for partial, _, included in results
+        if id(partial) in merged_ids
+        for article in included
+    ]
+    return generated_summary, articles, covered
 
 
 """
@@ -158,13 +490,69 @@ Event Expected in following format
 
 
 def handler(event, context):
+    global invocation_deadline
     print("Input Event", event)
 
-    previous_summary, summary_count, articles = get_cluster_data(event["cluster_id"])
-    generated_summary = generate_cluster_summary(previous_summary, articles, summary_count > 0)
-    averages = generate_average_cluster_data(articles)
+    if context is not None:
+        invocation_deadline = (
+            time.time()
+            + context.get_remaining_time_in_millis() / 1000
+            - INVOCATION_RESERVE_SECONDS
+        )
+
+    # Same clock as entry_creation_date on the consumer, up to the skew in the lag
+    read_started_at = datetime.now()
+    previous_summary, summary_count, pages, metadata = get_cluster_data(
+        event["cluster_id"]
+    )
+    # Decides who waits when the model quota runs short
+    priority = summary_priority(
+        int(metadata.get("number_of_articles", 0)), metadata.get("updated_at")
+    )
+    print(f"Priority: {priority:.2f}")
+    # Read until the cluster turns out large enough to be summarized in chunks
+    articles = []
+    for page in pages:
+        articles.extend(page)
+        if len(articles) >= MAP_REDUCE_MIN_ARTICLES:
+            break
+    if len(articles) >= MAP_REDUCE_MIN_ARTICLES:
+        # The map stage starts on these while the rest of the pages are read
+        generated_summary, articles, included = generate_cluster_summary_map_reduce(
+            previous_summary, articles, priority, pages
+        )
+    elif articles:
+        representative_articles = select_representative_articles(
+            articles, SUMMARY_MAX_ARTICLES, SUMMARY_DIVERSITY
+        )
+        print(f"Summarizing {len(representative_articles)} of {len(articles)} articles")
+        generated_summary, included = generate_cluster_summary(
+            previous_summary, representative_articles, priority
+        )
+    else:
+        generated_summary, included = None, []
+    if generated_summary is None:
+        # Nothing new since the last summary, or nothing fit a prompt. The state
+        # machine then leaves the summary, its count, snapshot and high-water mark as they are
+        print("Nothing summarized")
+        return {"summarized": False}
+    averages = get_average_cluster_data_from_metadata(metadata)
+    if averages is None:
+        # Clusters created before the consumer kept aggregates
+        averages = generate_average_cluster_data(
+            get_cluster_articles(event["cluster_id"])
+        )
 
     print("Generated Summary", generated_summary)
     print("Averages", averages)
 
-    return {**generated_summary, **averages, "summary_count": summary_count + 1}
+    return {
+        "summarized": True,
+        **generated_summary,
+        **averages,
+        "summary_count": summary_count + 1,
+        "summarized_through": high_water_mark(
+            articles, included, metadata.get("summarized_through", ""), read_started_at
+        ),
+        **summary_snapshot(metadata),
+    }
@@ -0,0 +1,71 @@
+import math
+import struct
+
+# struct formats of the embedding encodings the stream consumer writes
+DTYPE_FORMATS = {"float32": "f", "float16": "e"}
+DTYPE_SIZES = {"float32": 4, "float16": 2}
+ENTITY_COUNTERS = ["location_counts", "organization_counts"]
+
+
+def decode_vector(item, name):
+    # Low level DynamoDB attributes, as the client returns them
+    blob = item.get(name, {}).get("B")
+    dtype = item.get(f"{name}_dtype", {}).get("S", "float16")
+    # Empty when the last summary was made without a centroid
+    if not blob or dtype not in DTYPE_FORMATS:
+        return None
+    count = len(blob) // DTYPE_SIZES[dtype]
+    return struct.unpack(f"<{count}{DTYPE_FORMATS[dtype]}", blob)
+
+
+def cosine_drift(vector, other):
+    dot = sum(x * y for x, y in zip(vector, other))
+    norms = math.sqrt(sum(x * x for x in vector)) * math.sqrt(sum(y * y for y in other))
+    if not norms:
+        return 1.0
+    return 1.0 - dot / norms
+
+
+def entities(item):
+    # Keys of the bounded location and organization counters of the metadata item
+    return {
+        f"{counter}:{name}"
+        for counter in ENTITY_COUNTERS
+        for name in item.get(counter, {}).get("M", {})
+    }
+
+
+def summarized_entities(item):
+    return {value["S"] for value in item.get("summary_entities", {}).get("L", [])}
+
+
+def entity_novelty(current, previous):
+    # Share of the current top entities that were not there at the last summary
+    if not current:
+        return 0.0
+    return len(current - previous) / len(current)
+
+
+def measure_change(item):
+    """
+    Returns how far a cluster moved since its last summary, as (drift, novelty).
+
+    drift is the cosine distance between the current centroid and the one
+    recorded when the last summary started, None when either is missing.
+    novelty is the entity_novelty of the cluster's top entities.
+    """
+    centroid = decode_vector(item, "centroid")
+    summary_centroid = decode_vector(item, "summary_centroid")
+    drift = None
+    if centroid is not None and summary_centroid is not None:
+        if len(centroid) == len(summary_centroid):
+            drift = cosine_drift(centroid, summary_centroid)
+    novelty = entity_novelty(entities(item), summarized_entities(item))
+    return drift, novelty
+
+
+def is_significant(drift, novelty, min_drift, min_novelty):
+    # Without a recorded centroid there is nothing to compare against, summarize
+    if drift is None:
+        return True
+    return drift >= min_drift or novelty >= min_novelty
@@ -1,80 +1,245 @@
 import json
 import boto3
 import os
+import re
+import time
+import functools
+from change_significance import is_significant, measure_change
+
+# BatchGetItem request limit
+GET_BATCH_SIZE = 100
+MAX_UNPROCESSED_RETRIES = 5
+ARTICLE_CAP = 3  # A multiple of articles_threshold, to stop processing summaries
+# Step Functions execution names, at most 80 of these characters
+EXECUTION_NAME_PATTERN = re.compile(r"[^A-Za-z0-9_-]")
+METADATA_PROJECTION = ", ".join(
+    [
+        "PK",
+        "number_of_articles",
+        "summary_count",
+        "centroid",
+        "centroid_dtype",
+        "summary_centroid",
+        "summary_centroid_dtype",
+        "location_counts",
+        "organization_counts",
+        "summary_entities",
+    ]
+)
+
+
+# Clients are created on first use and reused by later invocations in the container
+@functools.lru_cache(maxsize=None)
+def get_client(service_name):
+    return boto3.client(service_name)
+
+
+def clusters_with_new_articles(records):
+    # Cluster PKs that received articles in this batch, in order of first appearance
+    clusters = {}
+    for record in records:
+        if record["eventName"] != "INSERT":
+            continue
+        new_image = record["dynamodb"].get("NewImage", {})
+        if new_image.get("type", {}).get("S") == "article":
+            pk_value = new_image["PK"]["S"]
+            clusters[pk_value] = clusters.get(pk_value, 0) + 1
+    return clusters
+
+
+def get_cluster_metadata(dynamodb_client, table_name, cluster_ids):
+    """
+    Reads the metadata item of every cluster with BatchGetItem, keyed by PK.
+    """
+    metadata = {}
+    for i in range(0, len(cluster_ids), GET_BATCH_SIZE):
+        request = {
+            table_name: {
+                "Keys": [
+                    {"PK": {"S": pk}, "SK": {"S": f"#METADATA#{pk}"}}
+                    for pk in cluster_ids[i : i + GET_BATCH_SIZE]
+                ],
+                "ProjectionExpression": METADATA_PROJECTION,
+            }
+        }
+        for attempt in range(MAX_UNPROCESSED_RETRIES):
+            response = dynamodb_client.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(table_name, []):
+                metadata[item["PK"]["S"]] = item
+            request = response.get("UnprocessedKeys")
+            if not request:
+                break
+            time.sleep(0.05 * 2**attempt)
+        if request:
+            print(f"Metadata of {len(request[table_name]['Keys'])} clusters unread")
+    return metadata
+
+
+def needs_summary(item, articles_threshold):
+    # If we get an empty item with no articles there is nothing to summarize yet
+    if "number_of_articles" not in item:
+        return False
+    number_of_articles = int(item["number_of_articles"]["N"])
+    summary_count = int(item.get("summary_count", {"N": "0"})["N"])
+    lower_limit_flag = number_of_articles > articles_threshold * (summary_count + 1)
+    upper_limit_flag = number_of_articles < ARTICLE_CAP * articles_threshold
+    # Within the range, or outside the upper limit but still not summarized
+    return lower_limit_flag and (upper_limit_flag or summary_count == 0)
+
+
+def execution_name(cluster_id, summary_generation, pending_since):
+    """
+    Names the execution after the cluster, the summary it will produce and its claim.
+
+    Only the trigger that claimed the summary starts it, a later claim of the
+    same generation needs a name of its own since Step Functions keeps the
+    names of closed executions.
+    """
+    name = f"{cluster_id}-{summary_generation}-{pending_since}"
+    return EXECUTION_NAME_PATTERN.sub("_", name)[-80:]
+
+
+def metadata_key(pk_value):
+    return {"PK": {"S": pk_value}, "SK": {"S": f"#METADATA#{pk_value}"}}
+
+
+def claim_summary(
+    dynamodb_client, table_name, pk_value, summary_generation, pending_seconds, now=None
+):
+    """
+    Marks summary_generation of the cluster as pending, returns the time of the claim.
+
+    None when the generation is pending already, so however the triggers for
+    it are batched, and however long its execution retries, one execution
+    makes it. A claim older than pending_seconds, longer than an execution
+    can take, is given up on and taken over.
+    """
+    now = int(time.time()) if now is None else now
+    try:
+        dynamodb_client.update_item(
+            TableName=table_name,
+            Key=metadata_key(pk_value),
+            UpdateExpression=(
+                "SET summary_pending_generation = :generation, "
+                "summary_pending_since = :now"
+            ),
+            ConditionExpression=(
+                "attribute_not_exists(summary_pending_since) "
+                "OR summary_pending_generation <> :generation "
+                "OR summary_pending_since < :expired"
+            ),
+            ExpressionAttributeValues={
+                ":generation": {"N": str(summary_generation)},
+                ":now": {"N": str(now)},
+                ":expired": {"N": str(now - pending_seconds)},
+            },
+        )
+    except dynamodb_client.exceptions.ConditionalCheckFailedException:
+        return None
+    return now
+
+
+def release_summary(dynamodb_client, table_name, pk_value, pending_since):
+    # Lets the next trigger claim the summary again, unless someone else has since
+    try:
+        dynamodb_client.update_item(
+            TableName=table_name,
+            Key=metadata_key(pk_value),
+            UpdateExpression="REMOVE summary_pending_since",
+            ConditionExpression="summary_pending_since = :since",
+            ExpressionAttributeValues={":since": {"N": str(pending_since)}},
+        )
+    except dynamodb_client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+def advance_summary_count(dynamodb_client, table_name, pk_value, summary_count):
+    # Moves the article threshold on as if the summary had run, unless someone else already did
+    try:
+        dynamodb_client.update_item(
+            TableName=table_name,
+            Key=metadata_key(pk_value),
+            UpdateExpression="SET summary_count = :next",
+            ConditionExpression="summary_count = :seen",
+            ExpressionAttributeValues={
+                ":next": {"N": str(summary_count + 1)},
+                ":seen": {"N": str(summary_count)},
+            },
+        )
+    except dynamodb_client.exceptions.ConditionalCheckFailedException:
+        print(f"Summary count of {pk_value} changed meanwhile")
 
 
 def handler(event, context):
-    # Initialize the DynamoDB and Step Functions clients
-    dynamodb_client = boto3.client("dynamodb")
-    sfn_client = boto3.client("stepfunctions")
+    dynamodb_client = get_client("dynamodb")
+    sfn_client = get_client("stepfunctions")
 
     # State Machine ARN and the threshold for number_of_articles from environment variables
     state_machine_arn = os.environ["STATE_MACHINE_ARN"]
     articles_threshold = int(os.environ["ARTICLES_THRESHOLD"])
-    article_cap = 3  # A multiple of articles_threshold, to stop processing summaries
+    # Longest a summary execution takes, retries included
+    pending_seconds = int(os.environ.get("SUMMARY_PENDING_SECONDS", "900"))
+    # Below both, the new articles add too little to summarize the cluster again
+    min_drift = float(os.environ.get("SUMMARY_MIN_DRIFT", "0.02"))
+    min_novelty = float(os.environ.get("SUMMARY_MIN_ENTITY_NOVELTY", "0.25"))
     # DynamoDB table name
     table_name = os.environ["DYNAMODB_TABLE_NAME"]
 
-    # Process each record in the DynamoDB Stream
-    for record in event[
-        "Records"
-    ]:  # ! ToDo aggregate records and send them in batch instead of one at at Time
-        if record["eventName"] == "INSERT":
-            new_image = record["dynamodb"].get("NewImage", {})
-            print("New Record")
-            if "type" in new_image and new_image["type"]["S"] == "article":
-                print("Record is an Article")
-
-                # Extract primary key (PK)
-                pk_value = new_image["PK"]["S"]
-                metadata_key = f"#METADATA#{pk_value}"
-                print("PK is", pk_value)
-
-                # Get the item with PK and #METADATA#[PK] sort key
-                response = dynamodb_client.get_item(
-                    TableName=table_name,
-                    Key={"PK": {"S": pk_value}, "SK": {"S": metadata_key}},
+    clusters = clusters_with_new_articles(event["Records"])
+    print(
+        f"{len(event['Records'])} records, {sum(clusters.values())} new articles "
+        f"in {len(clusters)} clusters"
+    )
+    if not clusters:
+        return {"statusCode": 200, "body": json.dumps("No new articles.")}
+
+    metadata = get_cluster_metadata(dynamodb_client, table_name, list(clusters))
+
+    started = 0
+    skipped = 0
+    for pk_value in clusters:
+        item = metadata.get(pk_value, {})
+        if not needs_summary(item, articles_threshold):
+            print(f"Cluster {pk_value} does not need a summary yet")
+            continue
+
+        summary_count = int(item.get("summary_count", {"N": "0"})["N"])
+        if summary_count > 0:
+            drift, novelty = measure_change(item)
+            print(f"Cluster {pk_value} drift: {drift}, entity novelty: {novelty:.2f}")
+            if not is_significant(drift, novelty, min_drift, min_novelty):
+                advance_summary_count(
+                    dynamodb_client, table_name, pk_value, summary_count
                 )
-                item = response.get("Item", {})
-                print("Cluster: ", item)
-                
-                # If we get an empty item with no articles move to the next record
-                if "number_of_articles" not in item:
-                    continue
-
-                summary_count = int(item.get("summary_count", {"N": "0"})["N"])
-                lower_limit_flag = int(item["number_of_articles"]["N"]) > articles_threshold * (summary_count + 1)
-                upper_limit_flag = int(item["number_of_articles"]["N"]) < 3 * articles_threshold
-                
-                print("Summary Count:", summary_count)
-                print("Lower Limit Flag:", lower_limit_flag)
-                print("Upper Limit Flag:", upper_limit_flag)
-                print("Overall flag:", (lower_limit_flag and upper_limit_flag) or (lower_limit_flag and summary_count == 0))
-
-                # Check if number_of_articles is within a range or if it is outside the upper limit but still hasn't been summarized
-                if (lower_limit_flag and upper_limit_flag) or (lower_limit_flag and summary_count == 0):
-                    # Prepare data for Step Functions
-                    input_data = {
-                        "cluster_id": pk_value,
-                    }
-
-                    # Start execution of the state machine
-                    response = sfn_client.start_execution(
-                        stateMachineArn=state_machine_arn, input=json.dumps(input_data)
-                    )
-
-                    print(
-                        f"Started Step Functions execution for 'article' record: {response['executionArn']}"
-                    )
-                else:
-                    print(
-                        "Not enough articles in the cluster yet, less than ",
-                        articles_threshold,
-                    )
+                skipped += 1
+                continue
+
+        pending_since = claim_summary(
+            dynamodb_client, table_name, pk_value, summary_count + 1, pending_seconds
+        )
+        if pending_since is None:
+            print(f"Summary {summary_count + 1} of {pk_value} is pending already")
+            continue
+        name = execution_name(pk_value, summary_count + 1, pending_since)
+        try:
+            response = sfn_client.start_execution(
+                stateMachineArn=state_machine_arn,
+                name=name,
+                input=json.dumps({"cluster_id": pk_value}),
+            )
+        except sfn_client.exceptions.ExecutionAlreadyExists:
+            print(f"Execution {name} already exists")
+            continue
+        except Exception:
+            release_summary(dynamodb_client, table_name, pk_value, pending_since)
+            raise
+        started += 1
+        print(f"Started Step Functions execution: {response['executionArn']}")
 
     return {
         "statusCode": 200,
         "body": json.dumps(
-            'Processed DynamoDB stream records of type "article" with sufficient count.'
+            f"Started {started} and skipped {skipped} summaries "
+            f"for {len(clusters)} updated clusters."
         ),
     }
@@ -0,0 +1,106 @@
+import gzip
+import json
+import math
+import zlib
+from decimal import Decimal
+
+# Fields moved out of the inline ARTICLE# item
+BODY_FIELDS = ["text", "summary"]
+# Summarization never reads more than this many summary characters, keep them inline
+INLINE_SUMMARY_LENGTH = 2000
+BODY_PREFIX = "article_bodies/"
+
+STORAGE_MODES = ("inline", "compressed", "s3")
+
+
+def compress_body(article):
+    body = {field: article.get(field) for field in BODY_FIELDS}
+    return zlib.compress(json.dumps(body).encode("utf-8"))
+
+
+def decompress_body(blob):
+    # boto3 returns Binary attributes wrapped, the raw bytes are in .value
+    blob = getattr(blob, "value", blob)
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def body_s3_key(article_id):
+    return f"{BODY_PREFIX}{article_id}.json.gz"
+
+
+def offload_article_item(item, mode, bucket=None):
+    """
+    Moves the large fields of an ARTICLE# item out of line.
+
+    Returns the item to write and, in s3 mode, the (bucket, key, body) upload
+    that has to happen before the item is written.
+    """
+    if mode == "inline" or item.get("text") is None:
+        return item, None
+
+    summary = item.get("summary") or ""
+    slim_item = {k: v for k, v in item.items() if k not in BODY_FIELDS}
+    slim_item["summary"] = summary[:INLINE_SUMMARY_LENGTH]
+
+    if mode == "compressed":
+        slim_item["body_z"] = compress_body(item)
+        return slim_item, None
+
+    if mode == "s3":
+        key = body_s3_key(item["article_id"])
+        body = {field: item.get(field) for field in BODY_FIELDS}
+        slim_item["body_s3_bucket"] = bucket
+        slim_item["body_s3_key"] = key
+        return slim_item, (bucket, key, gzip.compress(json.dumps(body).encode("utf-8")))
+
+    raise ValueError(f"Unknown article storage mode: {mode}")
+
+
+def rehydrate_article(item, s3_client=None):
+    # Returns a copy of the item with the full text and summary restored
+    if "body_z" in item:
+        body = decompress_body(item["body_z"])
+    elif "body_s3_key" in item:
+        response = s3_client.get_object(
+            Bucket=item["body_s3_bucket"], Key=item["body_s3_key"]
+        )
+        body = json.loads(gzip.decompress(response["Body"].read()).decode("utf-8"))
+    else:
+        return item
+
+    rehydrated = {
+        k: v
+        for k, v in item.items()
+        if k not in ("body_z", "body_s3_bucket", "body_s3_key")
+    }
+    rehydrated.update(body)
+    return rehydrated
+
+
+def attribute_size(value):
+    # Approximation of the DynamoDB item size rules
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (int, float, Decimal)):
+        return math.ceil(len(str(value).lstrip("-").replace(".", "")) / 2) + 1
+    if isinstance(value, dict):
+        return 3 + sum(
+            len(k.encode("utf-8")) + attribute_size(v) + 1 for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set)):
+        return 3 + sum(attribute_size(v) + 1 for v in value)
+    return len(str(value).encode("utf-8"))
+
+
+def item_size(item):
+    return sum(len(k.encode("utf-8")) + attribute_size(v) for k, v in item.items())
+
+
+def capacity_units(item):
+    # (write units, strongly consistent read units)
+    size = item_size(item)
+    return math.ceil(size / 1024), math.ceil(size / 4096)
@@ -0,0 +1,81 @@
+from datetime import datetime
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Most frequent entries kept per counter in the metadata item
+TOP_K = 20
+
+
+def parse_publication_date(publication_date):
+    if not publication_date:
+        return None
+    try:
+        return datetime.fromisoformat(publication_date.strip().rstrip("Z"))
+    except ValueError:
+        return None
+
+
+def update_counter(counts, values, top_k=TOP_K):
+    """
+    Counts values with the Space-Saving algorithm, keeping at most top_k entries.
+
+    A new value that finds the counter full takes over the entry with the
+    lowest count and inherits that count. Counts are therefore upper bounds,
+    but any value more frequent than 1 / top_k of all values is kept, so a
+    late majority still becomes the most common value.
+    """
+    # DynamoDB returns numbers as Decimal, keep plain ints while counting
+    counts = {k: int(v) for k, v in (counts or {}).items()}
+    for value in values or []:
+        if not value:
+            continue
+        if value in counts or len(counts) < top_k:
+            counts[value] = counts.get(value, 0) + 1
+            continue
+        evicted = min(counts, key=counts.get)
+        counts[value] = counts.pop(evicted) + 1
+    return counts
+
+
+def most_common(counts):
+    if not counts:
+        return ""
+    return max(counts.items(), key=lambda kv: kv[1])[0]
+
+
+def update_cluster_aggregates(metadata, articles, top_k=TOP_K):
+    """
+    Folds newly added articles into the aggregates kept on a #METADATA# item.
+
+    Maintains bounded location and organization counters and the earliest and
+    latest publication dates, so readers do not need the whole partition.
+    """
+    location_counts = metadata.get("location_counts", {})
+    organization_counts = metadata.get("organization_counts", {})
+    earliest_date = metadata.get("earliest_date") or ""
+    latest_date = metadata.get("latest_date") or ""
+
+    for article in articles:
+        location_counts = update_counter(
+            location_counts, article.get("locations"), top_k
+        )
+        organization_counts = update_counter(
+            organization_counts, article.get("organizations"), top_k
+        )
+
+        publication_date = parse_publication_date(article.get("publication_date"))
+        if publication_date is None:
+            continue
+        publication_date = publication_date.strftime(DATE_FORMAT)
+        # Same fixed width format, so string comparison orders dates
+        if not earliest_date or publication_date < earliest_date:
+            earliest_date = publication_date
+        if not latest_date or publication_date > latest_date:
+            latest_date = publication_date
+
+    metadata["location_counts"] = location_counts
+    metadata["organization_counts"] = organization_counts
+    metadata["most_common_location"] = most_common(location_counts)
+    metadata["most_common_organization"] = most_common(organization_counts)
+    metadata["earliest_date"] = earliest_date
+    metadata["latest_date"] = latest_date
+    return metadata
@@ -0,0 +1,97 @@
+import hashlib
+from boto3.dynamodb.conditions import Key
+
+# Metadata items are spread over a few GSI partitions so no single one runs hot
+CLUSTER_LIST_SHARDS = 4
+SHARD_ATTRIBUTE = "cluster_shard"
+INDEXES = {
+    "size": ("clusters_by_size", "number_of_articles"),
+    "recency": ("clusters_by_recency", "updated_at"),
+}
+ARTICLE_LIST_FIELDS = ["PK", "SK", "article_id", "title", "summary", "publication_date"]
+
+
+def shard_for_cluster(cluster_id, shards=CLUSTER_LIST_SHARDS):
+    # Stable across processes, unlike hash()
+    digest = hashlib.md5(cluster_id.encode("utf-8")).hexdigest()
+    return f"CLUSTERS#{int(digest, 16) % shards}"
+
+
+def index_key(item, order):
+    _, sort_attribute = INDEXES[order]
+    return {
+        "PK": item["PK"],
+        "SK": item["SK"],
+        SHARD_ATTRIBUTE: item[SHARD_ATTRIBUTE],
+        sort_attribute: item[sort_attribute],
+    }
+
+
+def get_top_clusters(
+    table, limit=50, order="size", page_token=None, shards=CLUSTER_LIST_SHARDS
+):
+    """
+    Returns up to `limit` clusters ordered by size or recency, and a page token.
+
+    Reads at most `limit` items from each shard, so the cost is bounded by
+    limit * shards regardless of how much history the table holds. Pass the
+    returned token back in to get the next page, None means there are no more.
+    """
+    index_name, sort_attribute = INDEXES[order]
+    cursors = page_token or {shard: None for shard in _shard_names(shards)}
+
+    candidates = []
+    fetched = {}
+    exhausted = {}
+    for shard, cursor in cursors.items():
+        query_args = {
+            "IndexName": index_name,
+            "KeyConditionExpression": Key(SHARD_ATTRIBUTE).eq(shard),
+            "ScanIndexForward": False,
+            "Limit": limit,
+        }
+        if cursor is not None:
+            query_args["ExclusiveStartKey"] = cursor
+        response = table.query(**query_args)
+        items = response.get("Items", [])
+        fetched[shard] = len(items)
+        exhausted[shard] = "LastEvaluatedKey" not in response
+        candidates.extend((shard, item) for item in items)
+
+    # Stable sort, so each shard contributes a prefix of what it returned
+    candidates.sort(key=lambda shard_item: shard_item[1][sort_attribute], reverse=True)
+    page = candidates[:limit]
+
+    next_cursors = dict(cursors)
+    consumed = {shard: 0 for shard in cursors}
+    for shard, item in page:
+        consumed[shard] += 1
+        next_cursors[shard] = index_key(item, order)
+    for shard in cursors:
+        if exhausted[shard] and consumed[shard] == fetched[shard]:
+            del next_cursors[shard]
+
+    return [item for _, item in page], next_cursors or None
+
+
+def get_cluster_articles(table, cluster_id, limit=100, page_token=None):
+    query_args = {
+        "KeyConditionExpression": Key("PK").eq(cluster_id)
+        & Key("SK").begins_with("ARTICLE#"),
+        # Placeholders avoid clashes with DynamoDB reserved words
+        "ProjectionExpression": ", ".join(
+            f"#f{i}" for i in range(len(ARTICLE_LIST_FIELDS))
+        ),
+        "ExpressionAttributeNames": {
+            f"#f{i}": field for i, field in enumerate(ARTICLE_LIST_FIELDS)
+        },
+        "Limit": limit,
+    }
+    if page_token is not None:
+        query_args["ExclusiveStartKey"] = page_token
+    response = table.query(**query_args)
+    return response.get("Items", []), response.get("LastEvaluatedKey")
+
+
+def _shard_names(shards):
+    return [f"CLUSTERS#{i}" for i in range(shards)]
@@ -5,22 +5,35 @@ from clustering import (
     batch_update_numpy_distance_matrix,
     get_sparse_distance_matrix,
 )
+from article_storage import offload_article_item
+from cluster_aggregates import update_cluster_aggregates
+from cluster_read_model import SHARD_ATTRIBUTE, shard_for_cluster
+from related_stories import RelatedStories, serve, take_snapshot, text_embedder
 import numpy as np
 import time
 import boto3
+from boto3.dynamodb.conditions import Key
 from sklearn.cluster import DBSCAN
 import uuid
 from datetime import datetime
+import base64
 import ast  # Use Abstract Syntax Trees module to safely evaluate string representation of dictionaries
 import functools
+import gzip
+import io
 import os
 import pickle
 import threading
 import copy
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+# Number of concurrent S3 reads when fetching article bodies for slim messages
+ARTICLE_FETCH_WORKERS = int(os.environ.get("ARTICLE_FETCH_WORKERS", "32"))
+
 # Initialize AWS clients
-s3 = boto3.client("s3")
+s3 = boto3.client("s3", config=Config(max_pool_connections=ARTICLE_FETCH_WORKERS))
 ssm = boto3.client("ssm")
 dynamodb = boto3.resource("dynamodb")
 sqs = boto3.client("sqs")
@@ -30,6 +43,19 @@ S3_BUCKET_NAME = os.environ["S3_BUCKET_NAME"]
 S3_FILE_KEY = os.environ["S3_FILE_KEY"]
 SQS_QUEUE = os.environ["SQS_QUEUE"]
 DYNAMODB_TABLE = os.environ["DYNAMODB_TABLE"]
+# "inline" keeps the full text in the item, "compressed" or "s3" move it out of line
+ARTICLE_STORAGE_MODE = os.environ.get("ARTICLE_STORAGE_MODE", "inline")
+ARTICLE_BODY_BUCKET = os.environ.get("ARTICLE_BODY_BUCKET", S3_BUCKET_NAME)
+# Deliveries a near-duplicate waits for its original to reach the pool before it is filed alone
+DUPLICATE_MAX_RECEIVES = int(os.environ.get("DUPLICATE_MAX_RECEIVES", "3"))
+# Precision of the embeddings kept on ARTICLE# items and cluster centroids, "none" to skip them
+ARTICLE_EMBEDDING_DTYPE = os.environ.get("ARTICLE_EMBEDDING_DTYPE", "float16")
+# Port of the related stories queries over the pool, 0 turns them off
+RELATED_STORIES_PORT = int(os.environ.get("RELATED_STORIES_PORT", "0"))
+# Text queries are embedded with the same model as the articles
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "")
+EMBEDDING_ENDPOINT_NAME = os.environ.get("EMBEDDING_ENDPOINT_NAME", "")
+MAX_LENGTH = os.environ.get("MAX_LENGTH", "512")
 
 # Setup for clustering
 label_tracker: List[tuple] = []
@@ -42,6 +68,12 @@ unique_article_id = 0
 unique_cluster_id = 0
 cluster_count = 0
 
+related_stories_service = None
+
+# Binary embedding encodings written by embed_docs, keyed by version
+EMBEDDING_DTYPES = {1: {"float32": "<f4", "float16": "<f2"}}
+ITEM_EMBEDDING_DTYPES = EMBEDDING_DTYPES[1]
+
 # Stream
 batch_times = []  #
 processed_pool_sizes = []
@@ -60,12 +92,49 @@ def timer(func):
     return wrapper
 
 
+def decode_embedding(concat_embedding):
+    # Legacy format, a JSON list holding a single list of floats
+    if isinstance(concat_embedding, list):
+        return np.asarray(concat_embedding[0])
+
+    dtype = EMBEDDING_DTYPES[concat_embedding["version"]][concat_embedding["dtype"]]
+    embedding = np.frombuffer(
+        base64.b64decode(concat_embedding["data"]),
+        dtype=dtype,
+        count=concat_embedding["dim"],
+    )
+    # Upcast so the pool keeps a single dtype regardless of the wire format
+    return embedding.astype(np.float32)
+
+
+def embedding_attributes(embedding, name="embedding"):
+    # Little endian binary, read back by summarization and the summary trigger
+    if embedding is None or ARTICLE_EMBEDDING_DTYPE not in ITEM_EMBEDDING_DTYPES:
+        return {}
+    dtype = ITEM_EMBEDDING_DTYPES[ARTICLE_EMBEDDING_DTYPE]
+    return {
+        name: np.asarray(embedding, dtype=dtype).tobytes(),
+        f"{name}_dtype": ARTICLE_EMBEDDING_DTYPE,
+    }
+
+
+def get_cluster_centroids(cluster_ids):
+    # The pool entry of a cluster holds the mean of its members' embeddings
+    wanted = set(cluster_ids)
+    return {
+        label: embeds[i]
+        for i, (label, _) in enumerate(label_tracker)
+        if label in wanted
+    }
+
+
 # Format docs for clustering
 @timer
 def format_documents(messages):
     print("Format Docs")
     converted_messages = []
     associated_articles = {}
+    near_duplicates = []
     seen_ids = set()  # Keep track of seen ids
 
     for msg in messages:
@@ -82,8 +151,18 @@ def format_documents(messages):
         else:
             seen_ids.add(message_id)
 
+        # Near-duplicates carry no embedding, they join their original's cluster
+        if "duplicate_of" in message_body:
+            near_duplicates.append((msg, message_id, message_body["duplicate_of"]))
+            associated_articles[message_id] = message_body
+            continue
+
         # Proceed if id is not a duplicate
-        embeddings = np.asarray(message_body["concat_embedding"][0])
+        try:
+            embeddings = decode_embedding(message_body["concat_embedding"])
+        except (KeyError, ValueError) as e:
+            print(f"Skipping message {message_id}, could not decode embedding: {e}")
+            continue
 
         converted_messages.append(
             {
@@ -91,9 +170,210 @@ def format_documents(messages):
                 "concat_embedding": embeddings,
             }
         )
+        # The embedding now lives in the pool, no need to hold the encoded copy
+        message_body.pop("concat_embedding", None)
         associated_articles[message_id] = message_body
 
-    return converted_messages, associated_articles
+    return converted_messages, associated_articles, near_duplicates
+
+
+@timer
+def attach_near_duplicates(near_duplicates, new_entries_articles, updated_clusters):
+    """
+    Files near-duplicates under the pool entry holding their original article.
+
+    A singleton original becomes a two article cluster, as DBSCAN would have
+    made it. Returns the messages whose original is not in the pool yet, they
+    are left on the queue and retried on a later delivery.
+    """
+    global cluster_count
+    global unique_cluster_id
+
+    if not near_duplicates:
+        return []
+
+    entry_by_article = {
+        article_id: i
+        for i, (_, article_ids) in enumerate(label_tracker)
+        for article_id in article_ids
+    }
+    cluster_articles = dict(updated_clusters)
+
+    deferred = []
+    attached = 0
+    for msg, article_id, original_id in near_duplicates:
+        i = entry_by_article.get(original_id)
+        if i is None:
+            receives = int(msg.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+            if receives < DUPLICATE_MAX_RECEIVES:
+                deferred.append(msg)
+            else:
+                print(f"Original {original_id} not found, filing {article_id} alone")
+                new_entries_articles.append((str(uuid.uuid4()), [article_id]))
+            continue
+
+        label, article_ids = label_tracker[i]
+        article_ids.append(article_id)
+        entry_by_article[article_id] = i
+        if is_cluster[i] is False:
+            is_cluster[i] = True
+            cluster_count += 1
+            unique_cluster_id += 1
+        if label in cluster_articles:
+            cluster_articles[label].append(article_id)
+        else:
+            cluster_articles[label] = [article_id]
+            updated_clusters.append((label, cluster_articles[label]))
+        attached += 1
+
+    print(
+        f"Near duplicates: {len(near_duplicates)} received, {attached} attached, "
+        f"{len(deferred)} deferred"
+    )
+    return deferred
+
+
+def fetch_article_body(article):
+    response = s3.get_object(Bucket=article["s3_bucket"], Key=article["s3_key"])
+    body = json.loads(response["Body"].read().decode("utf-8"))
+    body.pop("concat_embedding", None)
+    return body
+
+
+def fetch_batch_bodies(bucket, key, articles):
+    # One ranged GET covering every requested document of a batch object
+    start = min(article["s3_range"][0] for article in articles)
+    end = max(sum(article["s3_range"]) for article in articles)
+    response = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+    # Each document is its own gzip member, so any run of them decompresses on its own
+    data = gzip.decompress(response["Body"].read())
+
+    bodies = {}
+    for line in io.BytesIO(data):
+        if line.strip():
+            body = json.loads(line)
+            body.pop("concat_embedding", None)
+            bodies[body["id"]] = body
+    return bodies
+
+
+@timer
+def fetch_article_bodies(article_ids, associated_articles):
+    # Slim messages only carry a pointer to the full article in S3
+    to_fetch = [
+        article_id
+        for article_id in article_ids
+        if "s3_key" in associated_articles.get(article_id, {})
+    ]
+    if not to_fetch:
+        return
+
+    # Articles handed off in the same batch object are fetched together
+    batches = {}
+    singles = []
+    for article_id in to_fetch:
+        article = associated_articles[article_id]
+        if "s3_range" in article:
+            batch = (article["s3_bucket"], article["s3_key"])
+            batches.setdefault(batch, []).append(article_id)
+        else:
+            singles.append(article_id)
+
+    print(
+        f"Fetching article bodies from S3: {len(to_fetch)} articles, {len(batches) + len(singles)} requests"
+    )
+    with ThreadPoolExecutor(max_workers=ARTICLE_FETCH_WORKERS) as executor:
+        batch_futures = {
+            batch: executor.submit(
+                fetch_batch_bodies,
+                *batch,
+                [associated_articles[article_id] for article_id in batch_article_ids],
+            )
+            for batch, batch_article_ids in batches.items()
+        }
+        futures = {
+            article_id: executor.submit(
+                fetch_article_body, associated_articles[article_id]
+            )
+            for article_id in singles
+        }
+        for batch, future in batch_futures.items():
+            try:
+                bodies = future.result()
+            except ClientError as e:
+                print(f"Could not fetch articles from {batch[1]}: {e}")
+                continue
+            for article_id in batches[batch]:
+                if article_id in bodies:
+                    associated_articles[article_id] = bodies[article_id]
+        for article_id, future in futures.items():
+            try:
+                associated_articles[article_id] = future.result()
+            except ClientError as e:
+                # Keep the pointer, the article is written without its body
+                print(f"Could not fetch article {article_id}: {e}")
+
+
+@timer
+def upload_article_bodies(uploads):
+    if not uploads:
+        return
+
+    print("Uploading article bodies to S3: ", len(uploads))
+    with ThreadPoolExecutor(max_workers=ARTICLE_FETCH_WORKERS) as executor:
+        futures = [
+            executor.submit(s3.put_object, Bucket=bucket, Key=key, Body=body)
+            for bucket, key, body in uploads
+        ]
+        # Raise on failure so no item points at a missing body
+        for future in futures:
+            future.result()
+
+
+def get_existing_articles(cluster_id):
+    # Only the fields the aggregates use, from articles written in earlier batches
+    query_args = {
+        "TableName": DYNAMODB_TABLE,
+        "KeyConditionExpression": Key("PK").eq(cluster_id)
+        & Key("SK").begins_with("ARTICLE#"),
+        "ProjectionExpression": "#locations, #organizations, #publication_date",
+        "ExpressionAttributeNames": {
+            "#locations": "locations",
+            "#organizations": "organizations",
+            "#publication_date": "publication_date",
+        },
+    }
+    articles = []
+    while True:
+        response = dynamodb.meta.client.query(**query_args)
+        articles.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return articles
+        query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+@timer
+def update_metadata_aggregates(items_to_batch_write, backfill_cluster_ids):
+    articles_by_cluster = {}
+    for (cluster_id, sort_key), item in items_to_batch_write.items():
+        if sort_key.startswith("ARTICLE#"):
+            articles_by_cluster.setdefault(cluster_id, []).append(item)
+
+    # Articles written in earlier batches are not in memory for clusters formed
+    # now, nor for clusters whose metadata predates the aggregates
+    with ThreadPoolExecutor(max_workers=ARTICLE_FETCH_WORKERS) as executor:
+        existing = dict(
+            zip(
+                backfill_cluster_ids,
+                executor.map(get_existing_articles, backfill_cluster_ids),
+            )
+        )
+    for cluster_id, articles in existing.items():
+        articles_by_cluster.setdefault(cluster_id, []).extend(articles)
+
+    for (cluster_id, sort_key), item in items_to_batch_write.items():
+        if sort_key.startswith("#METADATA#"):
+            update_cluster_aggregates(item, articles_by_cluster.get(cluster_id, []))
 
 
 @timer
@@ -179,7 +459,9 @@ def find_duplicates(items):
 
 
 @timer
-def add_items_to_dynamodb(articles, clusters, associated_articles):
+def add_items_to_dynamodb(
+    articles, clusters, associated_articles, article_embeddings=None, centroids=None
+):
     # Get the table
     table = dynamodb.Table(DYNAMODB_TABLE)
 
@@ -208,6 +490,11 @@ def add_items_to_dynamodb(articles, clusters, associated_articles):
             item["number_of_articles"] += (
                 len(cluster_associations[item["PK"]]) - 1
             )  # Subtract one for metadata
+        # Keys of the top clusters read model
+        item[SHARD_ATTRIBUTE] = shard_for_cluster(item["PK"])
+        item["updated_at"] = datetime.now().isoformat()
+        # Compared with the centroid at the last summary before summarizing again
+        item.update(embedding_attributes((centroids or {}).get(item["PK"]), "centroid"))
         # Check for duplicates
         if pk_sk in items_to_batch_write:
             print(f"Duplicate found for existing metadata: {pk_sk}")
@@ -226,11 +513,20 @@ def add_items_to_dynamodb(articles, clusters, associated_articles):
             "summary_count": 0,
             "description": "",
             "is_cluster": True,
+            SHARD_ATTRIBUTE: shard_for_cluster(key["PK"]),
+            "updated_at": datetime.now().isoformat(),
+            **embedding_attributes((centroids or {}).get(key["PK"]), "centroid"),
         }  # Partition Key  # Sort Key
         if pk_sk in items_to_batch_write:
             print(f"Duplicate found for new metadata: {pk_sk}")
         items_to_batch_write[pk_sk] = item
 
+    fetch_article_bodies(
+        [article_id for _, ids in clusters + articles for article_id in ids],
+        associated_articles,
+    )
+
+    body_uploads = []
     for cluster_id, ids in clusters + articles:
         for article_id in ids:
             pk_sk = (cluster_id, f"ARTICLE#{article_id}")
@@ -252,7 +548,13 @@ def add_items_to_dynamodb(articles, clusters, associated_articles):
                     # "article_sentiment": article.get("article_sentiment"),
                     "publication_date": article.get("publication_date"),
                     "entry_creation_date": datetime.now().isoformat(),
+                    **embedding_attributes((article_embeddings or {}).get(article_id)),
                 }  # Partition Key  # Sort Key
+                item, upload = offload_article_item(
+                    item, ARTICLE_STORAGE_MODE, ARTICLE_BODY_BUCKET
+                )
+                if upload is not None:
+                    body_uploads.append(upload)
             else:
                 item = {
                     "PK": cluster_id,
@@ -267,6 +569,13 @@ def add_items_to_dynamodb(articles, clusters, associated_articles):
                 print(f"Duplicate found for article: {pk_sk}")
             items_to_batch_write[pk_sk] = item
 
+    # Clusters without aggregates yet are counted from their whole partition once
+    backfill_cluster_ids = [key["PK"] for key in missing_keys] + [
+        item["PK"] for item in existing_metadata if "location_counts" not in item
+    ]
+    update_metadata_aggregates(items_to_batch_write, backfill_cluster_ids)
+    upload_article_bodies(body_uploads)
+
     # Write aggregated items to DynamoDB using batch writer
     with table.batch_writer() as batch:
         for pk_sk, item in items_to_batch_write.items():
@@ -447,9 +756,29 @@ def cluster(records):
 
 @timer
 def process_messages(records):
-    formatted_records, associated_articles = format_documents(records)
+    formatted_records, associated_articles, near_duplicates = format_documents(records)
     new_entries_articles, updated_clusters = cluster(formatted_records)
-    add_items_to_dynamodb(new_entries_articles, updated_clusters, associated_articles)
+    deferred = attach_near_duplicates(
+        near_duplicates, new_entries_articles, updated_clusters
+    )
+    if related_stories_service is not None:
+        # The pool is consistent between batches, the index is rebuilt off this thread
+        related_stories_service.publish(
+            take_snapshot(label_tracker, is_cluster, embeds)
+        )
+    article_embeddings = {
+        doc["id"]: doc["concat_embedding"] for doc in formatted_records
+    }
+    centroids = get_cluster_centroids(cluster_id for cluster_id, _ in updated_clusters)
+    add_items_to_dynamodb(
+        new_entries_articles,
+        updated_clusters,
+        associated_articles,
+        article_embeddings,
+        centroids,
+    )
+    # Messages left on the queue for a later delivery
+    return deferred
 
 
 @timer
@@ -479,6 +808,7 @@ def consume_records(batch_size=20):
         response = sqs.receive_message(
             QueueUrl=SQS_QUEUE,
             MaxNumberOfMessages=min(10, int(batch_size - len(all_messages))),
+            AttributeNames=["ApproximateReceiveCount"],
             WaitTimeSeconds=0,  # Short polling to avoid long waits
         )
 
@@ -565,6 +895,15 @@ if __name__ == "__main__":
 
     load_from_checkpoint()
 
+    if RELATED_STORIES_PORT:
+        related_stories_service = RelatedStories(
+            text_embedder(EMBEDDING_MODEL, EMBEDDING_ENDPOINT_NAME, MAX_LENGTH)
+        )
+        related_stories_service.publish(
+            take_snapshot(label_tracker, is_cluster, embeds)
+        )
+        serve(related_stories_service, port=RELATED_STORIES_PORT)
+
     print(f"Article queue: {len(incoming_articles)}")
 
     ### Define number of threads
@@ -597,8 +936,10 @@ if __name__ == "__main__":
         [t.start() for t in threads]
 
         if len(incoming_articles) >= batch_size:  # Check we have enough articles
-            process_messages(incoming_articles)
-            delete_messages_in_batches(incoming_articles)
+            deferred = process_messages(incoming_articles)
+            delete_messages_in_batches(
+                [msg for msg in incoming_articles if msg not in deferred]
+            )
 
             batches_processed += 1
             incoming_articles = []
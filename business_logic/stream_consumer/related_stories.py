@@ -0,0 +1,254 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import boto3
+import numpy as np
+
+# Deployed next to the consumer from embed_docs, only needed for text queries
+try:
+    from embedding_client import embed_sagemaker, embed_titan
+except ImportError:
+    embed_sagemaker = embed_titan = None
+
+MAX_K = 100
+
+
+def take_snapshot(label_tracker, is_cluster, embeds):
+    """
+    Copies the references of the cluster pool, cheap enough for the consumer thread.
+
+    Embeddings are replaced rather than changed in place, so copying the list
+    keeps them as they are now. Member lists keep growing, so their current
+    lengths are recorded and the index only reads up to them.
+    """
+    return (
+        [(label, ids, len(ids)) for label, ids in label_tracker],
+        list(is_cluster),
+        list(embeds or []),
+    )
+
+
+class ClusterIndex:
+    """
+    Unit length cluster centroids of one pool snapshot, for cosine nearest-neighbour queries.
+    """
+
+    def __init__(self, snapshot):
+        labels, is_cluster, embeds = snapshot
+        self.built_at = time.time()
+        self.article_rows = {}
+        for row, (_, ids, size) in enumerate(labels):
+            for article_id in ids[:size]:
+                self.article_rows[article_id] = row
+        if not embeds:
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+        else:
+            vectors = np.asarray(embeds, dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            self.vectors = vectors / np.where(norms == 0, 1, norms)
+        self.labels = [label for label, _, _ in labels]
+        self.sizes = [size for _, _, size in labels]
+        self.cluster_rows = np.nonzero(np.asarray(is_cluster, dtype=bool))[0]
+        self.cluster_vectors = self.vectors[self.cluster_rows]
+
+    def __len__(self):
+        return len(self.cluster_rows)
+
+    def article_vector(self, article_id):
+        # A singleton's own embedding, or the centroid of the cluster holding it
+        row = self.article_rows.get(article_id)
+        if row is None:
+            return None, None
+        return self.vectors[row], self.labels[row]
+
+    def nearest(self, vector, k=10, exclude=None):
+        if not len(self) or not k:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        if query.shape != self.cluster_vectors.shape[1:]:
+            raise ValueError(
+                f"Embedding has {query.size} dimensions, "
+                f"the pool has {self.cluster_vectors.shape[1]}"
+            )
+        norm = np.linalg.norm(query)
+        similarities = self.cluster_vectors @ (query / norm if norm else query)
+
+        # Partial sort, one extra in case the excluded cluster is among them
+        count = min(k + 1, len(similarities))
+        top = np.argpartition(-similarities, count - 1)[:count]
+        top = top[np.argsort(-similarities[top])]
+
+        results = []
+        for i in top:
+            row = self.cluster_rows[i]
+            if self.labels[row] == exclude:
+                continue
+            results.append(
+                {
+                    "cluster_id": self.labels[row],
+                    "distance": round(float(1 - similarities[i]), 6),
+                    "number_of_articles": self.sizes[row],
+                }
+            )
+        return results[:k]
+
+
+class RelatedStories:
+    """
+    Read-only nearest-cluster queries over the latest published pool snapshot.
+
+    publish only hands the snapshot over. A background thread builds the
+    next index from it and swaps it in, so clustering never waits for a
+    rebuild and queries never see a half-built index. Snapshots published
+    during a rebuild are coalesced into the latest one.
+    """
+
+    def __init__(self, embed_text=None):
+        self.embed_text = embed_text
+        self.index = ClusterIndex(([], [], []))
+        self.pending = None
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.refresh_forever, daemon=True)
+        self.thread.start()
+
+    def publish(self, snapshot):
+        with self.lock:
+            self.pending = snapshot
+        self.ready.set()
+
+    def refresh_forever(self):
+        while True:
+            self.ready.wait()
+            with self.lock:
+                snapshot, self.pending = self.pending, None
+                self.ready.clear()
+            if snapshot is None:
+                continue
+            try:
+                start = time.time()
+                index = ClusterIndex(snapshot)
+                self.index = index
+                print(
+                    f"Related stories index: {len(index)} clusters "
+                    f"in {time.time() - start:.2f} s"
+                )
+            except Exception as e:
+                print(f"Related stories index not rebuilt: {e}")
+
+    def query(self, article_id=None, embedding=None, text=None, k=10):
+        """
+        Returns the k clusters nearest to an article, an embedding or a text.
+
+        An article is looked up in the pool. Its own cluster is reported as
+        cluster_id and left out of the results. Text is embedded with the
+        model that embeds the articles. Distances are cosine distances, the
+        measure DBSCAN clusters on.
+        """
+        start = time.time()
+        index = self.index
+        k = max(1, min(int(k), MAX_K))
+        own_cluster = None
+        if article_id is not None:
+            embedding, own_cluster = index.article_vector(article_id)
+            if embedding is None:
+                raise KeyError(f"Article {article_id} is not in the cluster pool")
+        elif text is not None:
+            if self.embed_text is None:
+                raise ValueError("Text queries need an embedding model")
+            embedding = self.embed_text(text)
+        elif embedding is None:
+            raise ValueError("Pass an article_id, an embedding or a text")
+
+        results = index.nearest(embedding, k, exclude=own_cluster)
+        response = {
+            "results": results,
+            "clusters_indexed": len(index),
+            "index_age_seconds": round(time.time() - index.built_at, 3),
+        }
+        if own_cluster is not None:
+            response["cluster_id"] = own_cluster
+        response["took_ms"] = round((time.time() - start) * 1000, 3)
+        return response
+
+
+def text_embedder(model_name, endpoint_name, max_length):
+    # Same calls as embed_docs, one text at a time
+    if embed_titan is None or not model_name:
+        return None
+    # Created up front, client creation is not thread safe
+    if model_name == "titan":
+        bedrock = boto3.client("bedrock-runtime")
+        return lambda text: embed_titan(bedrock, [text], int(max_length))[0]
+
+    sagemaker = boto3.client("sagemaker-runtime")
+    return lambda text: embed_sagemaker(
+        sagemaker,
+        endpoint_name,
+        [text],
+        int(max_length),
+        max_texts=1,
+        max_payload_bytes=5000000,
+        max_tokens=int(max_length),
+    )[0]
+
+
+def make_handler(service):
+    class RelatedStoriesHandler(BaseHTTPRequestHandler):
+        """
+        GET /related?article_id=...&k=10, or POST /related with {"embedding" or "text", "k"}.
+        """
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            self.respond(url.path, params)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                params = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                return self.send_json(400, {"error": "Body is not JSON"})
+            self.respond(urlparse(self.path).path, params)
+
+        def respond(self, path, params):
+            if path != "/related":
+                return self.send_json(404, {"error": "Not found"})
+            try:
+                response = service.query(
+                    article_id=params.get("article_id"),
+                    embedding=params.get("embedding"),
+                    text=params.get("text"),
+                    k=params.get("k", 10),
+                )
+            except KeyError as e:
+                return self.send_json(404, {"error": str(e.args[0])})
+            except (TypeError, ValueError) as e:
+                return self.send_json(400, {"error": str(e)})
+            self.send_json(200, response)
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # Queries are frequent, keep them out of the consumer log
+            pass
+
+    return RelatedStoriesHandler
+
+
+def serve(service, host="0.0.0.0", port=8080):
+    # Requests are served on their own threads, next to the consumer loop
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Related stories served on {host}:{port}")
+    return server
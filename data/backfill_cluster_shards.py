@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), "..", "business_logic", "stream_consumer")
+)
+from cluster_read_model import SHARD_ATTRIBUTE, shard_for_cluster  # noqa: E402
+
+
+def backfill_cluster_shards(table, dry_run=False):
+    """
+    Adds the read model keys to metadata items written before the sharded indexes.
+
+    Those items have no cluster_shard, so the clusters_by_size and
+    clusters_by_recency indexes leave them out and the UI does not list
+    them until the consumer happens to rewrite them. updated_at falls back
+    to created_at. Items that already have a shard are not touched, so the
+    script can be run again safely.
+    """
+    scan_args = {
+        "FilterExpression": Attr("SK").begins_with("#METADATA#")
+        & Attr(SHARD_ATTRIBUTE).not_exists(),
+        "ProjectionExpression": "PK, SK, created_at, updated_at",
+    }
+    updated = 0
+    while True:
+        response = table.scan(**scan_args)
+        for item in response.get("Items", []):
+            updated_at = (
+                item.get("updated_at")
+                or item.get("created_at")
+                or datetime.now().isoformat()
+            )
+            if not dry_run:
+                table.update_item(
+                    Key={"PK": item["PK"], "SK": item["SK"]},
+                    UpdateExpression="SET #shard = :shard, #updated_at = :updated_at",
+                    ConditionExpression="attribute_not_exists(#shard)",
+                    ExpressionAttributeNames={
+                        "#shard": SHARD_ATTRIBUTE,
+                        "#updated_at": "updated_at",
+                    },
+                    ExpressionAttributeValues={
+                        ":shard": shard_for_cluster(item["PK"]),
+                        ":updated_at": updated_at,
+                    },
+                )
+            updated += 1
+        if "LastEvaluatedKey" not in response:
+            return updated
+        scan_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="One-off backfill of cluster_shard on metadata items"
+    )
+    parser.add_argument("--table", default="cluster-table-clustering-demo2")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    table = boto3.resource("dynamodb").Table(args.table)
+    count = backfill_cluster_shards(table, args.dry_run)
+    print(
+        f"{'Would backfill' if args.dry_run else 'Backfilled'} "
+        f"{count} metadata items in {args.table}"
+    )
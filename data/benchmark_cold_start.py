@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LAMBDAS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "business_logic", "lambdas"
+)
+# Placeholder configuration, enough for the modules to import and build their clients
+BASE_ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "PREPROCESS_BUCKET": "preprocess-bucket",
+    "EMBEDDING_BUCKET": "embedding-bucket",
+    "SQS_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/123456789012/queue",
+    "MAX_ARTICLES": "50",
+    "EMBEDDING_ENDPOINT_NAME": "endpoint",
+    "EMBEDDING_MODEL": "mistral7b",
+    "MAX_LENGTH": "512",
+    "MODEL_ID": "anthropic.claude-3-haiku-20240307-v1:0",
+    "DYNAMODB_TABLE_NAME": "cluster-table",
+    "STATE_MACHINE_ARN": "arn:aws:states:us-east-1:123456789012:stateMachine:summary",
+    "ARTICLES_THRESHOLD": "5",
+}
+# Module of each handler, and the client set up its first invocation does before any request
+HANDLERS = {
+    "pre_process_docs": 'get_client("s3")',
+    "embed_docs": 'get_client("s3"); get_client("sqs"); get_client("sagemaker-runtime"); get_embedding_cache()',
+    "summarization": "get_bedrock_client(); get_table()",
+    "trigger_sfn": 'get_client("dynamodb"); get_client("stepfunctions")',
+}
+# Runs in a fresh interpreter, so nothing is cached between measurements
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module} as handler_module
+imported = time.perf_counter()
+exec({first_use!r}, vars(handler_module))
+first_use = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - start) * 1000, "first_use_ms": (first_use - imported) * 1000}}))
+"""
+
+
+def measure_local(module, first_use, runs):
+    env = dict(os.environ, **BASE_ENV)
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, first_use=first_use)],
+            cwd=os.path.join(LAMBDAS_PATH, module),
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        key: statistics.median(result[key] for result in results)
+        for key in ("import_ms", "first_use_ms")
+    }
+
+
+def report_deployed(function_names, hours):
+    # Cold starts as Lambda reports them, from the REPORT lines that carry an Init Duration
+    import boto3
+
+    logs = boto3.client("logs")
+    start_time = int((time.time() - hours * 3600) * 1000)
+    for function_name in function_names:
+        init_ms, duration_ms = [], []
+        paginator = logs.get_paginator("filter_log_events")
+        for page in paginator.paginate(
+            logGroupName=f"/aws/lambda/{function_name}",
+            startTime=start_time,
+            filterPattern='"Init Duration"',
+        ):
+            for event in page["events"]:
+                fields = dict(
+                    part.strip().split(": ", 1)
+                    for part in event["message"].split("\t")
+                    if ": " in part
+                )
+                init_ms.append(float(fields["Init Duration"].split()[0]))
+                duration_ms.append(float(fields["Duration"].split()[0]))
+        if not init_ms:
+            print(f"{function_name}\tno cold starts in the last {hours} h")
+            continue
+        print(
+            f"{function_name}\tcold starts: {len(init_ms)}"
+            f"\tinit p50: {statistics.median(init_ms):.0f} ms"
+            f"\tinit max: {max(init_ms):.0f} ms"
+            f"\tfirst invocation p50: {statistics.median(duration_ms):.0f} ms"
+        )
+
+
+parser = argparse.ArgumentParser(
+    description="Measure handler import and first-use time, and deployed cold starts"
+)
+parser.add_argument("--runs", type=int, default=5)
+parser.add_argument(
+    "--max-ms",
+    type=float,
+    default=None,
+    help="Exit non-zero when any handler's import plus first use exceeds this",
+)
+parser.add_argument(
+    "--deployed",
+    nargs="*",
+    default=[],
+    metavar="FUNCTION_NAME",
+    help="Also report cold starts of these deployed functions from CloudWatch Logs",
+)
+parser.add_argument("--hours", type=float, default=24)
+args = parser.parse_args()
+
+regressions = []
+print("handler\timport ms\tfirst use ms")
+for module, first_use in HANDLERS.items():
+    timings = measure_local(module, first_use, args.runs)
+    print(f"{module}\t{timings['import_ms']:.1f}\t{timings['first_use_ms']:.1f}")
+    if args.max_ms is not None and sum(timings.values()) > args.max_ms:
+        regressions.append(module)
+
+if args.deployed:
+    report_deployed(args.deployed, args.hours)
+
+if regressions:
+    print(f"Over {args.max_ms} ms: {', '.join(regressions)}")
+sys.exit(1 if regressions else 0)
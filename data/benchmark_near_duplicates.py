@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "..",
+        "business_logic",
+        "lambdas",
+        "pre_process_docs",
+    )
+)
+from near_duplicates import (  # noqa: E402
+    SHINGLE_SIZE,
+    TOKEN_PATTERN,
+    NearDuplicateIndex,
+)
+
+JSON_FILE_PATH = "./public_data/dataset.dev.json"  # Path to the single JSON file
+# Mersenne prime hashing, as near_duplicates signed documents before numpy
+PRIME = (1 << 61) - 1
+
+
+def reference_signature(text, permutations):
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) <= SHINGLE_SIZE:
+        hashes = {zlib.crc32(" ".join(tokens).encode("utf-8"))}
+    else:
+        hashes = {
+            zlib.crc32(" ".join(tokens[i : i + SHINGLE_SIZE]).encode("utf-8"))
+            for i in range(len(tokens) - SHINGLE_SIZE + 1)
+        }
+    return [min([(a * h + b) % PRIME for h in hashes]) for a, b in permutations]
+
+
+def syndicated_copy(text, rng, edits=3):
+    # Wire copies differ by a few words, a dateline or a trailing credit
+    words = text.split()
+    for _ in range(edits):
+        if words:
+            words[rng.randrange(len(words))] = rng.choice(["Reuters", "AP", "(AFP)"])
+    return " ".join(words) + " Copyright 2024."
+
+
+parser = argparse.ArgumentParser(
+    description="MinHash signing cost and detection rate per signature size"
+)
+parser.add_argument("--count", type=int, default=2000, help="Articles to index")
+parser.add_argument("--threshold", type=float, default=0.8)
+args = parser.parse_args()
+
+with open(JSON_FILE_PATH, "r") as f:
+    texts = [
+        article["title"] + "\n" + article["text"]
+        for article in json.load(f)[: args.count]
+    ]
+rng = random.Random(37)
+copies = [syndicated_copy(text, rng) for text in texts]
+
+reference_rng = random.Random(20240501)
+reference_permutations = [
+    (reference_rng.randrange(1, PRIME), reference_rng.randrange(0, PRIME))
+    for _ in range(64)
+]
+start = time.perf_counter()
+for text in texts:
+    reference_signature(text, reference_permutations)
+reference_ms = (time.perf_counter() - start) * 1000 / len(texts)
+print(f"Pure Python, 64 permutations:\t{reference_ms:.3f} ms per article")
+
+print("bands\trows\tms/article\tcopies caught\tfalse matches")
+for bands, rows_per_band in [(8, 4), (16, 4), (32, 4), (16, 8), (32, 2)]:
+    index = NearDuplicateIndex(
+        args.threshold, len(texts) * 2, 3600, bands, rows_per_band
+    )
+    start = time.perf_counter()
+    signatures = [index.signature(text) for text in texts]
+    signing_ms = (time.perf_counter() - start) * 1000 / len(texts)
+
+    # Originals that match an earlier original are false positives
+    false_matches = sum(
+        index.find_or_add(f"original-{i}", signature, now=0) is not None
+        for i, signature in enumerate(signatures)
+    )
+    caught = sum(
+        index.find_or_add(f"copy-{i}", index.signature(copy), now=0) == f"original-{i}"
+        for i, copy in enumerate(copies)
+    )
+    print(
+        f"{bands}\t{rows_per_band}\t{signing_ms:.3f}\t\t"
+        f"{caught / len(texts):.1%}\t\t{false_matches}"
+    )
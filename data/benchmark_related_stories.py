@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+import uuid
+
+import numpy as np
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "..",
+        "business_logic",
+        "stream_consumer",
+    )
+)
+from related_stories import RelatedStories, serve, take_snapshot  # noqa: E402
+
+
+def random_pool(entries, clusters, dimensions):
+    # Pool entries as the consumer keeps them, clusters first
+    label_tracker = [
+        (
+            str(uuid.uuid4()),
+            [f"article-{i}-{j}" for j in range(5 if i < clusters else 1)],
+        )
+        for i in range(entries)
+    ]
+    is_cluster = [i < clusters for i in range(entries)]
+    embeds = list(np.random.rand(entries, dimensions).astype(np.float32) - 0.5)
+    return label_tracker, is_cluster, embeds
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return (
+        f"p50 {latencies[len(latencies) // 2]:.2f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99)]:.2f} ms"
+    )
+
+
+parser = argparse.ArgumentParser(
+    description="Related stories query latency over a synthetic cluster pool"
+)
+parser.add_argument("--entries", type=int, default=50000, help="Pool entries")
+parser.add_argument("--clusters", type=int, default=5000)
+parser.add_argument("--dimensions", type=int, default=1024)
+parser.add_argument("--queries", type=int, default=500)
+parser.add_argument("--k", type=int, default=10)
+parser.add_argument("--port", type=int, default=8765)
+args = parser.parse_args()
+
+label_tracker, is_cluster, embeds = random_pool(
+    args.entries, args.clusters, args.dimensions
+)
+service = RelatedStories()
+
+# The part the consumer thread pays for on every batch
+start = time.time()
+snapshot = take_snapshot(label_tracker, is_cluster, embeds)
+snapshot_ms = (time.time() - start) * 1000
+start = time.time()
+service.publish(snapshot)
+while not len(service.index):
+    time.sleep(0.01)
+print(f"Snapshot on the consumer thread: {snapshot_ms:.2f} ms")
+print(f"Index build in the background: {time.time() - start:.2f} s")
+
+latencies = []
+for i in range(args.queries):
+    response = service.query(embedding=embeds[i % args.entries] + 0.01, k=args.k)
+    latencies.append(response["took_ms"])
+print(f"By embedding: {percentiles(latencies)}")
+
+latencies = []
+for i in range(args.queries):
+    article_id = label_tracker[i % args.entries][1][0]
+    latencies.append(service.query(article_id=article_id, k=args.k)["took_ms"])
+print(f"By article id: {percentiles(latencies)}")
+
+server = serve(service, host="127.0.0.1", port=args.port)
+latencies = []
+for i in range(args.queries):
+    article_id = label_tracker[i % args.entries][1][0]
+    start = time.time()
+    with urllib.request.urlopen(
+        f"http://127.0.0.1:{args.port}/related?article_id={article_id}&k={args.k}"
+    ) as response:
+        json.loads(response.read())
+    latencies.append((time.time() - start) * 1000)
+print(f"Over HTTP: {percentiles(latencies)}")
+
+# Queries keep being answered from the old index while a new one is built
+service.publish(take_snapshot(label_tracker, is_cluster, embeds))
+response = service.query(article_id=label_tracker[0][1][0], k=args.k)
+print(
+    f"During a rebuild: {response['took_ms']:.2f} ms, "
+    f"index age {response['index_age_seconds']:.2f} s"
+)
+server.shutdown()
@@ -0,0 +1,175 @@
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+os.environ.setdefault("MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+os.environ.setdefault("DYNAMODB_TABLE_NAME", "cluster-table")
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "..",
+        "business_logic",
+        "lambdas",
+        "summarization",
+    )
+)
+import summarization  # noqa: E402
+from rate_limiter import (  # noqa: E402
+    CapacityUnavailable,
+    InMemoryBucketStore,
+    TokenBuckets,
+    summary_priority,
+)
+
+
+class LocalBedrock:
+    """
+    Bedrock stand-in enforcing a per-minute request and token quota.
+
+    Quotas are sliding one minute windows, calls over them raise the same
+    ThrottlingException the service does. Latency grows with output tokens.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, seconds_per_token):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.seconds_per_token = seconds_per_token
+        self.lock = threading.Lock()
+        self.calls = []  # (time, tokens)
+        self.stats = {"calls": 0, "throttled": 0, "tokens": 0}
+
+    def invoke_model(self, body, **kwargs):
+        prompt = json.loads(body)["messages"][0]["content"]
+        input_tokens = len(prompt) // 4
+        output_tokens = random.randint(80, 200)
+        tokens = input_tokens + output_tokens
+        now = time.time()
+        with self.lock:
+            self.calls = [call for call in self.calls if call[0] > now - 60]
+            if (
+                len(self.calls) + 1 > self.requests_per_minute
+                or sum(t for _, t in self.calls) + tokens > self.tokens_per_minute
+            ):
+                self.stats["throttled"] += 1
+                raise ClientError(
+                    {"Error": {"Code": "ThrottlingException", "Message": "Too many"}},
+                    "InvokeModel",
+                )
+            self.calls.append((now, tokens))
+            self.stats["calls"] += 1
+            self.stats["tokens"] += tokens
+        time.sleep(output_tokens * self.seconds_per_token)
+        text = "<title>Title</title><summary>Summary</summary>"
+        return {
+            "body": io.BytesIO(
+                json.dumps(
+                    {
+                        "content": [{"type": "text", "text": text}],
+                        "usage": {
+                            "input_tokens": input_tokens,
+                            "output_tokens": output_tokens,
+                        },
+                    }
+                ).encode("utf-8")
+            ),
+            "ResponseMetadata": {"HTTPHeaders": {}},
+        }
+
+
+def random_cluster():
+    size = int(random.paretovariate(1.2) * 5)
+    articles = [
+        {
+            "title": f"Article {i}",
+            "summary": " ".join(random.choices(["word", "story", "news"], k=200)),
+        }
+        for i in range(size)
+    ]
+    return size, articles
+
+
+def worker(deadline, results):
+    # Stands in for one summarization Lambda, picking up a new cluster when done
+    while time.time() < deadline:
+        size, articles = random_cluster()
+        priority = summary_priority(size)
+        start = time.time()
+        try:
+            if size >= summarization.MAP_REDUCE_MIN_ARTICLES:
+                summarization.generate_cluster_summary_map_reduce(
+                    "", articles, priority
+                )
+            else:
+                summarization.generate_cluster_summary("", articles[:25], priority)
+            results.append(("ok", size, time.time() - start))
+        except CapacityUnavailable:
+            results.append(("unavailable", size, time.time() - start))
+            # As the state machine would, back off before the next attempt
+            time.sleep(random.uniform(0, 10))
+
+
+parser = argparse.ArgumentParser(
+    description="Summarization throughput against a local Bedrock stand-in"
+)
+parser.add_argument("--workers", type=int, default=20, help="Concurrent summaries")
+parser.add_argument("--seconds", type=int, default=60)
+parser.add_argument("--requests-per-minute", type=int, default=120)
+parser.add_argument("--tokens-per-minute", type=int, default=200000)
+parser.add_argument("--seconds-per-token", type=float, default=0.005)
+parser.add_argument(
+    "--no-limiter", action="store_true", help="Rely on retries alone, as before"
+)
+args = parser.parse_args()
+
+bedrock = LocalBedrock(
+    args.requests_per_minute, args.tokens_per_minute, args.seconds_per_token
+)
+limiter = None
+if not args.no_limiter:
+    limiter = TokenBuckets(
+        args.requests_per_minute, args.tokens_per_minute, InMemoryBucketStore()
+    )
+summarization.get_bedrock_client = lambda: bedrock
+summarization.get_rate_limiter = lambda: limiter
+# The stand-in logs nothing, keep the per-call prints out of the report
+summarization.print = lambda *a, **k: None
+
+results = []
+deadline = time.time() + args.seconds
+threads = [
+    threading.Thread(target=worker, args=(deadline, results))
+    for _ in range(args.workers)
+]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+
+minutes = args.seconds / 60
+done = [r for r in results if r[0] == "ok"]
+print(f"Limiter: {'off' if args.no_limiter else 'on'}")
+print(
+    f"Summaries: {len(done)} done, {len(results) - len(done)} gave up "
+    f"({len(done) / minutes:.1f} per minute)"
+)
+print(
+    f"Model calls: {bedrock.stats['calls'] / minutes:.1f} per minute "
+    f"of {args.requests_per_minute}, tokens: {bedrock.stats['tokens'] / minutes:.0f} "
+    f"per minute of {args.tokens_per_minute}"
+)
+print(f"Throttled calls: {bedrock.stats['throttled']}")
+large = sorted(r[2] for r in done if r[1] >= summarization.MAP_REDUCE_MIN_ARTICLES)
+small = sorted(r[2] for r in done if r[1] < summarization.MAP_REDUCE_MIN_ARTICLES)
+for name, latencies in (("small", small), ("map-reduce", large)):
+    if latencies:
+        print(
+            f"Latency {name}: p50 {latencies[len(latencies) // 2]:.1f} s, "
+            f"max {latencies[-1]:.1f} s over {len(latencies)} summaries"
+        )
@@ -0,0 +1,72 @@
+import json
+import os
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "business_logic", "lambdas", "pre_process_docs"
+    )
+)
+from text_normalization import clean_text, remove_tags  # noqa: E402
+
+JSON_FILE_PATH = "./public_data/dataset.dev.json"  # Path to the single JSON file
+COUNT = 1200000
+
+
+# Reference implementations, as pre_process_docs used them before text_normalization
+def reference_clean_text(text):
+    text = text.replace("&quot;", '"')
+    text = re.sub(r'[^:a-zA-Z0-9\s"\'-]', "", text)
+    return text
+
+
+def reference_remove_tags(text: str):
+    soup = BeautifulSoup(text, "html.parser")
+    return soup.get_text()
+
+
+# The same calls process_data makes for each article
+def normalize(article, clean, strip):
+    return (
+        clean(article["title"]),
+        clean(article["text"]),
+        strip(article["text"]),
+        strip(article["date"]),
+    )
+
+
+def check_equivalence(data_list):
+    mismatches = 0
+    for article in data_list:
+        expected = normalize(article, reference_clean_text, reference_remove_tags)
+        actual = normalize(article, clean_text, remove_tags)
+        if expected != actual:
+            mismatches += 1
+            print(f"Mismatch for article {article.get('id')}")
+    return mismatches
+
+
+def benchmark(data_list, clean, strip):
+    start = time.perf_counter()
+    for article in data_list:
+        normalize(article, clean, strip)
+    return time.perf_counter() - start
+
+
+with open(JSON_FILE_PATH, "r") as f:
+    data_list = json.load(f)[:COUNT]
+
+mismatches = check_equivalence(data_list)
+print(f"Articles: {len(data_list)}\tMismatches: {mismatches}")
+
+reference_time = benchmark(data_list, reference_clean_text, reference_remove_tags)
+fast_time = benchmark(data_list, clean_text, remove_tags)
+print(f"BeautifulSoup:\t{reference_time:.2f} s")
+print(f"text_normalization:\t{fast_time:.2f} s")
+print(f"Speedup:\t{reference_time / fast_time:.1f}x")
+
+sys.exit(1 if mismatches else 0)
@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+from datetime import datetime
+
+from tqdm import tqdm
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), "..", "business_logic", "stream_consumer")
+)
+from article_storage import capacity_units, offload_article_item  # noqa: E402
+
+JSON_FILE_PATH = "./public_data/dataset.dev.json"  # Path to the single JSON file
+COUNT = 1200000
+MODES = ["inline", "compressed", "s3"]
+
+
+# Build the ARTICLE# item the consumer would write for a raw article
+# Raw HTML is kept in text and summary, so sizes are a slight upper bound
+def build_item(article):
+    return {
+        "PK": "00000000-0000-0000-0000-000000000000",
+        "SK": f"ARTICLE#{article['id']}",
+        "type": "article",
+        "article_id": article["id"],
+        "title": article.get("title"),
+        "summary": article.get("text"),
+        "text": article.get("text"),
+        "organizations": None,
+        "locations": None,
+        "publication_date": article.get("date"),
+        "entry_creation_date": datetime.now().isoformat(),
+    }
+
+
+with open(JSON_FILE_PATH, "r") as f:
+    data_list = json.load(f)[:COUNT]
+
+totals = {mode: {"wcu": 0, "rcu": 0} for mode in MODES}
+for article in tqdm(data_list):
+    item = build_item(article)
+    for mode in MODES:
+        stored_item, _ = offload_article_item(dict(item), mode, "body-bucket")
+        wcu, rcu = capacity_units(stored_item)
+        totals[mode]["wcu"] += wcu
+        totals[mode]["rcu"] += rcu
+
+print(f"Articles: {len(data_list)}")
+for mode in MODES:
+    wcu = totals[mode]["wcu"]
+    rcu = totals[mode]["rcu"]
+    wcu_saving = 1 - wcu / totals["inline"]["wcu"]
+    rcu_saving = 1 - rcu / totals["inline"]["rcu"]
+    print(
+        f"{mode}\tWCU: {wcu}\tRCU: {rcu}\t"
+        f"WCU saving: {wcu_saving:.1%}\tRCU saving: {rcu_saving:.1%}"
+    )
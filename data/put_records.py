@@ -1,15 +1,45 @@
 import boto3
 import json
+import os
+import sys
 import time
 import random
 import string
 from tqdm import tqdm
 
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "..",
+        "business_logic",
+        "lambdas",
+        "pre_process_docs",
+    )
+)
+from record_format import (  # noqa: E402
+    KINESIS_MAX_RECORD_BYTES,
+    default_codec,
+    pack_records,
+)
+
 STREAM_NAME = "input-stream-clustering-demo2"
 PARTITION_KEY = "a"
 JSON_FILE_PATH = "./public_data/dataset.dev.json"  # Path to the single JSON file
+# Articles too large for a record are written here instead of being sent
+SKIPPED_FILE_PATH = "./skipped_articles.json"
 COUNT = 1200000
-BATCH_SIZE = 5
+CODEC = default_codec()  # "zstd" when the zstandard package is installed, else "gzip"
+# Records reach the pre-processing state machine through the pipe, base64 encoded
+# and PREPROCESS_BATCH_SIZE at a time, in an execution input of at most 256 KB
+PREPROCESS_BATCH_SIZE = 10  # Must match preprocess_batch_size in Terraform
+PIPE_OVERHEAD_BYTES = 1024  # Record metadata the pipe adds to each record
+MAX_RECORD_BYTES = min(
+    KINESIS_MAX_RECORD_BYTES,
+    256 * 1024 * 3 // 4 // PREPROCESS_BATCH_SIZE - PIPE_OVERHEAD_BYTES,
+)
+RECORDS_PER_REQUEST = 1  # Records per PutRecords call, at most 500 and 5 MB
+DELAY_SECONDS = 0.2  # Pause between PutRecords calls
+MAX_ATTEMPTS = 5
 
 # Create a Kinesis client
 kinesis = boto3.client("kinesis")
@@ -20,64 +50,60 @@ def generate_partition_key():
     return "".join(random.choices(string.ascii_letters + string.digits, k=16))
 
 
-# Helper function to check record size does not exceed 1MB
-def is_record_size_valid(record):
-    return len(record) < 1024 * 1024  # less than 1MB
-
-
-# Helper function to check batch size does not exceed 5MB
-def is_batch_size_valid(batch):
-    return (
-        sum(len(record["Data"]) for record in batch) < 5 * 1024 * 1024
-    )  # less than 5MB
+# Puts the records, retrying the ones Kinesis throttles or rejects
+def put_with_retries(records):
+    for attempt in range(MAX_ATTEMPTS):
+        response = kinesis.put_records(Records=records, StreamName=STREAM_NAME)
+        if not response.get("FailedRecordCount"):
+            return []
+        failed = []
+        for record, result in zip(records, response["Records"]):
+            if "ErrorCode" in result:
+                print(
+                    f"Error: {result['ErrorCode']}, Message: {result['ErrorMessage']}"
+                )
+                failed.append(record)
+        records = failed
+        time.sleep(random.uniform(0, 0.1 * 2**attempt))
+    return records
 
 
 # Read the JSON data from the file
 with open(JSON_FILE_PATH, "r") as f:
-    data_list = json.load(f)
-
-# Iterate through the JSON data in batches
-for batch_index in tqdm(range(0, min(COUNT, len(data_list)), BATCH_SIZE)):
-    batch_list = data_list[batch_index : batch_index + BATCH_SIZE]
-    data_json = json.dumps(batch_list)
-
-    # Check if the individual record size is valid
-    if not is_record_size_valid(data_json):
-        print(
-            f"Batch starting at index {batch_index} exceeds the maximum allowed size of 1MB."
-        )
-        continue  # Skip this batch
-
-    # Create a record to put to Kinesis
-    record = {
-        "Data": data_json,
-        "PartitionKey": generate_partition_key(),
-    }
-
-    records_to_put = [record]
-
-    # Add the record to the batch if it doesn't exceed the batch size
-    if is_batch_size_valid(records_to_put):
-        # Delay for 0.2 seconds
-        time.sleep(0.2)
-
-        # Create the PutRecords request
-        put_records_request = {
-            "Records": records_to_put,
-            "StreamName": STREAM_NAME,
-        }
-
-        # Put the records to Kinesis
-        response = kinesis.put_records(**put_records_request)
-
-        # Check for any failed records
-        failed_records = response.get("Records", [])
-        for record in failed_records:
-            if "ErrorCode" in record:
-                print(
-                    f"Error: {record['ErrorCode']}, Message: {record['ErrorMessage']}"
-                )
-    else:
-        print(
-            f"Batch starting at index {batch_index} would exceed the batch size limit of 5MB."
-        )
+    data_list = json.load(f)[:COUNT]
+
+records, skipped = pack_records(data_list, MAX_RECORD_BYTES, CODEC)
+for article in skipped:
+    print(
+        f"Article {article.get('id')} exceeds the maximum record size of {MAX_RECORD_BYTES} bytes."
+    )
+if skipped:
+    with open(SKIPPED_FILE_PATH, "w") as f:
+        json.dump(skipped, f)
+record_bytes = sum(len(record) for record, _ in records)
+print(
+    f"{len(data_list) - len(skipped)} articles in {len(records)} {CODEC} records, "
+    f"{(len(data_list) - len(skipped)) / max(len(records), 1):.1f} articles and "
+    f"{record_bytes / max(len(records), 1) / 1024:.0f} KB per record"
+)
+
+failed_count = 0
+for request_index in tqdm(range(0, len(records), RECORDS_PER_REQUEST)):
+    records_to_put = [
+        {"Data": record, "PartitionKey": generate_partition_key()}
+        for record, _ in records[request_index : request_index + RECORDS_PER_REQUEST]
+    ]
+    failed_count += len(put_with_retries(records_to_put))
+    time.sleep(DELAY_SECONDS)
+
+# Repeated after the progress bar so neither goes unnoticed
+if skipped:
+    print(
+        f"WARNING: {len(skipped)} of {len(data_list)} articles "
+        f"({len(skipped) / len(data_list):.2%}) were not sent, each compresses to more "
+        f"than {MAX_RECORD_BYTES} bytes. They are in {SKIPPED_FILE_PATH}"
+    )
+if failed_count:
+    print(f"WARNING: {failed_count} records could not be put to {STREAM_NAME}")
+if skipped or failed_count:
+    sys.exit(1)
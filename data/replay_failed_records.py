@@ -0,0 +1,49 @@
+import argparse
+import base64
+import json
+
+import boto3
+
+FAILED_RECORDS_PREFIX = "failed-records/"
+
+
+def failed_record_keys(s3, bucket, prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield obj["Key"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Puts records parked by pre-processing back on the input stream"
+    )
+    parser.add_argument("--bucket", required=True, help="Preprocessing bucket name")
+    parser.add_argument("--stream", default="input-stream-clustering-demo2")
+    parser.add_argument(
+        "--prefix",
+        default=FAILED_RECORDS_PREFIX,
+        help="e.g. failed-records/2024/05/01/",
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    s3 = boto3.client("s3")
+    kinesis = boto3.client("kinesis")
+    replayed = 0
+    for key in failed_record_keys(s3, args.bucket, args.prefix):
+        parked = json.loads(s3.get_object(Bucket=args.bucket, Key=key)["Body"].read())
+        record = parked["record"]
+        print(f"{key}: {parked['error']}")
+        if args.dry_run:
+            continue
+        kinesis.put_record(
+            StreamName=args.stream,
+            Data=base64.b64decode(record["data"]),
+            PartitionKey=record.get("partitionKey") or "replay",
+        )
+        # Removed once it is back on the stream, so a second run does not repeat it
+        s3.delete_object(Bucket=args.bucket, Key=key)
+        replayed += 1
+
+    print(f"Replayed {replayed} records to {args.stream}")
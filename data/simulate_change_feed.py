@@ -0,0 +1,137 @@
+import argparse
+import os
+import random
+import sys
+from datetime import datetime
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "..",
+        "business_logic",
+        "lambdas",
+        "change_feed",
+    )
+)
+from change_feed import (  # noqa: E402
+    FEED_FIELDS,
+    ChangeFeed,
+    InMemoryChangeStore,
+    InMemoryStream,
+    cluster_changes,
+)
+
+
+def metadata_item(cluster_id, number_of_articles):
+    return {
+        "PK": cluster_id,
+        "SK": f"#METADATA#{cluster_id}",
+        "type": "metadata",
+        "number_of_articles": number_of_articles,
+        "generated_summary": "",
+        "summary_count": 0,
+        "description": "",
+        "is_cluster": True,
+        "updated_at": datetime.now().isoformat(),
+    }
+
+
+def simulate_batch(stream, clusters, new_clusters, articles, summaries):
+    # Stands in for one consumer batch, then the summaries it triggered
+    for _ in range(new_clusters):
+        cluster_id = f"cluster-{len(clusters)}"
+        clusters.append(cluster_id)
+        stream.put_item(metadata_item(cluster_id, 0))
+    for _ in range(articles):
+        cluster_id = random.choice(clusters)
+        article_id = f"{cluster_id}-{random.getrandbits(32)}"
+        stream.put_item({"PK": cluster_id, "SK": f"ARTICLE#{article_id}"})
+        metadata = stream.items[(cluster_id, f"#METADATA#{cluster_id}")]
+        stream.update_item(
+            metadata["PK"],
+            metadata["SK"],
+            {
+                "number_of_articles": metadata["number_of_articles"] + 1,
+                "updated_at": datetime.now().isoformat(),
+                # Not shown by the cluster list, so not in the feed
+                "centroid": bytes(random.getrandbits(8) for _ in range(8)),
+            },
+        )
+    for cluster_id in random.sample(clusters, min(summaries, len(clusters))):
+        metadata = stream.items[(cluster_id, f"#METADATA#{cluster_id}")]
+        stream.update_item(
+            metadata["PK"],
+            metadata["SK"],
+            {
+                "generated_summary": f"Summary {random.getrandbits(16)}",
+                "description": f"Title {random.getrandbits(16)}",
+                "summary_count": metadata["summary_count"] + 1,
+            },
+        )
+
+
+def cluster_list(stream):
+    # What a full scan of the table shows the dashboard
+    return {
+        pk: {field: item[field] for field in FEED_FIELDS}
+        for (pk, sk), item in stream.items.items()
+        if sk.startswith("#METADATA#")
+    }
+
+
+parser = argparse.ArgumentParser(
+    description="Dashboard refreshes over the change feed against an in-memory stream"
+)
+parser.add_argument("--refreshes", type=int, default=200)
+parser.add_argument("--batches-per-refresh", type=int, default=3)
+parser.add_argument("--max-versions", type=int, default=100)
+parser.add_argument(
+    "--stall", type=int, default=150, help="Refresh at which the dashboard pauses"
+)
+args = parser.parse_args()
+
+stream = InMemoryStream()
+feed = ChangeFeed(InMemoryChangeStore(), args.max_versions)
+clusters = []
+
+# The dashboard starts from a full read and the version it was taken at
+state = feed.changes_since(None)
+version = state["version"]
+dashboard = cluster_list(stream)
+scan_reads = feed_reads = resets = 0
+
+for refresh in range(args.refreshes):
+    for _ in range(args.batches_per_refresh):
+        simulate_batch(stream, clusters, random.randint(1, 3), random.randint(0, 30), 2)
+        for event in stream.events():
+            changes = cluster_changes(event["Records"])
+            if changes:
+                feed.append(changes)
+
+    # A paused dashboard falls behind the entries the feed keeps
+    if refresh == args.stall:
+        for _ in range(args.max_versions + 1):
+            simulate_batch(stream, clusters, 0, 5, 0)
+            for event in stream.events():
+                feed.append(cluster_changes(event["Records"]))
+
+    scan_reads += len(stream.items)
+    response = feed.changes_since(version)
+    feed_reads += 1
+    if response["reset"]:
+        resets += 1
+        dashboard = cluster_list(stream)
+    for change in response["changes"]:
+        dashboard[change["cluster_id"]] = {
+            field: change[field] for field in FEED_FIELDS
+        }
+    version = response["version"]
+    assert dashboard == cluster_list(stream), f"Dashboard out of date at {refresh}"
+
+print(
+    f"Refreshes: {args.refreshes}, clusters: {len(clusters)}, items: {len(stream.items)}"
+)
+print(f"Feed version: {version}, entries kept: {args.max_versions}, resets: {resets}")
+print(f"Items read by full scans: {scan_reads}")
+print(f"Queries over the change feed: {feed_reads}, one per refresh")
+print("Dashboard matched the table after every refresh")
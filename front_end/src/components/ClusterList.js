@@ -13,6 +13,10 @@ import ClusterModal from "./ClusterModal";
 import awsConfig from "../aws-exports";
 
 const refreshInterval = 5000;
+const clusterListShards = 4; // Must match CLUSTER_LIST_SHARDS in the stream consumer
+const clusterListLimit = 50;
+const changeFeedKey = "#CHANGE_FEED#"; // Must match FEED_PK in the change feed Lambda
+const versionKey = (version) => `VERSION#${String(version).padStart(12, "0")}`;
 
 const ClusterList = () => {
   const [clusters, setClusters] = useState([]);
@@ -25,6 +29,8 @@ const ClusterList = () => {
   ); // Initialize countdown
 
   const dynamoDbRef = useRef();
+  const clustersByIdRef = useRef(new Map());
+  const versionRef = useRef(null); // Change feed version the list is up to date with
 
   useEffect(() => {
     const configureAWS = async () => {
@@ -65,63 +71,167 @@ const ClusterList = () => {
     };
   }, []);
 
+  const showClusters = () => {
+    const newClusters = [...clustersByIdRef.current.values()]
+      .filter(
+        (item) =>
+          item.is_cluster &&
+          item.generated_summary &&
+          item.number_of_articles > 2
+      )
+      .sort((a, b) => b.number_of_articles - a.number_of_articles)
+      .slice(0, clusterListLimit);
+
+    setClusters(newClusters);
+    setTotalArticles(
+      newClusters.reduce(
+        (total, cluster) => total + cluster.number_of_articles,
+        0
+      )
+    );
+  };
+
+  const fetchLatestVersion = async () => {
+    const data = await dynamoDbRef.current
+      .query({
+        TableName: "cluster-table-clustering-demo2",
+        KeyConditionExpression: "PK = :pk AND begins_with(SK, :version)",
+        ExpressionAttributeValues: {
+          ":pk": changeFeedKey,
+          ":version": "VERSION#",
+        },
+        ScanIndexForward: false,
+        Limit: 1,
+        ConsistentRead: true,
+      })
+      .promise();
+    return data.Items.length ? data.Items[0].version : 0;
+  };
+
+  const loadClusters = async () => {
+    // Taken first, changes made during the load are applied again on the next refresh
+    const version = await fetchLatestVersion();
+    // Read the top clusters from each shard of the read model instead of scanning the table
+    const shardQueries = [...Array(clusterListShards).keys()].map((shard) =>
+      dynamoDbRef.current
+        .query({
+          TableName: "cluster-table-clustering-demo2",
+          IndexName: "clusters_by_size",
+          KeyConditionExpression: "cluster_shard = :shard",
+          ExpressionAttributeValues: { ":shard": `CLUSTERS#${shard}` },
+          ScanIndexForward: false,
+          Limit: clusterListLimit,
+        })
+        .promise()
+    );
+    const responses = await Promise.all(shardQueries);
+
+    clustersByIdRef.current = new Map(
+      responses.flatMap((data) => data.Items).map((item) => [item.PK, item])
+    );
+    versionRef.current = version;
+  };
+
+  const fetchChanges = async (version) => {
+    // One query for every entry after the version, null once some were dropped
+    let lastEvaluatedKey = null;
+    const entries = [];
+    do {
+      const params = {
+        TableName: "cluster-table-clustering-demo2",
+        KeyConditionExpression: "PK = :pk AND SK > :sk",
+        ExpressionAttributeValues: {
+          ":pk": changeFeedKey,
+          ":sk": versionKey(version),
+        },
+        ConsistentRead: true,
+      };
+      if (lastEvaluatedKey) {
+        params.ExclusiveStartKey = lastEvaluatedKey;
+      }
+      const data = await dynamoDbRef.current.query(params).promise();
+      entries.push(...data.Items);
+      lastEvaluatedKey = data.LastEvaluatedKey;
+    } while (lastEvaluatedKey);
+
+    if (entries.length && entries[0].version !== version + 1) {
+      return null;
+    }
+    return entries;
+  };
+
+  const applyChanges = (entries) => {
+    for (const entry of entries) {
+      for (const change of JSON.parse(entry.changes)) {
+        const { cluster_id: clusterId, kinds, ...fields } = change;
+        if (kinds.includes("removed")) {
+          clustersByIdRef.current.delete(clusterId);
+        } else {
+          clustersByIdRef.current.set(clusterId, {
+            ...clustersByIdRef.current.get(clusterId),
+            ...fields,
+            PK: clusterId,
+          });
+        }
+      }
+      versionRef.current = entry.version;
+    }
+  };
+
   const fetchClusters = async () => {
     if (!dynamoDbRef.current) {
       console.log("DynamoDB client not initialized");
       return;
     }
+    // Only the changes since the last refresh, the full list when too far behind
+    const entries =
+      versionRef.current === null ? null : await fetchChanges(versionRef.current);
+    if (entries) {
+      applyChanges(entries);
+    } else {
+      await loadClusters();
+    }
+    showClusters();
+  };
+
+  const fetchArticles = async (cluster) => {
     let lastEvaluatedKey = null;
-    const allItems = [];
-    let articlesCount = 0;
+    const articles = [];
     const params = {
       TableName: "cluster-table-clustering-demo2",
+      KeyConditionExpression: "#pk = :pk AND begins_with(#sk, :article)",
+      // Only what the modal shows, the embedding is most of an article item
+      ProjectionExpression: "#pk, #sk, #title, #summary, #text, #date",
+      ExpressionAttributeNames: {
+        "#pk": "PK",
+        "#sk": "SK",
+        "#title": "title",
+        "#summary": "summary",
+        "#text": "text",
+        "#date": "publication_date",
+      },
+      ExpressionAttributeValues: {
+        ":pk": cluster.PK,
+        ":article": "ARTICLE#",
+      },
     };
 
     do {
       if (lastEvaluatedKey) {
         params.ExclusiveStartKey = lastEvaluatedKey;
       }
-      const data = await dynamoDbRef.current.scan(params).promise();
-      allItems.push(...data.Items);
+      const data = await dynamoDbRef.current.query(params).promise();
+      articles.push(...data.Items.filter((item) => item.publication_date));
       lastEvaluatedKey = data.LastEvaluatedKey;
     } while (lastEvaluatedKey);
 
-    const articlesByCluster = allItems.reduce((acc, item) => {
-      if (item.is_cluster) {
-        acc[item.PK] = acc[item.PK] || [];
-      } else if (item.SK.startsWith("ARTICLE#")) {
-        if (item.publication_date) {
-          articlesCount++;
-          if (acc[item.PK]) {
-            acc[item.PK].push(item);
-          }
-        }
-      }
-      return acc;
-    }, {});
-
-    const newClusters = allItems
-      .filter(
-        (item) =>
-          item.is_cluster &&
-          item.generated_summary &&
-          articlesByCluster[item.PK] &&
-          articlesByCluster[item.PK].length > 2
-      )
-      .map((cluster) => ({
-        ...cluster,
-        articles: articlesByCluster[cluster.PK],
-        number_of_articles: articlesByCluster[cluster.PK].length,
-      }))
-      .sort((a, b) => b.number_of_articles - a.number_of_articles);
-
-    setClusters(newClusters);
-    setTotalArticles(articlesCount);
+    return articles;
   };
 
-  const handleViewArticles = (cluster) => {
+  const handleViewArticles = async (cluster) => {
     console.log("Opening modal for cluster:", cluster.PK);
-    setSelectedCluster(cluster);
+    const articles = await fetchArticles(cluster);
+    setSelectedCluster({ ...cluster, articles });
     setModalVisible(true); // Set the modal to be visible
   };
 
@@ -42,7 +42,9 @@ const ClusterModal = ({ cluster, articles, onClose, visible }) => {
                 ? "Hide Full Text"
                 : "Show Full Text"}
             </Button>
-            {visibleArticles[article.SK] && <p>{article.text}</p>}
+            {visibleArticles[article.SK] && (
+              <p>{article.text || article.summary}</p>
+            )}
             <hr></hr>
           </div>
         ))
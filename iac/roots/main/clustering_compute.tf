@@ -16,6 +16,15 @@ resource "aws_s3_object" "clustering_code" {
   force_destroy = true
 }
 
+# Text queries of the related stories service embed with the same client as embed_docs
+resource "aws_s3_object" "clustering_embedding_client" {
+  bucket        = module.cluster_code_bucket.name
+  key           = "stream_consumer/embedding_client.py"
+  source        = "../../../business_logic/lambdas/embed_docs/embedding_client.py"
+  source_hash   = filemd5("../../../business_logic/lambdas/embed_docs/embedding_client.py")
+  force_destroy = true
+}
+
 # SQS Queue
 resource "aws_sqs_queue" "tags" {
   name                    = "${var.app_name}-${var.env_name}-queue"
@@ -58,12 +67,17 @@ data "cloudinit_config" "this_cloudinit_config" {
         CONFIGURE_NODE_SCRIPT = base64gzip(templatefile("${path.module}/templates/ConfigureNode.sh",
           {
             config = {
-              "S3_BUCKET_PATH"     = "${module.cluster_code_bucket.id}/stream_consumer/"
-              "S3_BUCKET_NAME"     = module.cluster_code_bucket.id
-              "S3_FILE_KEY"        = "checkpoint.pkl"
-              "SQS_QUEUE"          = aws_sqs_queue.tags.url
-              "DYNAMODB_TABLE"     = aws_dynamodb_table.cluster_table.name
-              "AWS_DEFAULT_REGION" = local.region
+              "S3_BUCKET_PATH"          = "${module.cluster_code_bucket.id}/stream_consumer/"
+              "S3_BUCKET_NAME"          = module.cluster_code_bucket.id
+              "S3_FILE_KEY"             = "checkpoint.pkl"
+              "SQS_QUEUE"               = aws_sqs_queue.tags.url
+              "DYNAMODB_TABLE"          = aws_dynamodb_table.cluster_table.name
+              "ARTICLE_STORAGE_MODE"    = var.article_storage_mode
+              "AWS_DEFAULT_REGION"      = local.region
+              "RELATED_STORIES_PORT"    = var.related_stories_port
+              "EMBEDDING_MODEL"         = var.model_name
+              "EMBEDDING_ENDPOINT_NAME" = var.model_name != "titan" ? aws_sagemaker_endpoint.pytorch_endpoint[0].name : ""
+              "MAX_LENGTH"              = var.max_length_embedding
             }
           }
           )
@@ -84,6 +98,16 @@ resource "aws_security_group" "this_aws_security_group_ec2" {
     protocol    = "-1"
     cidr_blocks = ["0.0.0.0/0"]
   }
+  dynamic "ingress" {
+    for_each = var.related_stories_port > 0 ? [var.related_stories_port] : []
+    content {
+      description = "Related stories queries from within the VPC"
+      from_port   = ingress.value
+      to_port     = ingress.value
+      protocol    = "tcp"
+      cidr_blocks = [var.cidr_block]
+    }
+  }
   tags = merge(local.tags, { Name = "${local.standard_resource_name}-ec2" })
 
 }
@@ -20,7 +20,7 @@ resource "aws_pipes_pipe" "event_pipe" {
 
   source_parameters {
     kinesis_stream_parameters {
-      batch_size             = 1
+      batch_size             = var.preprocess_batch_size
       parallelization_factor = 1
       starting_position      = "TRIM_HORIZON"
       maximum_retry_attempts = 0
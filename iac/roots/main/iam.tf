@@ -167,6 +167,11 @@ resource "aws_iam_role_policy" "stream_consumer_policy" {
         Effect   = "Allow",
         Resource = ["${module.cluster_code_bucket.arn}/*", module.cluster_code_bucket.arn]
       },
+      {
+        Action   = ["s3:GetObject"],
+        Effect   = "Allow",
+        Resource = ["${module.embedding_data_bucket.arn}/*"]
+      },
       {
         "Effect" : "Allow",
         "Action" : [
@@ -188,6 +193,7 @@ resource "aws_iam_role_policy" "stream_consumer_policy" {
           "dynamodb:CreateTable",
           "dynamodb:DescribeTable",
           "dynamodb:GetItem",
+          "dynamodb:Query",
           "dynamodb:Scan",
         ],
         Effect = "Allow",
@@ -205,6 +211,12 @@ resource "aws_iam_role_policy" "stream_consumer_policy" {
         Effect   = "Allow"
         Resource = aws_sqs_queue.tags.arn
       },
+      {
+        # Embeds the text of related stories queries
+        Action   = "bedrock:InvokeModel",
+        Resource = "*",
+        Effect   = "Allow",
+      },
       {
         "Effect" : "Allow",
         "Action" : [
@@ -379,6 +391,22 @@ resource "aws_iam_policy" "lambda_sqs_policy" {
   })
 }
 
+resource "aws_iam_role_policy" "embedding_cache_policy" {
+  name = "embedding_cache_policy-${var.app_name}-${var.env_name}"
+  role = aws_iam_role.embedding_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Action   = ["dynamodb:BatchGetItem", "dynamodb:BatchWriteItem"],
+        Effect   = "Allow",
+        Resource = [aws_dynamodb_table.embedding_cache_table.arn]
+      }
+    ]
+  })
+}
+
 resource "aws_iam_policy" "lambda_s3_policy" {
   description = "Policy for S3 Access"
   policy = jsonencode({
@@ -402,9 +430,26 @@ resource "aws_iam_policy" "lambda_s3_policy" {
   })
 }
 
+resource "aws_iam_role_policy" "preprocessing_invoke_embedding_policy" {
+  count = var.fused_ingest ? 1 : 0
+  name  = "preprocessing_invoke_embedding_policy-${var.app_name}-${var.env_name}"
+  role  = aws_iam_role.preprocessing_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Action   = ["lambda:InvokeFunction"],
+        Effect   = "Allow",
+        Resource = [aws_lambda_function.embedding_lambda.arn]
+      }
+    ]
+  })
+}
+
 resource "aws_iam_policy_attachment" "lambda_execution_policy_attachment" {
   name       = "lambda_execution_policy_attachment"
-  roles      = [aws_iam_role.summarization_lambda_role.name, aws_iam_role.trigger_sfn_lambda_role.name, aws_iam_role.preprocessing_lambda_role.name, aws_iam_role.embedding_lambda_role.name, aws_iam_role.step_functions_role.name]
+  roles      = [aws_iam_role.summarization_lambda_role.name, aws_iam_role.trigger_sfn_lambda_role.name, aws_iam_role.change_feed_lambda_role.name, aws_iam_role.preprocessing_lambda_role.name, aws_iam_role.embedding_lambda_role.name, aws_iam_role.step_functions_role.name]
   policy_arn = aws_iam_policy.lambda_execution_policy.arn
 }
 
@@ -416,7 +461,7 @@ resource "aws_iam_policy_attachment" "lambda_kinesis_policy_attachment" {
 
 resource "aws_iam_policy_attachment" "lambda_sagemaker_policy_attachment" {
   name       = "lambda_sagemaker_policy_attachment"
-  roles      = [aws_iam_role.embedding_lambda_role.name]
+  roles      = [aws_iam_role.embedding_lambda_role.name, aws_iam_role.stream_consumer_role.name]
   policy_arn = aws_iam_policy.lambda_sagemaker_policy.arn
 }
 
@@ -461,7 +506,9 @@ resource "aws_iam_role_policy" "summarization_policy" {
     Statement = [
       {
         Action = [
+          "dynamodb:GetItem",
           "dynamodb:Query",
+          "dynamodb:UpdateItem",
         ],
         Resource = [
           aws_dynamodb_table.cluster_table.arn,
@@ -572,6 +619,58 @@ resource "aws_iam_role_policy" "trigger_sfn_policy" {
         Resource = aws_sfn_state_machine.summary_sfn.arn,
         Effect   = "Allow",
       },
+      {
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:BatchGetItem",
+          "dynamodb:Query",
+          "dynamodb:PutItem",
+          "dynamodb:UpdateItem",
+          "dynamodb:DeleteItem",
+          "dynamodb:GetRecords",
+          "dynamodb:GetShardIterator",
+          "dynamodb:DescribeStream",
+          "dynamodb:ListStreams"
+        ],
+        Resource = [
+          aws_dynamodb_table.cluster_table.arn,
+          "${aws_dynamodb_table.cluster_table.arn}/*"
+        ],
+        Effect = "Allow",
+      },
+      {
+        Action   = "logs:*",
+        Resource = "arn:aws:logs:${local.region}:${local.account_id}:*",
+        Effect   = "Allow",
+      },
+    ],
+  })
+}
+
+resource "aws_iam_role" "change_feed_lambda_role" {
+  name = "change-feed-role-${var.app_name}-${var.env_name}"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Action = "sts:AssumeRole",
+        Effect = "Allow",
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        },
+      },
+    ],
+  })
+}
+
+resource "aws_iam_role_policy" "change_feed_policy" {
+  name = "change-feed-policy-${var.app_name}-${var.env_name}"
+  role = aws_iam_role.change_feed_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
       {
         Action = [
           "dynamodb:GetItem",
@@ -579,6 +678,7 @@ resource "aws_iam_role_policy" "trigger_sfn_policy" {
           "dynamodb:PutItem",
           "dynamodb:UpdateItem",
           "dynamodb:DeleteItem",
+          "dynamodb:ConditionCheckItem",
           "dynamodb:GetRecords",
           "dynamodb:GetShardIterator",
           "dynamodb:DescribeStream",
@@ -10,6 +10,8 @@ module "pre_process_docs_ecr" {
   aws_kms_key_arn     = aws_kms_key.this_aws_kms_key.arn
   ecr_count_number    = 2
   ecr_base_arn        = local.ecr_base_arn
+  # The batch format is owned by the embedding function, which reads what this one writes
+  shared_files = ["${path.module}/${var.lambda_code_path}/embed_docs/batch_handoff.py"]
 }
 
 resource "aws_lambda_function" "pre_processing_lambda" {
@@ -20,7 +22,8 @@ resource "aws_lambda_function" "pre_processing_lambda" {
   description                    = "Executes the pre-process_docs-${local.standard_resource_name} Function"
   function_name                  = "pre-process-docs-${local.standard_resource_name}"
   role                           = aws_iam_role.preprocessing_lambda_role.arn
-  timeout                        = 300 # Timeout in seconds (5 minutes)
+  # Fused ingest waits for the embedding function, so it needs longer than its timeout
+  timeout                        = var.fused_ingest ? 900 : 300 # Timeout in seconds (15 or 5 minutes)
   kms_key_arn                    = aws_kms_key.this_aws_kms_key.arn
   image_uri                      = module.pre_process_docs_ecr.latest_image_uri
   package_type                   = "Image"
@@ -39,7 +42,12 @@ resource "aws_lambda_function" "pre_processing_lambda" {
 
   environment {
     variables = {
-      PREPROCESS_BUCKET = module.preprocess_data_bucket.name
+      PREPROCESS_BUCKET          = module.preprocess_data_bucket.name
+      HANDOFF_FORMAT             = var.handoff_format
+      FUSED_EMBEDDING_FUNCTION   = var.fused_ingest ? aws_lambda_function.embedding_lambda.function_name : ""
+      FUSED_MAX_DOCUMENTS        = var.fused_max_documents
+      FUSED_READ_TIMEOUT_SECONDS = aws_lambda_function.embedding_lambda.timeout + 10
+      NEAR_DUPLICATE_THRESHOLD   = var.near_duplicate_threshold
     }
   }
 }
@@ -83,13 +91,18 @@ resource "aws_lambda_function" "embedding_lambda" {
 
   environment {
     variables = {
-      EMBEDDING_ENDPOINT_NAME = var.model_name != "titan" ? aws_sagemaker_endpoint.pytorch_endpoint[0].name : ""
-      MAX_LENGTH              = var.max_length_embedding
-      SQS_QUEUE_URL           = aws_sqs_queue.tags.url
-      PREPROCESS_BUCKET       = module.preprocess_data_bucket.name
-      EMBEDDING_BUCKET        = module.embedding_data_bucket.name
-      MAX_ARTICLES            = var.max_articles_embedding_endpoint
-      EMBEDDING_MODEL         = var.model_name
+      EMBEDDING_ENDPOINT_NAME     = var.model_name != "titan" ? aws_sagemaker_endpoint.pytorch_endpoint[0].name : ""
+      MAX_LENGTH                  = var.max_length_embedding
+      SQS_QUEUE_URL               = aws_sqs_queue.tags.url
+      PREPROCESS_BUCKET           = module.preprocess_data_bucket.name
+      EMBEDDING_BUCKET            = module.embedding_data_bucket.name
+      MAX_ARTICLES                = var.max_articles_embedding_endpoint
+      EMBEDDING_MODEL             = var.model_name
+      EMBEDDING_ENCODING          = var.embedding_encoding
+      MESSAGE_MODE                = var.message_mode
+      HANDOFF_FORMAT              = var.handoff_format
+      EMBEDDING_CACHE_TABLE       = aws_dynamodb_table.embedding_cache_table.name
+      EMBEDDING_CACHE_TTL_SECONDS = var.embedding_cache_ttl_days * 24 * 3600
     }
   }
 }
@@ -134,9 +147,53 @@ resource "aws_lambda_function" "trigger_sfn_function" {
 
   environment {
     variables = {
-      STATE_MACHINE_ARN   = aws_sfn_state_machine.summary_sfn.arn
-      ARTICLES_THRESHOLD  = 5
-      DYNAMODB_TABLE_NAME = aws_dynamodb_table.cluster_table.name
+      STATE_MACHINE_ARN          = aws_sfn_state_machine.summary_sfn.arn
+      ARTICLES_THRESHOLD         = 5
+      DYNAMODB_TABLE_NAME        = aws_dynamodb_table.cluster_table.name
+      # Every attempt of the summarization function and the backoff between them
+      SUMMARY_PENDING_SECONDS    = 5 * aws_lambda_function.summarization_function.timeout + 300
+      SUMMARY_MIN_DRIFT          = var.summary_min_drift
+      SUMMARY_MIN_ENTITY_NOVELTY = var.summary_min_entity_novelty
+    }
+  }
+}
+
+module "change_feed_ecr" {
+  source              = "../../templates/modules/ecr"
+  region              = local.region
+  ecr_name            = "change-feed-${local.standard_resource_name}"
+  build_script_path   = "${path.module}/${var.build_script_path}"
+  business_logic_path = "${path.module}/${var.lambda_code_path}/change_feed/"
+  tags                = local.tags
+  aws_kms_key_arn     = aws_kms_key.this_aws_kms_key.arn
+  ecr_count_number    = 2
+  ecr_base_arn        = local.ecr_base_arn
+}
+
+resource "aws_lambda_function" "change_feed_function" {
+  #checkov:skip=CKV_AWS_116: "Ensure that AWS Lambda function is configured for a Dead Letter Queue(DLQ)"
+  #checkov:skip=CKV_AWS_173: "Check encryption settings for Lambda environmental variable"
+  #checkov:skip=CKV_AWS_117: "Ensure that AWS Lambda function is configured inside a VPC"
+  #checkov:skip=CKV_AWS_272: "Ensure AWS Lambda function is configured to validate code-signing"
+  description   = "Executes the change-feed-${local.standard_resource_name} Function"
+  function_name = "change-feed-${local.standard_resource_name}"
+  role          = aws_iam_role.change_feed_lambda_role.arn
+  timeout       = 30
+  kms_key_arn   = aws_kms_key.this_aws_kms_key.arn
+  image_uri     = module.change_feed_ecr.latest_image_uri
+  package_type  = "Image"
+  tags          = local.tags
+
+  reserved_concurrent_executions = -1
+
+  tracing_config {
+    mode = "Active"
+  }
+
+  environment {
+    variables = {
+      DYNAMODB_TABLE_NAME      = aws_dynamodb_table.cluster_table.name
+      CHANGE_FEED_MAX_VERSIONS = var.change_feed_max_versions
     }
   }
 }
@@ -161,7 +218,7 @@ resource "aws_lambda_function" "summarization_function" {
   description                    = "Executes the summarization-function-${local.standard_resource_name} Function"
   function_name                  = "summarization-function-${local.standard_resource_name}"
   role                           = aws_iam_role.summarization_lambda_role.arn
-  timeout                        = 30
+  timeout                        = 120 # Map-reduce summaries make two rounds of model calls
   kms_key_arn                    = aws_kms_key.this_aws_kms_key.arn
   image_uri                      = module.summarization_function_ecr.latest_image_uri
   package_type                   = "Image"
@@ -181,8 +238,13 @@ resource "aws_lambda_function" "summarization_function" {
 
   environment {
     variables = {
-      DYNAMODB_TABLE_NAME = aws_dynamodb_table.cluster_table.name
-      MODEL_ID            = "anthropic.claude-3-haiku-20240307-v1:0"
+      DYNAMODB_TABLE_NAME         = aws_dynamodb_table.cluster_table.name
+      MODEL_ID                    = "anthropic.claude-3-haiku-20240307-v1:0"
+      SUMMARY_MAX_ARTICLES        = 25
+      PROMPT_TOKEN_BUDGET         = 3000
+      MAP_REDUCE_MIN_ARTICLES     = 40
+      BEDROCK_REQUESTS_PER_MINUTE = var.bedrock_requests_per_minute
+      BEDROCK_TOKENS_PER_MINUTE   = var.bedrock_tokens_per_minute
     }
   }
 }
@@ -76,20 +76,119 @@ resource "aws_dynamodb_table" "cluster_table" {
     type = "S"
   }
 
+  attribute {
+    name = "cluster_shard"
+    type = "S"
+  }
+
+  attribute {
+    name = "number_of_articles"
+    type = "N"
+  }
+
+  attribute {
+    name = "updated_at"
+    type = "S"
+  }
+
+  # Article to cluster lookup, embeddings and bodies stay in the base table
   global_secondary_index {
-    name            = "article_id"
-    hash_key        = "article_id"
-    projection_type = "ALL"
+    name               = "article_id"
+    hash_key           = "article_id"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["type", "title", "publication_date", "entry_creation_date"]
   }
 
+  # Top clusters read model, only metadata items carry cluster_shard
+  global_secondary_index {
+    name               = "clusters_by_size"
+    hash_key           = "cluster_shard"
+    range_key          = "number_of_articles"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["description", "generated_summary", "summary_count", "most_common_location", "most_common_organization", "earliest_date", "latest_date", "is_cluster"]
+  }
+
+  global_secondary_index {
+    name               = "clusters_by_recency"
+    hash_key           = "cluster_shard"
+    range_key          = "updated_at"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["description", "generated_summary", "summary_count", "most_common_location", "most_common_organization", "earliest_date", "latest_date", "is_cluster"]
+  }
+
+  # Old images let the change feed tell what a metadata update changed
   stream_enabled   = true
-  stream_view_type = "NEW_IMAGE"
+  stream_view_type = "NEW_AND_OLD_IMAGES"
+}
+
+# Shared tier of the embedding cache, keyed by a hash of the embedded text and model
+resource "aws_dynamodb_table" "embedding_cache_table" {
+  #checkov:skip=CKV_AWS_119: "Ensure DynamoDB Tables are encrypted using a KMS Customer Managed CMK"
+  #checkov:skip=CKV_AWS_28: "Ensure DynamoDB point in time recovery (backup) is enabled"
+  name         = "embedding-cache-${local.standard_resource_name}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "cache_key"
+  server_side_encryption {
+    enabled = true
+  }
+
+  attribute {
+    name = "cache_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
 }
 
 resource "aws_lambda_event_source_mapping" "stream_mapping" {
   event_source_arn  = aws_dynamodb_table.cluster_table.stream_arn
   function_name     = aws_lambda_function.trigger_sfn_function.arn
   starting_position = "LATEST"
+
+  maximum_batching_window_in_seconds = min(var.summary_debounce_seconds, 300)
+
+  # Only new articles can trigger a summary, metadata and rate limiter writes are left out
+  filter_criteria {
+    filter {
+      pattern = jsonencode({
+        eventName = ["INSERT"]
+        dynamodb = {
+          NewImage = {
+            type = {
+              S = ["article"]
+            }
+          }
+        }
+      })
+    }
+  }
+}
+
+# Only metadata item records reach the change feed, its own writes are filtered out
+resource "aws_lambda_event_source_mapping" "change_feed_mapping" {
+  event_source_arn  = aws_dynamodb_table.cluster_table.stream_arn
+  function_name     = aws_lambda_function.change_feed_function.arn
+  starting_position = "LATEST"
+  batch_size        = 1000
+
+  maximum_batching_window_in_seconds = 1
+
+  filter_criteria {
+    filter {
+      pattern = jsonencode({
+        dynamodb = {
+          Keys = {
+            SK = {
+              S = [{ prefix = "#METADATA#" }]
+            }
+          }
+        }
+      })
+    }
+  }
 }
 
 # Pre-processing state machine
@@ -109,7 +208,19 @@ resource "aws_sfn_state_machine" "pre_processing_sfn" {
     "PreProcessing": {
       "Type": "Task",
       "Resource": "${aws_lambda_function.pre_processing_lambda.arn}",
-      "Next": "CallSageMaker"
+      "OutputPath": "$.s3_keys",
+      "Next": "NeedsEmbedding"
+    },
+    "NeedsEmbedding": {
+      "Type": "Choice",
+      "Choices": [
+        {
+          "Variable": "$[0]",
+          "IsPresent": true,
+          "Next": "CallSageMaker"
+        }
+      ],
+      "Default": "SuccessState"
     },
     "CallSageMaker": {
       "Type": "Task",
@@ -19,7 +19,33 @@ resource "aws_sfn_state_machine" "summary_sfn" {
           "Payload.$"  = "$"
         },
         ResultPath = "$.LambdaOutput",
-        Next       = "UpdateDynamoDB"
+        # The Lambda raises CapacityUnavailable when the model quota stays exhausted, before
+        # its timeout. A timeout nonetheless is retried too, nothing was written yet
+        Retry = [
+          {
+            ErrorEquals     = ["CapacityUnavailable", "Lambda.TooManyRequestsException", "Sandbox.Timedout", "States.Timeout"],
+            IntervalSeconds = 15,
+            MaxAttempts     = 4,
+            BackoffRate     = 2,
+            JitterStrategy  = "FULL"
+          }
+        ],
+        Next = "CheckSummarized"
+      },
+      # Without new articles that fit a prompt there is no summary, and nothing to record
+      CheckSummarized = {
+        Type = "Choice",
+        Choices = [
+          {
+            Variable      = "$.LambdaOutput.Payload.summarized",
+            BooleanEquals = false,
+            Next          = "NothingSummarized"
+          }
+        ],
+        Default = "UpdateDynamoDB"
+      },
+      NothingSummarized = {
+        Type = "Succeed"
       },
       UpdateDynamoDB = {
         Type     = "Task",
@@ -34,7 +60,7 @@ resource "aws_sfn_state_machine" "summary_sfn" {
               "S.$" : "States.Format('#METADATA#{}', $.cluster_id)"
             }
           },
-          "UpdateExpression" : "SET #description = :description_val, #generated_summary = :generated_summary_val, #summary_count = :summary_count_val, #most_common_location = :most_common_location_val, #most_common_organization = :most_common_organization_val, #earliest_date = :earliest_date_val, #latest_date = :latest_date_val",
+          "UpdateExpression" : "SET #description = :description_val, #generated_summary = :generated_summary_val, #summary_count = :summary_count_val, #most_common_location = :most_common_location_val, #most_common_organization = :most_common_organization_val, #earliest_date = :earliest_date_val, #latest_date = :latest_date_val, #summarized_through = :summarized_through_val, #summary_entities = :summary_entities_val, #summary_centroid = :summary_centroid_val, #summary_centroid_dtype = :summary_centroid_dtype_val",
           "ExpressionAttributeNames" : {
             "#description" : "description",
             "#generated_summary" : "generated_summary",
@@ -42,7 +68,11 @@ resource "aws_sfn_state_machine" "summary_sfn" {
             "#most_common_location" : "most_common_location",
             "#most_common_organization" : "most_common_organization",
             "#earliest_date" : "earliest_date",
-            "#latest_date" : "latest_date"
+            "#latest_date" : "latest_date",
+            "#summarized_through" : "summarized_through",
+            "#summary_entities" : "summary_entities",
+            "#summary_centroid" : "summary_centroid",
+            "#summary_centroid_dtype" : "summary_centroid_dtype"
           },
           "ExpressionAttributeValues" : {
             ":description_val" : { "S.$" : "$.LambdaOutput.Payload.title" },
@@ -51,7 +81,12 @@ resource "aws_sfn_state_machine" "summary_sfn" {
             ":most_common_location_val" : { "S.$" : "$.LambdaOutput.Payload.most_common_location" },
             ":most_common_organization_val" : { "S.$" : "$.LambdaOutput.Payload.most_common_organization" },
             ":earliest_date_val" : { "S.$" : "$.LambdaOutput.Payload.earliest_date" },
-            ":latest_date_val" : { "S.$" : "$.LambdaOutput.Payload.latest_date" }
+            ":latest_date_val" : { "S.$" : "$.LambdaOutput.Payload.latest_date" },
+            ":summarized_through_val" : { "S.$" : "$.LambdaOutput.Payload.summarized_through" },
+            # What the next change check compares against, recorded with the summary it describes
+            ":summary_entities_val" : { "L.$" : "$.LambdaOutput.Payload.summary_entities" },
+            ":summary_centroid_val" : { "B.$" : "$.LambdaOutput.Payload.summary_centroid" },
+            ":summary_centroid_dtype_val" : { "S.$" : "$.LambdaOutput.Payload.summary_centroid_dtype" }
           }
         },
         End = true
@@ -106,6 +106,102 @@ variable "max_articles_embedding_endpoint" {
   default     = 200
 }
 
+variable "preprocess_batch_size" {
+  description = "Number of Kinesis records sent to one pre-processing execution"
+  type        = number
+  default     = 10
+}
+
+variable "embedding_encoding" {
+  description = "Wire format of embeddings sent to the clustering queue: 'json', 'float32' or 'float16'"
+  type        = string
+  default     = "float16"
+}
+
+variable "message_mode" {
+  description = "'full' sends whole articles to the clustering queue, 'slim' sends only the id, embedding and a pointer to the embedding bucket object"
+  type        = string
+  default     = "full"
+}
+
+variable "article_storage_mode" {
+  description = "How article bodies are stored in DynamoDB: 'inline', 'compressed' or 's3'"
+  type        = string
+  default     = "inline"
+}
+
+variable "handoff_format" {
+  description = "'batch' passes documents between pipeline stages as one compressed NDJSON object per invocation, 'object' as one JSON object per document"
+  type        = string
+  default     = "batch"
+}
+
+variable "fused_ingest" {
+  description = "Embed small batches from the pre-processing function directly, skipping the S3 handoff and the embedding state. Requires the batch handoff format"
+  type        = bool
+  default     = false
+}
+
+variable "fused_max_documents" {
+  description = "Largest batch, in documents, embedded inline when fused_ingest is enabled"
+  type        = number
+  default     = 25
+}
+
+variable "embedding_cache_ttl_days" {
+  description = "Days an entry stays in the shared embedding cache"
+  type        = number
+  default     = 7
+}
+
+variable "near_duplicate_threshold" {
+  description = "Estimated Jaccard similarity above which pre-processing treats an article as a copy of an earlier one and skips embedding it, 0 disables the check. Best effort, each pre-processing container only remembers the articles it handled itself"
+  type        = number
+  default     = 0.8
+}
+
+variable "summary_debounce_seconds" {
+  description = "Stream batching window of the trigger function, new articles of a cluster within it start at most one summarization (at most 300)"
+  type        = number
+  default     = 30
+}
+
+variable "summary_min_drift" {
+  description = "Cosine distance the cluster centroid must move since the last summary, unless enough new entities appeared, before the cluster is summarized again. 0 always summarizes"
+  type        = number
+  default     = 0.02
+}
+
+variable "summary_min_entity_novelty" {
+  description = "Share of the cluster's locations and organizations that must be new since the last summary, unless the centroid drifted enough, before the cluster is summarized again. 0 always summarizes"
+  type        = number
+  default     = 0.25
+}
+
+variable "bedrock_requests_per_minute" {
+  description = "Bedrock requests per minute all summarizations share, set to the account quota of the summarization model. 0 turns the limiter off"
+  type        = number
+  default     = 1000
+}
+
+variable "bedrock_tokens_per_minute" {
+  description = "Bedrock input and output tokens per minute all summarizations share, set to the account quota of the summarization model"
+  type        = number
+  default     = 2000000
+}
+
+variable "change_feed_max_versions" {
+  description = "Entries the cluster change feed keeps, dashboards further behind reload the cluster list"
+  type        = number
+  default     = 1000
+}
+
+variable "related_stories_port" {
+  description = "Port of the related stories queries on the clustering instance, reachable from within the VPC. 0 turns them off"
+  type        = number
+  default     = 8080
+}
+
 variable "instance_type" {
   type        = string
   default     = "c7g.4xlarge"
@@ -1,6 +1,6 @@
 # Checks if build folder has changed
 data "external" "this_external" {
-  program = ["bash", "${var.build_script_path}/dir_md5.sh", "${var.business_logic_path}"]
+  program = concat(["bash", "${var.build_script_path}/dir_md5.sh", "${var.business_logic_path}"], var.shared_files)
 }
 
 resource "aws_ecr_repository" "this_aws_ecr_repository" {
@@ -46,7 +46,7 @@ resource "terraform_data" "this_terraform_data_build_ecr_image" {
     aws_ecr_repository.this_aws_ecr_repository.id
   ]
   provisioner "local-exec" {
-    command = "bash ${var.build_script_path}/build.sh ${var.ecr_base_arn} ${var.business_logic_path} ${aws_ecr_repository.this_aws_ecr_repository.name} ${aws_ecr_repository.this_aws_ecr_repository.repository_url} ${var.region}"
+    command = "bash ${var.build_script_path}/build.sh ${var.ecr_base_arn} ${var.business_logic_path} ${aws_ecr_repository.this_aws_ecr_repository.name} ${aws_ecr_repository.this_aws_ecr_repository.repository_url} ${var.region} ${join(" ", var.shared_files)}"
   }
 }
 
@@ -8,6 +8,12 @@ variable "business_logic_path" {
   description = "Path to the Business Logic"
 }
 
+variable "shared_files" {
+  type        = list(string)
+  description = "Files from other business logic folders copied into the build context, kept in one place only"
+  default     = []
+}
+
 variable "ecr_name" {
   type        = string
   description = "Name of the ECR Repository"
@@ -0,0 +1,181 @@
+import json
+import os
+import sys
+
+import boto3
+import pytest
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "business_logic", "lambdas", "change_feed"
+    )
+)
+from change_feed import (  # noqa: E402
+    FEED_FIELDS,
+    ChangeFeed,
+    DynamoDBChangeStore,
+    InMemoryChangeStore,
+    InMemoryStream,
+    cluster_changes,
+    split_entries,
+)
+
+
+def metadata_item(cluster_id, number_of_articles=2, **values):
+    return {
+        "PK": cluster_id,
+        "SK": f"#METADATA#{cluster_id}",
+        "type": "metadata",
+        "number_of_articles": number_of_articles,
+        "generated_summary": "",
+        "summary_count": 0,
+        "description": "",
+        "is_cluster": True,
+        "updated_at": "2024-05-01T00:00:00",
+        **values,
+    }
+
+
+def feed_changes(stream, feed):
+    for event in stream.events():
+        changes = cluster_changes(event["Records"])
+        if changes:
+            feed.append(changes)
+
+
+def test_cluster_changes_kinds():
+    stream = InMemoryStream()
+    stream.put_item(metadata_item("a"))
+    stream.put_item({"PK": "a", "SK": "ARTICLE#1", "type": "article"})
+    stream.update_item("a", "#METADATA#a", {"number_of_articles": 3})
+    stream.update_item("a", "#METADATA#a", {"generated_summary": "Summary"})
+    stream.put_item(metadata_item("b"))
+    stream.update_item("b", "#METADATA#b", {"centroid": b"\x00\x01"})
+    stream.delete_item("b", "#METADATA#b")
+
+    changes = {
+        change["cluster_id"]: change for change in cluster_changes(stream.records)
+    }
+
+    assert changes["a"]["kinds"] == ["new_cluster", "count", "summary"]
+    assert changes["a"]["number_of_articles"] == 3
+    assert changes["a"]["generated_summary"] == "Summary"
+    # The centroid update moved nothing the cluster list shows
+    assert changes["b"]["kinds"] == ["new_cluster", "removed"]
+
+
+def test_untouched_fields_make_no_change():
+    stream = InMemoryStream()
+    stream.put_item(metadata_item("a"))
+    stream.records = []
+    stream.update_item("a", "#METADATA#a", {"centroid": b"\x00", "location_counts": {}})
+
+    assert cluster_changes(stream.records) == []
+
+
+def test_reader_catches_up_with_merged_changes():
+    stream = InMemoryStream()
+    feed = ChangeFeed(InMemoryChangeStore(), max_versions=10)
+    start = feed.changes_since(None)
+    assert start == {"version": 0, "changes": [], "reset": True}
+
+    stream.put_item(metadata_item("a"))
+    feed_changes(stream, feed)
+    stream.update_item("a", "#METADATA#a", {"number_of_articles": 5})
+    feed_changes(stream, feed)
+
+    response = feed.changes_since(start["version"])
+    assert response["version"] == 2
+    assert not response["reset"]
+    (change,) = response["changes"]
+    assert change["kinds"] == ["new_cluster", "count"]
+    assert change["number_of_articles"] == 5
+    assert set(FEED_FIELDS) <= set(change)
+
+    assert feed.changes_since(response["version"]) == {
+        "version": 2,
+        "changes": [],
+        "reset": False,
+    }
+
+
+def test_reader_behind_the_kept_entries_is_reset():
+    stream = InMemoryStream()
+    feed = ChangeFeed(InMemoryChangeStore(), max_versions=3)
+    for i in range(5):
+        stream.put_item(metadata_item(f"cluster-{i}"))
+        feed_changes(stream, feed)
+
+    assert feed.changes_since(0) == {"version": 5, "changes": [], "reset": True}
+    response = feed.changes_since(2)
+    assert not response["reset"]
+    assert [change["cluster_id"] for change in response["changes"]] == [
+        "cluster-2",
+        "cluster-3",
+        "cluster-4",
+    ]
+
+
+def test_stale_commit_is_refused():
+    store = InMemoryChangeStore()
+    assert store.commit(1, [])
+    assert not store.commit(1, [])
+    assert not store.commit(3, [])
+    assert store.head() == 1
+
+
+def test_large_batches_are_split_into_entries():
+    changes = [
+        {
+            "cluster_id": f"cluster-{i}",
+            "kinds": ["summary"],
+            "generated_summary": "x" * 100,
+        }
+        for i in range(10)
+    ]
+    entries = split_entries(changes, max_bytes=500)
+
+    assert len(entries) > 1
+    assert all(len(json.dumps(entry)) <= 500 for entry in entries)
+    assert [change for entry in entries for change in entry] == changes
+
+    feed = ChangeFeed(InMemoryChangeStore())
+    assert feed.append(changes) == [1]
+
+
+@pytest.fixture
+def dynamodb_client():
+    moto = pytest.importorskip("moto")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = boto3.client("dynamodb", region_name="us-east-1")
+        client.create_table(
+            TableName="cluster-table-test",
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield client
+
+
+def test_dynamodb_store_keeps_the_latest_entries(dynamodb_client):
+    store = DynamoDBChangeStore(dynamodb_client, "cluster-table-test")
+    feed = ChangeFeed(store, max_versions=2)
+    for i in range(3):
+        feed.append([{"cluster_id": f"cluster-{i}", "kinds": ["count"]}])
+
+    assert store.head() == 3
+    assert not store.commit(3, [])
+    assert [version for version, _ in store.entries_after(0)] == [2, 3]
+    assert feed.changes_since(1)["changes"] == [
+        {"cluster_id": "cluster-1", "kinds": ["count"]},
+        {"cluster_id": "cluster-2", "kinds": ["count"]},
+    ]
@@ -0,0 +1,62 @@
+import os
+import sys
+from collections import Counter
+from decimal import Decimal
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), "..", "business_logic", "stream_consumer")
+)
+from cluster_aggregates import (  # noqa: E402
+    most_common,
+    update_cluster_aggregates,
+    update_counter,
+)
+
+
+def test_late_majority_becomes_most_common():
+    counts = {}
+    # The counter fills up with early values first
+    for i in range(40):
+        counts = update_counter(counts, [f"early-{i % 25}"], top_k=20)
+    for _ in range(30):
+        counts = update_counter(counts, ["late"], top_k=20)
+
+    assert len(counts) <= 20
+    assert most_common(counts) == "late"
+
+
+def test_counts_are_exact_until_the_counter_is_full():
+    values = ["a", "b", "a", "c", "a", "b"]
+    assert update_counter({"a": Decimal(1)}, values, top_k=5) == {
+        "a": 4,
+        "b": 2,
+        "c": 1,
+    }
+
+
+def test_heavy_hitters_match_a_recount():
+    values = [f"rare-{i}" for i in range(300)]
+    values[::3] = ["heavy"] * 100
+    values[1::6] = ["second"] * 50
+    counts = {}
+    for value in values:
+        counts = update_counter(counts, [value], top_k=10)
+
+    recount = Counter(values)
+    assert most_common(counts) == recount.most_common(1)[0][0]
+    # Space-Saving counts overestimate by at most the number of values / top_k
+    for value in ["heavy", "second"]:
+        assert recount[value] <= counts[value] <= recount[value] + len(values) // 10
+
+
+def test_aggregates_track_dates_and_entities():
+    metadata = update_cluster_aggregates(
+        {},
+        [
+            {"locations": ["Paris"], "publication_date": "2024-05-02T10:00:00Z"},
+            {"locations": ["Paris", "Lyon"], "publication_date": "2024-05-01T09:00:00"},
+        ],
+    )
+    assert metadata["most_common_location"] == "Paris"
+    assert metadata["earliest_date"] == "2024-05-01 09:00:00"
+    assert metadata["latest_date"] == "2024-05-02 10:00:00"
@@ -0,0 +1,173 @@
+import os
+import sys
+
+import boto3
+import pytest
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), "..", "business_logic", "stream_consumer")
+)
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "data"))
+from backfill_cluster_shards import backfill_cluster_shards  # noqa: E402
+from cluster_read_model import (  # noqa: E402
+    INDEXES,
+    SHARD_ATTRIBUTE,
+    get_cluster_articles,
+    get_top_clusters,
+    shard_for_cluster,
+)
+
+# Point at DynamoDB Local (e.g. http://localhost:8000) to run against it
+DYNAMODB_ENDPOINT_URL = os.environ.get("DYNAMODB_ENDPOINT_URL")
+
+
+def create_table(dynamodb):
+    # Same keys and read model indexes as the cluster table in main.tf
+    return dynamodb.create_table(
+        TableName="cluster-table-test",
+        KeySchema=[
+            {"AttributeName": "PK", "KeyType": "HASH"},
+            {"AttributeName": "SK", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "PK", "AttributeType": "S"},
+            {"AttributeName": "SK", "AttributeType": "S"},
+            {"AttributeName": SHARD_ATTRIBUTE, "AttributeType": "S"},
+            {"AttributeName": "number_of_articles", "AttributeType": "N"},
+            {"AttributeName": "updated_at", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": index_name,
+                "KeySchema": [
+                    {"AttributeName": SHARD_ATTRIBUTE, "KeyType": "HASH"},
+                    {"AttributeName": sort_attribute, "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+            for index_name, sort_attribute in INDEXES.values()
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+@pytest.fixture
+def table():
+    if DYNAMODB_ENDPOINT_URL:
+        dynamodb = boto3.resource(
+            "dynamodb",
+            endpoint_url=DYNAMODB_ENDPOINT_URL,
+            region_name="us-east-1",
+            aws_access_key_id="local",
+            aws_secret_access_key="local",
+        )
+        table = create_table(dynamodb)
+        table.wait_until_exists()
+        yield table
+        table.delete()
+        return
+
+    moto = pytest.importorskip("moto")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        yield create_table(boto3.resource("dynamodb", region_name="us-east-1"))
+
+
+def put_cluster(table, index, number_of_articles, shard=True):
+    cluster_id = f"cluster-{index:03d}"
+    item = {
+        "PK": cluster_id,
+        "SK": f"#METADATA#{cluster_id}",
+        "type": "metadata",
+        "number_of_articles": number_of_articles,
+        "created_at": f"2024-05-01T00:{index // 60:02d}:{index % 60:02d}",
+        "description": f"Cluster {index}",
+    }
+    if shard:
+        item[SHARD_ATTRIBUTE] = shard_for_cluster(cluster_id)
+        item["updated_at"] = item["created_at"]
+    table.put_item(Item=item)
+    return cluster_id
+
+
+def read_all(table, limit, order):
+    pages = []
+    clusters, token = get_top_clusters(table, limit=limit, order=order)
+    pages.append(clusters)
+    while token is not None:
+        clusters, token = get_top_clusters(
+            table, limit=limit, order=order, page_token=token
+        )
+        pages.append(clusters)
+    return pages
+
+
+def test_top_clusters_by_size_pages_across_shards(table):
+    sizes = {
+        put_cluster(table, i, (i * 7) % 23 + 2): (i * 7) % 23 + 2 for i in range(30)
+    }
+    pages = read_all(table, limit=7, order="size")
+
+    assert all(len(page) <= 7 for page in pages)
+    assert all(len(page) == 7 for page in pages[:-1])
+    ids = [item["PK"] for page in pages for item in page]
+    assert sorted(ids) == sorted(sizes)
+    returned_sizes = [
+        int(item["number_of_articles"]) for page in pages for item in page
+    ]
+    assert returned_sizes == sorted(sizes.values(), reverse=True)
+
+
+def test_top_clusters_by_recency(table):
+    for i in range(12):
+        put_cluster(table, i, 3)
+    clusters, _ = get_top_clusters(table, limit=5, order="recency")
+
+    assert [item["PK"] for item in clusters] == [
+        f"cluster-{i:03d}" for i in range(11, 6, -1)
+    ]
+
+
+def test_unsharded_clusters_listed_after_backfill(table):
+    for i in range(5):
+        put_cluster(table, i, 4)
+    old = [put_cluster(table, i, 10, shard=False) for i in range(5, 8)]
+    clusters, _ = get_top_clusters(table, limit=50)
+    assert not set(old) & {item["PK"] for item in clusters}
+
+    assert backfill_cluster_shards(table, dry_run=True) == 3
+    assert backfill_cluster_shards(table) == 3
+    assert backfill_cluster_shards(table) == 0
+
+    clusters, _ = get_top_clusters(table, limit=50)
+    assert {item["PK"] for item in clusters[:3]} == set(old)
+    assert len(clusters) == 8
+
+
+def test_cluster_articles_paged(table):
+    cluster_id = put_cluster(table, 0, 25)
+    for i in range(25):
+        table.put_item(
+            Item={
+                "PK": cluster_id,
+                "SK": f"ARTICLE#article-{i:02d}",
+                "type": "article",
+                "article_id": f"article-{i:02d}",
+                "title": f"Title {i}",
+                "embedding": b"\x00" * 32,
+            }
+        )
+
+    articles, token = get_cluster_articles(table, cluster_id, limit=10)
+    while token is not None:
+        page, token = get_cluster_articles(
+            table, cluster_id, limit=10, page_token=token
+        )
+        articles.extend(page)
+
+    assert [item["article_id"] for item in articles] == [
+        f"article-{i:02d}" for i in range(25)
+    ]
+    assert all("embedding" not in item for item in articles)
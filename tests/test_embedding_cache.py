@@ -0,0 +1,123 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "business_logic", "lambdas", "embed_docs"
+    )
+)
+from embedding_cache import (  # noqa: E402
+    DynamoDBStore,
+    EmbeddingCache,
+    InMemoryStore,
+    cache_key,
+    pack_embedding,
+    unpack_embedding,
+)
+
+MODEL_ID = "titan:1024"
+
+
+class FailingStore:
+    def get_many(self, keys):
+        raise RuntimeError("store unavailable")
+
+    def put_many(self, entries):
+        raise RuntimeError("store unavailable")
+
+
+class FakeDynamoDBClient:
+    """
+    batch_get_item and batch_write_item over a dict, leaving the first key of a request unprocessed once.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.get_calls = []
+        self.write_calls = []
+        self.deferred = set()
+
+    def batch_get_item(self, RequestItems):
+        ((table_name, request),) = RequestItems.items()
+        self.get_calls.append(len(request["Keys"]))
+        first = request["Keys"][0]["cache_key"]["S"]
+        unprocessed = []
+        responses = []
+        for key in request["Keys"]:
+            name = key["cache_key"]["S"]
+            if name == first and name not in self.deferred:
+                self.deferred.add(name)
+                unprocessed.append(key)
+            elif name in self.items:
+                responses.append(self.items[name])
+        response = {"Responses": {table_name: responses}}
+        if unprocessed:
+            response["UnprocessedKeys"] = {table_name: dict(request, Keys=unprocessed)}
+        return response
+
+    def batch_write_item(self, RequestItems):
+        ((_, requests),) = RequestItems.items()
+        self.write_calls.append(len(requests))
+        for request in requests:
+            item = request["PutRequest"]["Item"]
+            self.items[item["cache_key"]["S"]] = item
+        return {}
+
+
+def test_cache_key_ignores_whitespace_and_unicode_composition():
+    assert cache_key("Café  opens\n", MODEL_ID) == cache_key(" Café opens", MODEL_ID)
+    assert cache_key("Cafe opens", MODEL_ID) != cache_key("Café opens", MODEL_ID)
+
+
+def test_cache_key_depends_on_model():
+    assert cache_key("text", "titan:1024") != cache_key("text", "titan:512")
+
+
+def test_pack_embedding_round_trip():
+    embedding = [0.5, -1.25, 3.0]
+    assert unpack_embedding(pack_embedding(embedding)) == embedding
+
+
+def test_local_tier_evicts_least_recently_used():
+    cache = EmbeddingCache(local_size=2)
+    cache.put_many({"a": [1.0], "b": [2.0]})
+    cache.get_many(["a"])
+    cache.put_many({"c": [3.0]})
+
+    assert cache.get_many(["a", "b", "c"]) == {"a": [1.0], "c": [3.0]}
+
+
+def test_shared_tier_hits_fill_local_tier():
+    shared = InMemoryStore()
+    EmbeddingCache(local_size=10, shared=shared).put_many({"a": [1.0], "b": [2.0]})
+
+    cache = EmbeddingCache(local_size=10, shared=shared)
+    assert cache.get_many(["a", "b", "c"]) == {"a": [1.0], "b": [2.0]}
+    assert cache.get_many(["a"]) == {"a": [1.0]}
+    assert cache.stats == {"local_hits": 1, "shared_hits": 2, "misses": 1}
+    assert cache.hit_rate() == pytest.approx(0.75)
+
+
+def test_shared_tier_failures_do_not_fail_the_batch():
+    cache = EmbeddingCache(local_size=10, shared=FailingStore())
+    cache.put_many({"a": [1.0]})
+
+    assert cache.get_many(["a", "b"]) == {"a": [1.0]}
+    assert cache.stats["misses"] == 1
+
+
+def test_dynamodb_store_batches_and_retries_unprocessed(monkeypatch):
+    monkeypatch.setattr("embedding_cache.time.sleep", lambda seconds: None)
+    client = FakeDynamoDBClient()
+    store = DynamoDBStore(client, "embedding-cache", ttl_seconds=3600)
+    entries = {f"key-{i}": [float(i), 0.5] for i in range(130)}
+
+    store.put_many(entries)
+    assert client.write_calls == [25, 25, 25, 25, 25, 5]
+
+    found = store.get_many(list(entries) + ["missing"])
+    assert found == entries
+    # Each 100 key request is sent again for the key left unprocessed
+    assert client.get_calls == [100, 1, 31, 1]
@@ -0,0 +1,118 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "business_logic", "lambdas", "pre_process_docs"
+    )
+)
+# batch_handoff.py is copied in from embed_docs when the image is built
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "business_logic", "lambdas", "embed_docs"
+    )
+)
+from near_duplicates import (  # noqa: E402
+    NearDuplicateIndex,
+    estimated_similarity,
+    minhash_signature,
+)
+
+ARTICLE = " ".join(f"word{i % 97} token{i % 89}" for i in range(400))
+
+
+def test_signature_is_deterministic():
+    assert (minhash_signature(ARTICLE) == minhash_signature(ARTICLE)).all()
+    assert (
+        estimated_similarity(
+            minhash_signature(ARTICLE), minhash_signature(ARTICLE.upper())
+        )
+        == 1.0
+    )
+
+
+def test_copy_is_matched_to_original():
+    index = NearDuplicateIndex(threshold=0.8)
+    copy = ARTICLE + " Copyright 2024 Reuters"
+    other = " ".join(f"other{i % 83} text{i % 79}" for i in range(400))
+
+    assert index.find_or_add("original", index.signature(ARTICLE), now=0) is None
+    assert index.find_or_add("copy", index.signature(copy), now=1) == "original"
+    assert index.find_or_add("other", index.signature(other), now=2) is None
+    assert index.stats == {"documents": 3, "duplicates": 1}
+
+
+def test_signature_size_follows_bands_and_rows():
+    index = NearDuplicateIndex(bands=8, rows_per_band=2)
+    assert len(index.signature(ARTICLE)) == 16
+
+
+def test_expired_documents_are_forgotten():
+    index = NearDuplicateIndex(threshold=0.8, max_documents=10, ttl_seconds=60)
+    signature = index.signature(ARTICLE)
+
+    assert index.find_or_add("original", signature, now=0) is None
+    assert index.find_or_add("late copy", signature, now=120) is None
+
+
+def test_removed_original_is_not_matched():
+    index = NearDuplicateIndex(threshold=0.8)
+    signature = index.signature(ARTICLE)
+
+    assert index.find_or_add("original", signature, now=0) is None
+    index.remove(["original"])
+    assert index.find("copy", signature, now=1) is None
+    assert index.bands == {}
+
+
+def load_pre_process_docs(monkeypatch):
+    monkeypatch.setenv("PREPROCESS_BUCKET", "bucket1")
+    import pre_process_docs
+
+    index = NearDuplicateIndex(threshold=0.8)
+    monkeypatch.setattr(pre_process_docs, "near_duplicate_index", index)
+    monkeypatch.setattr(pre_process_docs, "NEAR_DUPLICATE_THRESHOLD", 0.8)
+    monkeypatch.setattr(pre_process_docs, "decode_record", lambda event: event["docs"])
+    monkeypatch.setattr(pre_process_docs, "embed_inline", lambda documents: False)
+
+    def process_data(doc):
+        if doc.get("fail"):
+            raise ValueError("bad document")
+        return {"id": doc["id"], "title": "", "text": doc["text"]}
+
+    monkeypatch.setattr(pre_process_docs, "process_data", process_data)
+    return pre_process_docs, index
+
+
+def test_copy_of_an_original_in_a_failed_record_is_embedded(monkeypatch):
+    pre_process_docs, index = load_pre_process_docs(monkeypatch)
+    staged, parked = [], []
+    monkeypatch.setattr(pre_process_docs, "upload_batch", staged.extend)
+    monkeypatch.setattr(pre_process_docs, "park_failed_records", parked.extend)
+
+    pre_process_docs.handler(
+        [
+            {"docs": [{"id": "original", "text": ARTICLE}, {"id": "x", "fail": True}]},
+            {"docs": [{"id": "copy", "text": ARTICLE + " Reuters"}]},
+        ],
+        None,
+    )
+    assert len(parked) == 1
+    assert [doc["id"] for doc in staged] == ["copy"]
+    assert "duplicate_of" not in staged[0]
+
+
+def test_originals_of_a_parked_batch_leave_the_index(monkeypatch):
+    pre_process_docs, index = load_pre_process_docs(monkeypatch)
+    parked = []
+    monkeypatch.setattr(pre_process_docs, "park_failed_records", parked.extend)
+
+    def fail_upload(documents):
+        raise OSError("S3 unavailable")
+
+    monkeypatch.setattr(pre_process_docs, "upload_batch", fail_upload)
+    pre_process_docs.handler([{"docs": [{"id": "original", "text": ARTICLE}]}], None)
+    assert len(parked) == 1
+    assert index.find("copy", index.signature(ARTICLE)) is None
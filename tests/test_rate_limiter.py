@@ -0,0 +1,68 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "business_logic", "lambdas", "summarization"
+    )
+)
+os.environ.setdefault("MODEL_ID", "test-model")
+os.environ.setdefault("DYNAMODB_TABLE_NAME", "test-table")
+from botocore.exceptions import ClientError  # noqa: E402
+
+import summarization  # noqa: E402
+from rate_limiter import InMemoryBucketStore, TokenBuckets  # noqa: E402
+
+TOKENS_PER_MINUTE = 60000
+
+
+class FakeBedrock:
+    def __init__(self, errors):
+        self.errors = list(errors)
+
+    def invoke_model(self, **kwargs):
+        if self.errors:
+            code = self.errors.pop(0)
+            raise ClientError({"Error": {"Code": code}}, "InvokeModel")
+        body = {
+            "content": [{"text": "<title>T</title><summary>S</summary>"}],
+            "usage": {"input_tokens": 60, "output_tokens": 40},
+        }
+        return {"body": io.BytesIO(json.dumps(body).encode("utf-8"))}
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = TokenBuckets(600, TOKENS_PER_MINUTE, InMemoryBucketStore())
+    monkeypatch.setattr(summarization, "get_rate_limiter", lambda: limiter)
+    monkeypatch.setattr(summarization.time, "sleep", lambda seconds: None)
+    return limiter
+
+
+def tokens_left(limiter):
+    levels, _ = limiter.current(limiter.store.load()[0]["updated_at"])
+    return levels["tokens"]
+
+
+def test_failed_attempts_are_refunded(limiter, monkeypatch):
+    bedrock = FakeBedrock(["ServiceUnavailableException", "ModelTimeoutException"])
+    monkeypatch.setattr(summarization, "get_bedrock_client", lambda: bedrock)
+
+    assert summarization.generate_bedrock_claude("prompt", 1000)[:2] == (60, 40)
+    # Only the successful attempt's actual usage is spent, up to the refill meanwhile
+    assert tokens_left(limiter) == pytest.approx(
+        limiter.capacity["tokens"] - 100, abs=5
+    )
+
+
+def test_non_retryable_error_is_refunded(limiter, monkeypatch):
+    bedrock = FakeBedrock(["ValidationException"])
+    monkeypatch.setattr(summarization, "get_bedrock_client", lambda: bedrock)
+
+    with pytest.raises(ClientError):
+        summarization.generate_bedrock_claude("prompt", 1000)
+    assert tokens_left(limiter) == pytest.approx(limiter.capacity["tokens"], abs=5)
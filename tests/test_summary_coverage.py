@@ -0,0 +1,88 @@
+import os
+import sys
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "business_logic", "lambdas", "summarization"
+    )
+)
+os.environ.setdefault("MODEL_ID", "test-model")
+os.environ.setdefault("DYNAMODB_TABLE_NAME", "test-table")
+import summarization  # noqa: E402
+from prompt_builder import build_prompt, chunk_articles  # noqa: E402
+
+
+def article(day, words=10):
+    return {
+        "title": f"Article {day}",
+        "summary": " ".join(f"word{i}" for i in range(words)),
+        "entry_creation_date": f"2024-05-{day:02d}T00:00:00",
+    }
+
+
+def test_build_prompt_returns_included_articles():
+    small, large = article(1), article(2, words=5000)
+    _, _, included = build_prompt("", "", [large, small], 500)
+    assert included == [small]
+    # Only the first is cut to fit when none fits
+    _, _, included = build_prompt("", "", [large, article(3, words=5000)], 500)
+    assert included == [large]
+
+
+def test_oversized_article_is_chunked_as_given():
+    large = article(1, words=5000)
+    chunks = chunk_articles("", [article(2), large, article(3)], 500, 8)
+    assert [large] in chunks
+    assert sum(len(chunk) for chunk in chunks) == 3
+
+
+def test_mark_stays_below_articles_left_out():
+    articles = [article(day) for day in range(1, 6)]
+    included = [articles[0], articles[1], articles[3]]
+    mark = summarization.high_water_mark(articles, included, "2024-04-30T00:00:00")
+    assert mark == articles[1]["entry_creation_date"]
+
+
+def test_mark_unchanged_when_nothing_included():
+    articles = [article(day) for day in range(1, 6)]
+    mark = summarization.high_water_mark(articles, [], "2024-04-30T00:00:00")
+    assert mark == "2024-04-30T00:00:00"
+
+
+def test_map_reduce_covers_only_chunks_in_the_merge(monkeypatch):
+    def summarize(previous_summary, articles, priority=1.0):
+        usage = {
+            "calls": 1,
+            "articles": len(articles),
+            "estimated_input_tokens": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+        }
+        # Each chunk summarizes its first article only, the merge its first partial
+        return {"title": "", "summary": ""}, usage, articles[:1]
+
+    monkeypatch.setattr(summarization, "summarize_articles", summarize)
+    monkeypatch.setattr(summarization, "get_rate_limiter", lambda: None)
+    monkeypatch.setattr(summarization, "get_bedrock_client", lambda: None)
+    monkeypatch.setattr(summarization, "MAP_REDUCE_MAX_CHUNKS", 2)
+    monkeypatch.setattr(summarization, "PROMPT_TOKEN_BUDGET", 250)
+    articles = [article(day, words=60) for day in range(1, 20)]
+
+    summary, read, covered = summarization.generate_cluster_summary_map_reduce(
+        "", articles[:10], more_pages=[articles[10:]]
+    )
+    assert summary is not None
+    assert len(read) == len(articles)
+    assert covered == [articles[0]]
+    mark = summarization.high_water_mark(read, covered)
+    assert mark == articles[0]["entry_creation_date"]
+
+
+def test_nothing_summarized_leaves_the_cluster_alone(monkeypatch):
+    metadata = {"generated_summary": "Earlier", "summary_count": 2}
+    monkeypatch.setattr(
+        summarization,
+        "get_cluster_data",
+        lambda cluster_id: ("Earlier", 2, iter([[]]), metadata),
+    )
+    assert summarization.handler({"cluster_id": "c1"}, None) == {"summarized": False}
@@ -0,0 +1,92 @@
+import os
+import random
+import re
+import sys
+
+import pytest
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "business_logic", "lambdas", "pre_process_docs"
+    )
+)
+from text_normalization import clean_text, remove_tags  # noqa: E402
+
+bs4 = pytest.importorskip("bs4")
+
+SAMPLES = [
+    "",
+    "   ",
+    "\n\n",
+    "2024-05-01T12:00:00Z",
+    "Plain text with no markup",
+    "<p>Paragraph</p>\n<p>Another</p>",
+    "<p>  </p><p>\n  \n</p>",
+    "<b>Bold</b> and <i>italic</i> &amp; more",
+    '<a href="https://example.com?a=1&amp;b=2">link</a>',
+    "<a href=unquoted title='single'>x</a>",
+    "<br>line<br/>break<br />end</br>",
+    "<img src=x.png>caption</img>",
+    "Caf&eacute; &copy; 2024 &nbsp;&mdash; &hellip;",
+    "&quot;Quoted&quot; &#39;single&#39; &#x27;hex&#x27;",
+    "&#150; &#153; &#128; &#0; &#xD800; &#x110000;",
+    "&amp &lt;tag&gt; &unknown; &notanentity &notin;",
+    "AT&T and R&D & friends",
+    "&#65abc &#x41zz &#",
+    "<script>var a = '<b>';</script>visible",
+    "<style>p { color: red; }</style>text",
+    "<pre>  keep\n   spaces  </pre> <textarea> too\n</textarea>",
+    "<ruby>kanji<rt>reading</rt><rp>(</rp></ruby>",
+    "<template><p>hidden</p></template>shown",
+    "<!-- a comment -->after",
+    "<!DOCTYPE html><html><body>doc</body></html>",
+    "<?xml version='1.0'?>instruction",
+    "<![CDATA[raw <text>]]>after",
+    "<div><span>unclosed <b>tags",
+    "</p>stray end tag",
+    "<p>mismatched</div></p>",
+    "1 < 2 and 3 > 2",
+    "<<double>> <",
+    "<title>Title</title><noscript>no</noscript><iframe>frame</iframe>",
+    "<xmp><b>literal</b></xmp>",
+    "<P CLASS='Upper'>CASE</P>",
+    "tab\tseparated\r\nwindows",
+    "emoji \U0001f600 and accents éè",
+]
+
+
+def reference_remove_tags(text):
+    # What pre_process_docs did before text_normalization
+    return bs4.BeautifulSoup(text, "html.parser").get_text()
+
+
+def reference_clean_text(text):
+    text = text.replace("&quot;", '"')
+    return re.sub(r'[^:a-zA-Z0-9\s"\'-]', "", text)
+
+
+def random_markup(rng, length=40):
+    pieces = [
+        "<p>", "</p>", "<b>", "</b>", "<br>", "<br/>", "<pre>", "</pre>",
+        "<script>", "</script>", "<!-- c -->", "&amp;", "&nbsp;", "&#150;",
+        "&#x41;", "&bogus;", "&", "<", ">", " ", "\n", "\t", "word", "Wörd",
+        "'", '"', "<a href='x'>", "</a>", "<![CDATA[x]]>", "&lt;",
+    ]  # fmt: skip
+    return "".join(rng.choice(pieces) for _ in range(length))
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_remove_tags_matches_beautifulsoup(text):
+    assert remove_tags(text) == reference_remove_tags(text)
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_clean_text_matches_reference(text):
+    assert clean_text(text) == reference_clean_text(text)
+
+
+def test_remove_tags_matches_beautifulsoup_on_random_markup():
+    rng = random.Random(32)
+    for _ in range(2000):
+        text = random_markup(rng, rng.randint(1, 60))
+        assert remove_tags(text) == reference_remove_tags(text), repr(text)
@@ -0,0 +1,117 @@
+import os
+import sys
+
+import boto3
+import pytest
+
+sys.path.append(
+    os.path.join(
+        os.path.dirname(__file__), "..", "business_logic", "lambdas", "trigger_sfn"
+    )
+)
+import trigger_sfn  # noqa: E402
+
+TABLE_NAME = "cluster-table-test"
+
+
+@pytest.fixture
+def dynamodb_client():
+    moto = pytest.importorskip("moto")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = boto3.client("dynamodb", region_name="us-east-1")
+        client.create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        client.put_item(
+            TableName=TABLE_NAME,
+            Item={
+                **trigger_sfn.metadata_key("cluster-1"),
+                "number_of_articles": {"N": "8"},
+                "summary_count": {"N": "0"},
+            },
+        )
+        yield client
+
+
+class FakeStepFunctions:
+    class exceptions:
+        class ExecutionAlreadyExists(Exception):
+            pass
+
+    def __init__(self):
+        self.names = []
+
+    def start_execution(self, stateMachineArn, name, input):
+        if name in self.names:
+            raise self.exceptions.ExecutionAlreadyExists(name)
+        self.names.append(name)
+        return {"executionArn": f"arn:execution:{name}"}
+
+
+def claim(client, generation, now):
+    return trigger_sfn.claim_summary(
+        client, TABLE_NAME, "cluster-1", generation, 900, now
+    )
+
+
+def test_triggers_across_a_window_edge_claim_once(dynamodb_client):
+    # Either side of what used to be a 30 second debounce bucket edge
+    assert claim(dynamodb_client, 1, 29) == 29
+    assert claim(dynamodb_client, 1, 31) is None
+
+
+def test_slow_execution_keeps_its_claim(dynamodb_client):
+    assert claim(dynamodb_client, 1, 1000) == 1000
+    # Still retrying after CapacityUnavailable
+    assert claim(dynamodb_client, 1, 1600) is None
+    # Given up on once longer than an execution can take
+    assert claim(dynamodb_client, 1, 1901) == 1901
+
+
+def test_next_generation_claims_straight_away(dynamodb_client):
+    assert claim(dynamodb_client, 1, 1000) == 1000
+    assert claim(dynamodb_client, 2, 1010) == 1010
+
+
+def test_release_lets_the_summary_be_claimed_again(dynamodb_client):
+    assert claim(dynamodb_client, 1, 1000) == 1000
+    trigger_sfn.release_summary(dynamodb_client, TABLE_NAME, "cluster-1", 999)
+    assert claim(dynamodb_client, 1, 1001) is None
+    trigger_sfn.release_summary(dynamodb_client, TABLE_NAME, "cluster-1", 1000)
+    assert claim(dynamodb_client, 1, 1001) == 1001
+
+
+def test_handler_starts_one_execution_per_generation(dynamodb_client, monkeypatch):
+    sfn_client = FakeStepFunctions()
+    clients = {"dynamodb": dynamodb_client, "stepfunctions": sfn_client}
+    monkeypatch.setattr(trigger_sfn, "get_client", clients.get)
+    monkeypatch.setenv("STATE_MACHINE_ARN", "arn:state-machine")
+    monkeypatch.setenv("ARTICLES_THRESHOLD", "5")
+    monkeypatch.setenv("DYNAMODB_TABLE_NAME", TABLE_NAME)
+    event = {
+        "Records": [
+            {
+                "eventName": "INSERT",
+                "dynamodb": {
+                    "NewImage": {"PK": {"S": "cluster-1"}, "type": {"S": "article"}}
+                },
+            }
+        ]
+    }
+
+    trigger_sfn.handler(event, None)
+    trigger_sfn.handler(event, None)
+    assert len(sfn_client.names) == 1
+    assert sfn_client.names[0].startswith("cluster-1-1-")